@@ -3,4 +3,8 @@ from app import create_app
 app = create_app()
 
 if __name__ == "__main__":
+    from app.migrations import init_database
+
+    with app.app_context():
+        init_database()
     app.run(debug=True)
@@ -6,12 +6,21 @@ from flask_wtf.csrf import generate_csrf
 import os
 from .config import Config
 from flask_mail import Mail
-from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from .cache import LRUCache
+from .engine import configure_engine, engine_options, normalize_database_uri
+from .uploads import StreamingRequest, UploadRejected, handle_upload_rejected
+from .ratelimit import RateLimited, check_rate_limits, handle_rate_limited
+from .security import DEFAULT_PASSWORD_HASH_METHOD, normalize_hash_method
+from .state import get_state_store
 
 _db = SQLAlchemy()
 _login_manager = LoginManager()
 _csrf = CSRFProtect()
 _mail = Mail()
+_note_cache = LRUCache()
+_identity_cache = LRUCache()
+_tag_cache = LRUCache()
 
 
 def get_db():
@@ -30,19 +39,62 @@ def get_mail():
     return _mail
 
 
-def create_app():
+def get_note_cache():
+    return _note_cache
+
+
+def get_identity_cache():
+    return _identity_cache
+
+
+def get_tag_cache():
+    return _tag_cache
+
+
+def create_app(config=None):
     app = Flask(__name__, instance_relative_config=True)
+    app.request_class = StreamingRequest
     app.config.from_object(Config)
+    if config:
+        app.config.from_mapping(config)
 
     os.makedirs(app.instance_path, exist_ok=True)
     os.makedirs(os.path.join(app.instance_path, "uploads"), exist_ok=True)
 
+    proxies = {key: app.config.get(f"PROXY_FIX_X_{key.upper()}", 0) for key in ("for", "proto", "host")}
+    if any(proxies.values()):
+        app.wsgi_app = ProxyFix(app.wsgi_app, **{f"x_{key}": n for key, n in proxies.items()})
+
+    method = app.config.get("PASSWORD_HASH_METHOD") or DEFAULT_PASSWORD_HASH_METHOD
+    try:
+        normalize_hash_method(method)
+    except ValueError as exc:
+        # Otherwise every login would fail on the first hash
+        raise RuntimeError(f"Invalid PASSWORD_HASH_METHOD: {method}") from exc
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = normalize_database_uri(app.config["SQLALCHEMY_DATABASE_URI"])
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
     _db.init_app(app)
     _login_manager.init_app(app)
+    # Registered before CSRF so rejected requests never have their body parsed
+    app.before_request(check_rate_limits)
     _csrf.init_app(app)
     _mail.init_app(app)
+    _note_cache.configure(max_bytes=app.config.get("NOTE_CACHE_MAX_MB", 0) * 1024 * 1024)
+    # Sized in entries: identities and tag ids are put with size 1
+    _identity_cache.configure(max_bytes=app.config.get("IDENTITY_CACHE_SIZE", 0))
+    _tag_cache.configure(max_bytes=app.config.get("TAG_CACHE_SIZE", 0))
 
     _login_manager.login_view = "auth.login"
+    app.register_error_handler(UploadRejected, handle_upload_rejected)
+    app.register_error_handler(RateLimited, handle_rate_limited)
+
+    from .workers import start_workers
+
+    @app.before_request
+    def ensure_workers():
+        # Started lazily so CLI commands and imports don't spawn threads
+        start_workers(app)
 
     @app.context_processor
     def inject_globals():
@@ -56,32 +108,27 @@ def create_app():
     from .auth.routes import auth_bp
     from .notes.routes import notes_bp
     from .drive import drive_bp
-    try:
-        from .admin.routes import admin_bp
-    except Exception:
-        admin_bp = None
+    from .admin.routes import admin_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(notes_bp)
     app.register_blueprint(drive_bp)
-    if admin_bp:
-        app.register_blueprint(admin_bp)
-
+    app.register_blueprint(admin_bp)
+
+    from .perf import perf_cli
+    app.cli.add_command(perf_cli)
+    from .blobs import blobs_cli
+    app.cli.add_command(blobs_cli)
+    from .jobs import jobs_cli
+    app.cli.add_command(jobs_cli)
+    from .migrations import db_cli, init_command
+    app.cli.add_command(db_cli)
+    app.cli.add_command(init_command)
+
+    # No database round-trips here: the schema and the first admin are set up once by `flask init`
     with app.app_context():
-        from . import models  # noqa: F401
-        _db.create_all()
-        # Secure bootstrap admin if configured and no users exist
-        from .models import User
-        if User.query.count() == 0:
-            admin_email = os.getenv('ADMIN_EMAIL')
-            admin_password = os.getenv('ADMIN_PASSWORD')
-            if admin_email and admin_password:
-                u = User(email=admin_email.strip().lower(), is_admin=True)
-                u.set_password(admin_password)
-                _db.session.add(u)
-                try:
-                    _db.session.commit()
-                except IntegrityError:
-                    _db.session.rollback()
+        configure_engine(_db.engine, app.config)
+        # Fails here, not on the first login, when STATE_STORE_URL cannot work
+        get_state_store()
 
     return app
@@ -1,9 +1,19 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy import delete, select, update
 from sqlalchemy.exc import IntegrityError
 
-from .. import get_db
-from ..models import User
+from .. import get_db, get_note_cache, get_identity_cache, get_tag_cache
+from ..models import (
+    User, Note, Group, Attachment, DriveFile, DriveFolder, DriveShare, DriveUsage, NoteSearchToken,
+    UploadSession, note_tags, note_groups, drive_file_folders,
+)
+from ..blobs import dedup_stats, release_blobs, enqueue_delete
+from ..drive.resumable import chunk_keys
+from ..jobs import job_stats
+from ..mailer import get_smtp_pool
+from ..ratelimit import rate_limit_stats
+from ..identity import invalidate_identity
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -24,7 +34,21 @@ def check_admin():
 @login_required
 def index():
     users = User.query.order_by(User.created_at.desc()).all()
-    return render_template("admin/users.html", users=users)
+    return render_template("admin/users.html", users=users, blobs=dedup_stats())
+
+
+@admin_bp.get("/api/stats")
+@login_required
+def stats():
+    return jsonify({
+        "note_cache": get_note_cache().stats(),
+        "identity_cache": get_identity_cache().stats(),
+        "tag_cache": get_tag_cache().stats(),
+        "blobs": dedup_stats(),
+        "jobs": job_stats(),
+        "mail_pool": get_smtp_pool().stats(),
+        "rate_limits": rate_limit_stats(),
+    })
 
 
 @admin_bp.post("/users")
@@ -61,6 +85,7 @@ def set_quota(user_id: int):
     u.file_quota_count = int(cnt) if (cnt or '').strip() else None
     u.file_quota_mb = int(mb) if (mb or '').strip() else None
     db.session.commit()
+    invalidate_identity(u.id)
     flash("Квоты обновлены", "success")
     return redirect(url_for("admin.index"))
 
@@ -77,10 +102,50 @@ def reset_password(user_id: int):
     u = User.query.get_or_404(user_id)
     u.set_password(new_pass)
     db.session.commit()
+    invalidate_identity(u.id)
     flash("Пароль обновлён", "success")
     return redirect(url_for("admin.index"))
 
 
+def _delete_user_rows(u: User) -> None:
+    """Delete a user and everything they own with set-based statements.
+
+    Nothing is loaded into the session; stored bytes are released to the
+    purge queue and removed in the background.
+    """
+    note_ids = select(Note.id).where(Note.user_id == u.id).scalar_subquery()
+    file_ids = select(DriveFile.id).where(DriveFile.user_id == u.id).scalar_subquery()
+
+    keys = list(db.session.execute(select(DriveFile.stored_path).where(DriveFile.user_id == u.id)).scalars())
+    keys += db.session.execute(select(Attachment.stored_path).where(Attachment.note_id.in_(note_ids))).scalars()
+    if u.avatar_path:
+        keys.append(u.avatar_path)
+    release_blobs(keys)
+    for session_id, total_chunks in db.session.execute(
+        select(UploadSession.id, UploadSession.total_chunks).where(UploadSession.user_id == u.id)
+    ):
+        enqueue_delete(chunk_keys(session_id, total_chunks))
+
+    for stmt in (
+        delete(UploadSession).where(UploadSession.user_id == u.id),
+        delete(Attachment).where(Attachment.note_id.in_(note_ids)),
+        note_tags.delete().where(note_tags.c.note_id.in_(note_ids)),
+        note_groups.delete().where(note_groups.c.note_id.in_(note_ids)),
+        delete(NoteSearchToken).where(NoteSearchToken.user_id == u.id),
+        delete(Note).where(Note.user_id == u.id),
+        delete(Group).where(Group.user_id == u.id),
+        delete(DriveShare).where(DriveShare.file_id.in_(file_ids)),
+        update(DriveShare).where(DriveShare.created_by == u.id).values(created_by=None),
+        drive_file_folders.delete().where(drive_file_folders.c.file_id.in_(file_ids)),
+        delete(DriveFile).where(DriveFile.user_id == u.id),
+        delete(DriveFolder).where(DriveFolder.user_id == u.id),
+        delete(DriveUsage).where(DriveUsage.user_id == u.id),
+        delete(User).where(User.id == u.id),
+    ):
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+    db.session.expunge(u)
+
+
 @admin_bp.post("/users/<int:user_id>/delete")
 @login_required
 def delete_user(user_id: int):
@@ -90,7 +155,8 @@ def delete_user(user_id: int):
         flash("Нельзя удалить себя", "danger")
         return redirect(url_for("admin.index"))
     u = User.query.get_or_404(user_id)
-    db.session.delete(u)
+    _delete_user_rows(u)
     db.session.commit()
+    invalidate_identity(user_id)
     flash("Пользователь удалён", "success")
     return redirect(url_for("admin.index"))
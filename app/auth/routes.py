@@ -1,26 +1,40 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy.exc import IntegrityError
-import os
-import uuid
+import hmac
 import random
-from datetime import datetime, timedelta
+from datetime import datetime
 import mimetypes
-from flask_mail import Message
 
-from .. import get_db, get_login_manager, get_mail
+from .. import get_db, get_login_manager
 from ..models import User
+from ..downloads import send_stored_file
+from ..blobs import store_upload, release_blob
+from ..storage import get_storage
+from ..mailer import mail_enabled, queue_mail
+from ..state import get_state_store
+from ..ratelimit import rate_limit
+from ..identity import load_identity, invalidate_identity
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 db = get_db()
 login_manager = get_login_manager()
-mail = get_mail()
+
+OTP_TTL = 10 * 60
+OTP_SEND_WINDOW = 60 * 60
+OTP_MAX_SENDS = 5
+OTP_MAX_FAILS = 5
+OTP_LOCK_TTL = 15 * 60
+
+
+def _otp_keys(user_id: int):
+    return (f"otp:code:{user_id}", f"otp:sends:{user_id}", f"otp:fails:{user_id}", f"otp:lock:{user_id}")
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_identity(int(user_id))
 
 
 @auth_bp.get("/login")
@@ -29,6 +43,7 @@ def login():
 
 
 @auth_bp.post("/login")
+@rate_limit("login", "20/minute")
 def login_post():
     email = request.form.get("email", "").strip().lower()
     password = request.form.get("password", "")
@@ -37,35 +52,28 @@ def login_post():
     if not user or not user.check_password(password):
         flash("Неверные учетные данные", "danger")
         return redirect(url_for("auth.login"))
+    if user.rehash_password(password):
+        db.session.commit()
 
-    now = datetime.utcnow()
-    if user.otp_locked_until and now < user.otp_locked_until:
-        remain = int((user.otp_locked_until - now).total_seconds() // 60) + 1
+    store = get_state_store()
+    code_key, sends_key, _, lock_key = _otp_keys(user.id)
+    locked_for = store.ttl(lock_key)
+    if locked_for is not None:
+        remain = locked_for // 60 + 1
         flash(f"Аккаунт временно заблокирован для OTP. Подождите ~{remain} мин.", "danger")
         return redirect(url_for("auth.login"))
 
-    window_start = (user.otp_last_sent_at or (now - timedelta(hours=1)))
-    if (now - window_start) <= timedelta(hours=1):
-        user.otp_send_count = (user.otp_send_count or 0) + 1
-    else:
-        user.otp_send_count = 1
-    user.otp_last_sent_at = now
-    if user.otp_send_count > 5 and not current_app.debug:
+    if store.incr(sends_key, OTP_SEND_WINDOW) > OTP_MAX_SENDS and not current_app.debug:
         flash("Слишком много попыток. Попробуйте позже.", "danger")
-        db.session.commit()
         return redirect(url_for("auth.login"))
 
     code = f"{random.randint(1000, 9999)}"
-    user.otp_code = code
-    user.otp_expires_at = datetime.utcnow() + timedelta(minutes=10)
-    db.session.commit()
-    try:
-        msg = Message(subject="Код входа", recipients=[user.email])
-        msg.body = f"Ваш код: {code}. Действителен 10 минут."
-        mail.send(msg)
+    store.set(code_key, code, OTP_TTL)
+    if mail_enabled():
+        queue_mail("Код входа", [user.email], f"Ваш код: {code}. Действителен 10 минут.")
+        db.session.commit()
         flash("Мы отправили код подтверждения на вашу почту", "success")
-    except Exception:
-
+    else:
         flash(f"Код для входа: {code} (почта не настроена)", "warning")
     return redirect(url_for("auth.verify", email=user.email))
 
@@ -88,21 +96,22 @@ def profile():
 def update_profile():
     name = (request.form.get("name") or "").strip()
     password = request.form.get("password") or ""
+    # current_user is a cached read-only identity; changes go through the row
+    user = db.session.get(User, current_user.id)
     if name:
-        current_user.name = name
+        user.name = name
     if password:
-        current_user.set_password(password)
+        user.set_password(password)
     if "avatar" in request.files:
         f = request.files["avatar"]
         if f and f.filename:
-            uploads_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], "avatars")
-            os.makedirs(uploads_dir, exist_ok=True)
-            ext = os.path.splitext(f.filename)[1]
-            safe_name = uuid.uuid4().hex + ext
-            path = os.path.join(uploads_dir, safe_name)
-            f.save(path)
-            current_user.avatar_path = path
+            old_path = user.avatar_path
+            user.avatar_path, _, _ = store_upload(f)
+            user.avatar_mime = mimetypes.guess_type(f.filename)[0] or f.mimetype or None
+            if old_path:
+                release_blob(old_path)
     db.session.commit()
+    invalidate_identity(user.id)
     flash("Профиль обновлен", "success")
     return redirect(url_for("auth.profile"))
 
@@ -111,10 +120,11 @@ def update_profile():
 @login_required
 def user_avatar(user_id: int):
     u = User.query.get_or_404(user_id)
-    if not u.avatar_path or not os.path.exists(u.avatar_path):
+    if not u.avatar_path or not get_storage().exists(u.avatar_path):
         return ("", 404)
-    mime = mimetypes.guess_type(u.avatar_path)[0] or 'image/jpeg'
-    return send_file(u.avatar_path, mimetype=mime)
+    # Avatars uploaded before avatar_mime existed kept their extension in the path
+    mime = u.avatar_mime or mimetypes.guess_type(u.avatar_path)[0] or 'image/jpeg'
+    return send_stored_file(u.avatar_path, mime, immutable=request.args.get('v') == u.avatar_version)
 
 
 @auth_bp.get('/register')
@@ -126,6 +136,7 @@ def register():
 
 
 @auth_bp.post('/register')
+@rate_limit("register", "10/hour")
 def register_post():
     if not current_app.config.get('REGISTRATION_ENABLED', True):
         flash('Регистрация отключена. Обратитесь к администратору.', 'warning')
@@ -154,31 +165,30 @@ def verify():
 
 
 @auth_bp.post('/verify')
+@rate_limit("verify", "30/minute")
 def verify_post():
     email = (request.form.get('email') or '').strip().lower()
     code = (request.form.get('code') or '').strip()
     user = User.query.filter_by(email=email).first()
-    if not user or not user.otp_code or not user.otp_expires_at:
+    store = get_state_store()
+    code_key, _, fails_key, lock_key = _otp_keys(user.id) if user else (None,) * 4
+    expected = store.get(code_key) if user else None
+    if expected is None:
         flash('Сессия подтверждения не найдена. Войдите заново.', 'danger')
         return redirect(url_for('auth.login'))
-    now = datetime.utcnow()
-    if user.otp_locked_until and now < user.otp_locked_until:
+    if store.get(lock_key) is not None:
         flash('Слишком много неверных кодов. Попробуйте позже.', 'danger')
         return redirect(url_for('auth.verify', email=email))
-    if datetime.utcnow() > user.otp_expires_at or code != user.otp_code:
-        user.otp_fail_count = (user.otp_fail_count or 0) + 1
-        if user.otp_fail_count >= 5 and not current_app.debug:
-            user.otp_locked_until = now + timedelta(minutes=15)
-            user.otp_fail_count = 0
-        db.session.commit()
+    if not hmac.compare_digest(code.encode(), expected.encode()):
+        if store.incr(fails_key, OTP_LOCK_TTL) >= OTP_MAX_FAILS and not current_app.debug:
+            store.set(lock_key, "1", OTP_LOCK_TTL)
+            store.delete(fails_key)
         flash('Неверный или просроченный код', 'danger')
         return redirect(url_for('auth.verify', email=email))
-    user.otp_code = None
-    user.otp_expires_at = None
-    user.otp_fail_count = 0
-    user.otp_locked_until = None
+    store.delete(code_key, fails_key)
+    # The only write of a login: the first successful verification
     if not user.email_verified_at:
         user.email_verified_at = datetime.utcnow()
-    db.session.commit()
+        db.session.commit()
     login_user(user)
     return redirect(url_for('notes.index'))
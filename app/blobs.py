@@ -0,0 +1,272 @@
+import os
+import re
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import get_db
+from .engine import upsert_insert
+from .models import Attachment, Blob, DriveFile, PendingDelete, User
+from .storage import get_storage
+from .uploads import upload_digest, upload_size, upload_to_temp
+
+db = get_db()
+
+# Keeps IN lists well below every backend's bound-parameter limit
+BATCH = 500
+
+blobs_cli = AppGroup("blobs", help="Content-addressed file store.")
+
+
+# Also matches absolute local paths written before storage keys were introduced
+_BLOB_KEY = re.compile(r"(?:^|/)blobs/([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})$")
+
+
+def blob_tmp_dir() -> str:
+    """Local spool directory; with local storage it shares the filesystem, so uploads are renamed in."""
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], "blobs", "tmp")
+
+
+def blob_key(sha256: str) -> str:
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def blob_digest(key: str):
+    """SHA-256 of a key inside the store, None for legacy per-upload paths."""
+    m = _BLOB_KEY.search((key or "").replace(os.sep, "/"))
+    return m.group(3) if m else None
+
+
+def _add_ref(sha256: str, size_bytes: int) -> None:
+    """One more reference to the blob, creating its row; safe against a concurrent first upload."""
+    bump = update(Blob).where(Blob.sha256 == sha256).values(ref_count=Blob.ref_count + 1)
+    upsert = upsert_insert(db.engine)
+    if upsert is not None:
+        db.session.execute(
+            upsert(Blob).values(sha256=sha256, size_bytes=size_bytes, ref_count=1)
+            .on_conflict_do_update(index_elements=[Blob.sha256], set_={"ref_count": Blob.ref_count + 1})
+        )
+        return
+    if db.session.execute(bump).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(Blob).values(sha256=sha256, size_bytes=size_bytes, ref_count=1))
+    except IntegrityError:
+        # Another upload inserted the row first
+        db.session.execute(bump)
+
+
+def store_file(tmp_path: str, sha256: str, size_bytes: int) -> str:
+    """Move a finished temp file into the store, or drop it when the content is already there.
+
+    Returns the storage key to keep in stored_path.
+    """
+    storage = get_storage()
+    key = blob_key(sha256)
+    # Reference first and cancel a pending purge, so the purge worker's re-check sees this upload
+    try:
+        _add_ref(sha256, size_bytes)
+        db.session.execute(delete(PendingDelete).where(PendingDelete.key == key))
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    if storage.exists(key):
+        os.remove(tmp_path)
+    else:
+        storage.put_file(key, tmp_path)
+    return key
+
+
+def store_upload(f):
+    """Store an uploaded FileStorage; returns (key, sha256, size)."""
+    sha256 = upload_digest(f)
+    size_bytes = upload_size(f)
+    return store_file(upload_to_temp(f, blob_tmp_dir()), sha256, size_bytes), sha256, size_bytes
+
+
+def _batches(items, size=BATCH):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def enqueue_delete(keys) -> None:
+    """Queue storage keys for the purge worker in the caller's transaction."""
+    keys = [k for k in keys if k]
+    if keys:
+        db.session.execute(insert(PendingDelete), [{"key": k} for k in keys])
+
+
+def release_blobs(keys) -> None:
+    """Drop one reference per key in the caller's transaction.
+
+    Content whose last reference goes, and legacy per-upload paths, are
+    queued for deletion; the bytes are removed by purge_pending().
+    """
+    counts = Counter()
+    doomed = []
+    for key in keys:
+        sha256 = blob_digest(key)
+        if sha256 is not None:
+            counts[sha256] += 1
+        elif key:
+            doomed.append(key)
+    if counts:
+        db.session.execute(
+            update(Blob.__table__)
+            .where(Blob.__table__.c.sha256 == bindparam("b_sha256"))
+            .values(ref_count=Blob.__table__.c.ref_count - bindparam("b_refs")),
+            [{"b_sha256": sha256, "b_refs": refs} for sha256, refs in counts.items()],
+        )
+        for batch in _batches(counts):
+            dead = db.session.execute(
+                select(Blob.sha256).where(Blob.sha256.in_(batch), Blob.ref_count <= 0)
+            ).scalars().all()
+            if dead:
+                db.session.execute(delete(Blob).where(Blob.sha256.in_(dead)))
+                doomed.extend(blob_key(sha256) for sha256 in dead)
+    enqueue_delete(doomed)
+
+
+def release_blob(key: str) -> None:
+    release_blobs([key])
+
+
+def purge_pending(batch_size: int = BATCH, grace_seconds=None):
+    """Delete one batch of queued storage objects; returns (entries processed, failures).
+
+    Each row is claimed by deleting it before the bytes go, so concurrent
+    workers never share one, and a blob referenced again since it was
+    queued is left alone. Failed deletes are queued again, after the grace
+    period; after PURGE_MAX_ATTEMPTS failures the row is parked instead.
+    """
+    if grace_seconds is None:
+        grace_seconds = int(current_app.config.get("PURGE_GRACE_SECONDS") or 0)
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    rows = db.session.execute(
+        select(PendingDelete.id, PendingDelete.key, PendingDelete.attempts)
+        .where(PendingDelete.created_at <= cutoff, PendingDelete.parked_at.is_(None))
+        .order_by(PendingDelete.id)
+        .limit(batch_size)
+    ).all()
+    claimed = []
+    for row_id, key, attempts in rows:
+        if db.session.execute(delete(PendingDelete).where(PendingDelete.id == row_id)).rowcount:
+            claimed.append((key, attempts))
+    db.session.commit()
+
+    live = set()
+    shas = [s for s in (blob_digest(key) for key, _ in claimed) if s]
+    for batch in _batches(shas):
+        live.update(db.session.execute(select(Blob.sha256).where(Blob.sha256.in_(batch))).scalars())
+
+    storage = get_storage()
+    max_attempts = int(current_app.config.get("PURGE_MAX_ATTEMPTS") or 10)
+    failed = []
+    for key, attempts in claimed:
+        if blob_digest(key) in live:
+            continue
+        try:
+            storage.delete(key)
+        except Exception:
+            current_app.logger.exception("Failed to delete stored object %s", key)
+            parked_at = None
+            if attempts + 1 >= max_attempts:
+                parked_at = datetime.utcnow()
+                current_app.logger.error("Giving up on stored object %s after %d attempts", key, attempts + 1)
+            failed.append({"key": key, "attempts": attempts + 1, "parked_at": parked_at})
+    if failed:
+        db.session.execute(insert(PendingDelete), failed)
+        db.session.commit()
+    return len(claimed), len(failed)
+
+
+def dedup_stats() -> dict:
+    blobs, refs, stored, saved = db.session.query(
+        func.count(Blob.sha256),
+        func.coalesce(func.sum(Blob.ref_count), 0),
+        func.coalesce(func.sum(Blob.size_bytes), 0),
+        func.coalesce(func.sum(Blob.size_bytes * (Blob.ref_count - 1)), 0),
+    ).one()
+    parked = db.session.execute(
+        select(func.count(PendingDelete.id)).where(PendingDelete.parked_at.is_not(None))
+    ).scalar()
+    return {"blobs": blobs, "references": refs, "stored_bytes": stored, "saved_bytes": saved,
+            "parked_deletes": parked}
+
+
+def _referenced_paths():
+    yield from db.session.execute(db.select(DriveFile.stored_path)).scalars()
+    yield from db.session.execute(db.select(Attachment.stored_path)).scalars()
+    yield from db.session.execute(db.select(User.avatar_path).where(User.avatar_path.is_not(None))).scalars()
+
+
+def reconcile_refs() -> int:
+    """Recount references from the tables that point into the store; returns how many blobs changed."""
+    actual = {}
+    for path in _referenced_paths():
+        sha256 = blob_digest(path)
+        if sha256 is not None:
+            actual[sha256] = actual.get(sha256, 0) + 1
+    fixed = 0
+    for blob in Blob.query.all():
+        count = actual.pop(blob.sha256, 0)
+        if count == 0:
+            db.session.delete(blob)
+            enqueue_delete([blob_key(blob.sha256)])
+            fixed += 1
+        elif blob.ref_count != count:
+            blob.ref_count = count
+            fixed += 1
+    for sha256, count in actual.items():
+        found = get_storage().stat(blob_key(sha256))
+        if found is not None:
+            db.session.add(Blob(sha256=sha256, size_bytes=found.size, ref_count=count))
+            fixed += 1
+    db.session.commit()
+    return fixed
+
+
+@blobs_cli.command("reconcile")
+def reconcile_command():
+    """Recompute blob reference counts and remove unreferenced blobs."""
+    fixed = reconcile_refs()
+    click.echo(f"Fixed {fixed} blobs")
+
+
+@blobs_cli.command("purge")
+@click.option("--batch-size", default=BATCH, show_default=True)
+@click.option("--all", "purge_all", is_flag=True, help="Ignore the grace period.")
+@click.option("--retry-parked", is_flag=True, help="Queue entries that failed too often again first.")
+def purge_command(batch_size: int, purge_all: bool, retry_parked: bool):
+    """Remove the bytes of deleted files from storage."""
+    if retry_parked:
+        retried = db.session.execute(
+            update(PendingDelete).where(PendingDelete.parked_at.is_not(None)).values(parked_at=None, attempts=0)
+        ).rowcount
+        db.session.commit()
+        click.echo(f"Queued {retried} parked deletes again")
+    total = failures = 0
+    while True:
+        processed, failed = purge_pending(batch_size, 0 if purge_all else None)
+        total += processed - failed
+        failures += failed
+        # Failed entries are queued again; stop rather than retry them in a tight loop
+        if processed < batch_size or failed:
+            break
+    click.echo(f"Processed {total} queued deletes, {failures} failed")
+
+
+@blobs_cli.command("stats")
+def stats_command():
+    """Show how much space deduplication saves."""
+    s = dedup_stats()
+    click.echo(f"{s['blobs']} blobs, {s['references']} references, "
+               f"{s['stored_bytes']} bytes stored, {s['saved_bytes']} bytes saved, "
+               f"{s['parked_deletes']} parked deletes")
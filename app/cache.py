@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe per-process LRU bounded by the approximate size of its values.
+
+    Entries carry an optional version; a lookup with a different version is a
+    miss and drops the stale entry. Entries put with a ttl expire after it.
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key, version=None, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version or (entry[3] is not None and entry[3] <= time.monotonic()):
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version=None, size: int = 1, ttl=None) -> None:
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            expires = time.monotonic() + ttl if ttl is not None else None
+            self._data[key] = (version, value, size, expires)
+            self._bytes += size
+            self._evict()
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _drop(self, key) -> None:
+        self._bytes -= self._data.pop(key)[2]
+
+    def _evict(self) -> None:
+        while self._data and self._bytes > self.max_bytes:
+            _, entry = self._data.popitem(last=False)
+            self._bytes -= entry[2]
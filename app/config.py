@@ -15,10 +15,52 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL") or DEFAULT_DB_URI
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite: applied to every connection (file databases only, except busy_timeout)
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    # PostgreSQL and other server databases: connection pool per process
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
     UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER") or DEFAULT_UPLOADS
     SECURE_ENCRYPTION_KEY = os.getenv("SECURE_ENCRYPTION_KEY")
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50 MB
     MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "20"))
+    STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # local | s3
+    S3_BUCKET = os.getenv("S3_BUCKET")
+    S3_PREFIX = os.getenv("S3_PREFIX", "")
+    S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # MinIO and other S3-compatible stores
+    S3_REGION = os.getenv("S3_REGION")
+    S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID")
+    S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY")
+    STORAGE_PRESIGN_SECONDS = int(os.getenv("STORAGE_PRESIGN_SECONDS", "300"))
+    # memory:// keeps state per process and is only correct with a single worker;
+    # run several workers with redis://host:6379/0. database:// (the app database) is
+    # shared too, but costs a write transaction per counted request
+    STATE_STORE_URL = os.getenv("STATE_STORE_URL", "memory://")
+    # Trusted proxies in front of the app (nginx: 1); the client address, which per-IP
+    # rate limits key on, is then taken from X-Forwarded-For
+    PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", "0"))
+    PROXY_FIX_X_PROTO = int(os.getenv("PROXY_FIX_X_PROTO", "0"))
+    PROXY_FIX_X_HOST = int(os.getenv("PROXY_FIX_X_HOST", "0"))
+    RATE_LIMITS_ENABLED = os.getenv("RATE_LIMITS_ENABLED", "1") == "1"
+    RATE_LIMITS = {}  # name -> "N/unit", overrides the defaults on the routes
+    BACKGROUND_WORKERS = os.getenv("BACKGROUND_WORKERS", "1") == "1"
+    PURGE_INTERVAL_SECONDS = int(os.getenv("PURGE_INTERVAL_SECONDS", "30"))
+    # Deleted content stays this long so an upload racing the delete can still reference it
+    PURGE_GRACE_SECONDS = int(os.getenv("PURGE_GRACE_SECONDS", "600"))
+    PURGE_MAX_ATTEMPTS = int(os.getenv("PURGE_MAX_ATTEMPTS", "10"))
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+    JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "20"))
+    # Seconds before an edited note's search tokens are rebuilt; edits in between share one rebuild (0: inline)
+    NOTE_REINDEX_DELAY_SECONDS = float(os.getenv("NOTE_REINDEX_DELAY_SECONDS", "5"))
+    FILE_DELIVERY = os.getenv("FILE_DELIVERY", "send_file")  # send_file | x-sendfile | x-accel-redirect
+    X_ACCEL_REDIRECT_PREFIX = os.getenv("X_ACCEL_REDIRECT_PREFIX", "/_protected/")
     ALLOWED_EXTENSIONS = (os.getenv("ALLOWED_EXTENSIONS",
         "jpg,jpeg,png,gif,webp,pdf,txt,md,doc,docx,xls,xlsx,ppt,pptx,mp3,wav,ogg,mp4,mov,webm,zip,rar,7z"
     )).split(',')
@@ -28,6 +70,22 @@ class Config:
     MAIL_USERNAME = os.getenv("MAIL_USERNAME")
     MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
     MAIL_DEFAULT_SENDER = os.getenv("MAIL_DEFAULT_SENDER", os.getenv("MAIL_USERNAME", "no-reply@example.com"))
+    MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "2"))
+    MAIL_POOL_RECYCLE_SECONDS = int(os.getenv("MAIL_POOL_RECYCLE_SECONDS", "300"))
+    MAIL_POOL_MAX_MESSAGES = int(os.getenv("MAIL_POOL_MAX_MESSAGES", "100"))
+    # Without mail the OTP code is shown on the login page (development)
+    MAIL_ENABLED = os.getenv("MAIL_ENABLED", "1" if os.getenv("MAIL_USERNAME") else "0") == "1"
     DEFAULT_USER_FILE_QUOTA_COUNT = int(os.getenv("DEFAULT_USER_FILE_QUOTA_COUNT", "200"))
     DEFAULT_USER_FILE_QUOTA_MB = int(os.getenv("DEFAULT_USER_FILE_QUOTA_MB", "500"))
+    DRIVE_UPLOAD_CHUNK_MB = int(os.getenv("DRIVE_UPLOAD_CHUNK_MB", "5"))
+    DRIVE_UPLOAD_SESSION_HOURS = int(os.getenv("DRIVE_UPLOAD_SESSION_HOURS", "24"))
+    NOTE_CACHE_MAX_MB = int(os.getenv("NOTE_CACHE_MAX_MB", "32"))
+    # Werkzeug method string: scrypt:N:r:p or pbkdf2:sha256:iterations; older hashes are
+    # upgraded on the next successful login
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    # Logged-in user records cached per process; changes made elsewhere show up after the TTL
+    IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "10000"))
+    IDENTITY_CACHE_SECONDS = int(os.getenv("IDENTITY_CACHE_SECONDS", "30"))
+    # Tag name -> id per process; tags are never renamed or deleted, so entries never go stale
+    TAG_CACHE_SIZE = int(os.getenv("TAG_CACHE_SIZE", "10000"))
     REGISTRATION_ENABLED = os.getenv("REGISTRATION_ENABLED", "1") == "1"
@@ -0,0 +1,101 @@
+import os
+from urllib.parse import quote
+
+from flask import current_app, redirect, request, send_file
+from werkzeug.http import is_resource_modified
+from werkzeug.utils import send_file as _werkzeug_send_file
+
+from .storage import get_storage
+
+# Long enough to count as forever for content behind a versioned URL
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+DELIVERY_SEND_FILE = "send_file"
+DELIVERY_X_SENDFILE = "x-sendfile"
+DELIVERY_X_ACCEL = "x-accel-redirect"
+
+
+def send_stored_file(key, mimetype, download_name=None, digest=None, last_modified=None, immutable=False):
+    """send_file with conditional GET and byte ranges for a storage key.
+
+    A stored SHA-256 becomes a strong ETag; rows without one fall back to
+    Werkzeug's mtime/size tag. Immutable responses may be cached for a
+    year by the browser only, since every file here is behind a login.
+    With FILE_DELIVERY set to a proxy mode the bytes are left to the
+    front proxy and only the headers are produced here. Backends without
+    a local disk redirect to a short-lived presigned URL instead.
+    """
+    storage = get_storage()
+    path = storage.local_path(key)
+    if path is None:
+        url = storage.presign(key, int(current_app.config.get("STORAGE_PRESIGN_SECONDS") or 300),
+                              download_name=download_name, mimetype=mimetype)
+        resp = redirect(url)
+        resp.headers["Cache-Control"] = "private, no-store"
+        return resp
+    mode = current_app.config.get("FILE_DELIVERY") or DELIVERY_SEND_FILE
+    if mode in (DELIVERY_X_SENDFILE, DELIVERY_X_ACCEL):
+        resp = _proxy_response(mode, path, mimetype, download_name, digest, last_modified, immutable)
+        if resp is not None:
+            return resp
+    resp = send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=False,
+        download_name=download_name,
+        etag=digest or True,
+        last_modified=last_modified,
+        max_age=IMMUTABLE_MAX_AGE if immutable else None,
+        conditional=True,
+    )
+    # Werkzeug only advertises ranges when answering one; media players look for it up front
+    resp.headers.setdefault("Accept-Ranges", "bytes")
+    return _apply_cache_policy(resp, immutable)
+
+
+def _accel_uri(path):
+    root = os.path.abspath(current_app.config["UPLOAD_FOLDER"])
+    rel = os.path.relpath(os.path.abspath(path), root)
+    if rel.startswith(os.pardir):
+        return None
+    prefix = (current_app.config.get("X_ACCEL_REDIRECT_PREFIX") or "/_protected/").rstrip("/")
+    return f"{prefix}/{quote(rel.replace(os.sep, '/'))}"
+
+
+def _proxy_response(mode, path, mimetype, download_name, digest, last_modified, immutable):
+    """Header-only response for the proxy, or None when the file lies outside the mapped root."""
+    accel_uri = _accel_uri(path) if mode == DELIVERY_X_ACCEL else None
+    if mode == DELIVERY_X_ACCEL and accel_uri is None:
+        return None
+    # Ranges are served by the proxy; conditionals are answered here against our own ETag
+    resp = _werkzeug_send_file(
+        path,
+        request.environ,
+        mimetype=mimetype,
+        as_attachment=False,
+        download_name=download_name,
+        conditional=False,
+        etag=digest or True,
+        last_modified=last_modified,
+        max_age=IMMUTABLE_MAX_AGE if immutable else None,
+        use_x_sendfile=True,
+        response_class=current_app.response_class,
+    )
+    if accel_uri is not None:
+        del resp.headers["X-Sendfile"]
+        resp.headers["X-Accel-Redirect"] = accel_uri
+    etag, _ = resp.get_etag()
+    if not is_resource_modified(request.environ, etag=etag, last_modified=resp.last_modified):
+        resp.status_code = 304
+        resp.headers.pop("X-Sendfile", None)
+        resp.headers.pop("X-Accel-Redirect", None)
+        resp.headers.pop("Content-Length", None)
+    return _apply_cache_policy(resp, immutable)
+
+
+def _apply_cache_policy(resp, immutable):
+    if immutable:
+        resp.cache_control.public = None
+        resp.cache_control.private = True
+        resp.cache_control.immutable = True
+    return resp
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import tempfile
+import uuid
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import click
+from flask import request, jsonify, current_app, abort
+from flask_login import login_required, current_user
+
+from .. import get_db
+from . import drive_bp
+from ..models import UploadSession
+from ..uploads import UploadLimit, UploadRejected, max_file_bytes
+from .usage import get_usage
+from ..blobs import blob_tmp_dir, store_file, enqueue_delete
+from ..storage import get_storage
+from ..ratelimit import rate_limit
+from .routes import _user_quota_limits, _create_drive_file
+
+db = get_db()
+
+READ_BLOCK = 64 * 1024
+
+
+def _chunk_key(session_id: str, index: int) -> str:
+    # Chunks go through the storage backend so any node can take the next one
+    return f"chunks/{session_id}/{index}.part"
+
+
+def chunk_keys(session_id: str, total_chunks: int) -> list:
+    return [_chunk_key(session_id, i) for i in range(total_chunks)]
+
+
+def _chunk_length(s: UploadSession, index: int) -> int:
+    return max(0, min(s.chunk_size, s.size_bytes - index * s.chunk_size))
+
+
+def _received(s: UploadSession) -> list:
+    storage = get_storage()
+    return [i for i in range(s.total_chunks) if storage.exists(_chunk_key(s.id, i))]
+
+
+def _session_json(s: UploadSession) -> dict:
+    return {
+        "id": s.id,
+        "filename": s.filename,
+        "size": s.size_bytes,
+        "chunk_size": s.chunk_size,
+        "total_chunks": s.total_chunks,
+        "received": _received(s),
+        "expires_at": s.expires_at.isoformat(),
+    }
+
+
+def _get_session(session_id: str) -> UploadSession:
+    s = UploadSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
+    if datetime.utcnow() > s.expires_at:
+        _discard(s)
+        db.session.commit()
+        abort(410)
+    return s
+
+
+def _discard(s: UploadSession) -> None:
+    enqueue_delete(chunk_keys(s.id, s.total_chunks))
+    db.session.delete(s)
+
+
+def _check_quota(size_bytes: int) -> None:
+    used_count, used_bytes = get_usage(current_user.id)
+    count_limit, mb_limit = _user_quota_limits()
+    if count_limit is not None and used_count >= count_limit:
+        raise UploadRejected("count quota exceeded", 403)
+    if mb_limit is not None and used_bytes + size_bytes > mb_limit * 1024 * 1024:
+        raise UploadRejected("size quota exceeded", 403)
+
+
+def cleanup_expired_uploads(user_id=None) -> int:
+    q = UploadSession.query.filter(UploadSession.expires_at < datetime.utcnow())
+    if user_id is not None:
+        q = q.filter_by(user_id=user_id)
+    expired = q.all()
+    for s in expired:
+        _discard(s)
+    db.session.commit()
+    return len(expired)
+
+
+@drive_bp.post("/api/uploads")
+@login_required
+@rate_limit("drive-upload", "60/minute", per="user")
+def init_upload():
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "object required"}), 400
+    filename = data.get("filename")
+    filename = filename.strip() if isinstance(filename, str) else ""
+    size_bytes = data.get("size")
+    if not filename:
+        return jsonify({"error": "empty filename"}), 400
+    if not isinstance(size_bytes, int) or isinstance(size_bytes, bool) or size_bytes < 0:
+        return jsonify({"error": "size required"}), 400
+    if not isinstance(data.get("sha256") or "", str) or not isinstance(data.get("mime_type") or "", str):
+        return jsonify({"error": "invalid field type"}), 400
+    folder_id = data.get("folder_id")
+    if folder_id is not None and (not isinstance(folder_id, int) or isinstance(folder_id, bool)):
+        return jsonify({"error": "invalid folder_id"}), 400
+    limit = UploadLimit(blob_tmp_dir(), max_file_bytes(),
+                        allowed_extensions=current_app.config.get("ALLOWED_EXTENSIONS"))
+    limit.check_filename(filename)
+    limit.check_size(size_bytes)
+    _check_quota(size_bytes)
+
+    cleanup_expired_uploads(current_user.id)
+    chunk_size = int(current_app.config.get("DRIVE_UPLOAD_CHUNK_MB") or 5) * 1024 * 1024
+    s = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        filename=filename,
+        mime_type=data.get("mime_type") or None,
+        size_bytes=size_bytes,
+        chunk_size=chunk_size,
+        total_chunks=max(1, -(-size_bytes // chunk_size)),
+        folder_id=folder_id or None,
+        sha256=(data.get("sha256") or "").lower() or None,
+        expires_at=datetime.utcnow() + timedelta(hours=int(current_app.config.get("DRIVE_UPLOAD_SESSION_HOURS") or 24)),
+    )
+    db.session.add(s)
+    db.session.commit()
+    return jsonify(_session_json(s)), 201
+
+
+@drive_bp.get("/api/uploads/<session_id>")
+@login_required
+def upload_status(session_id: str):
+    return jsonify(_session_json(_get_session(session_id)))
+
+
+@drive_bp.put("/api/uploads/<session_id>/chunks/<int:index>")
+@login_required
+@rate_limit("drive-chunk", "600/minute", per="user")
+def upload_chunk(session_id: str, index: int):
+    s = _get_session(session_id)
+    if index < 0 or index >= s.total_chunks:
+        return jsonify({"error": "chunk out of range"}), 400
+    expected = _chunk_length(s, index)
+    digest = hashlib.sha256()
+    os.makedirs(blob_tmp_dir(), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=blob_tmp_dir(), prefix=f".{s.id}-{index}-")
+    try:
+        received = 0
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = request.stream.read(READ_BLOCK)
+                if not block:
+                    break
+                received += len(block)
+                if received > expected:
+                    break
+                digest.update(block)
+                out.write(block)
+        if received != expected:
+            return jsonify({"error": "chunk size mismatch", "expected": expected}), 400
+        checksum = (request.headers.get("X-Chunk-Sha256") or "").lower()
+        if checksum and checksum != digest.hexdigest():
+            return jsonify({"error": "checksum mismatch"}), 400
+        get_storage().put_file(_chunk_key(s.id, index), tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return jsonify({"ok": True, "index": index, "sha256": digest.hexdigest()})
+
+
+@drive_bp.post("/api/uploads/<session_id>/complete")
+@login_required
+def complete_upload(session_id: str):
+    s = _get_session(session_id)
+    received = set(_received(s))
+    missing = [i for i in range(s.total_chunks) if i not in received]
+    if missing:
+        return jsonify({"error": "missing chunks", "missing": missing}), 409
+    _check_quota(s.size_bytes)
+
+    tmp_dir = blob_tmp_dir()
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for i in range(s.total_chunks):
+                with closing(get_storage().open(_chunk_key(s.id, i))) as part:
+                    for block in iter(lambda: part.read(READ_BLOCK), b""):
+                        digest.update(block)
+                        out.write(block)
+        if s.sha256 and s.sha256 != digest.hexdigest():
+            return jsonify({"error": "checksum mismatch"}), 400
+        stored_path = store_file(tmp_path, digest.hexdigest(), s.size_bytes)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    df = _create_drive_file(s.filename, stored_path, s.mime_type, s.size_bytes, digest.hexdigest(), s.folder_id)
+    _discard(s)
+    db.session.commit()
+    return jsonify({"id": df.id, "filename": df.filename, "mime_type": df.mime_type, "size": df.size_bytes}), 201
+
+
+@drive_bp.delete("/api/uploads/<session_id>")
+@login_required
+def abort_upload(session_id: str):
+    s = UploadSession.query.filter_by(id=session_id, user_id=current_user.id).first_or_404()
+    _discard(s)
+    db.session.commit()
+    return jsonify({"ok": True})
+
+
+@drive_bp.cli.command("cleanup-uploads")
+def cleanup_uploads_command():
+    """Delete expired resumable upload sessions and their chunks."""
+    removed = cleanup_expired_uploads()
+    click.echo(f"Removed {removed} expired upload sessions")
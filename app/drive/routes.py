@@ -1,14 +1,21 @@
-import os
 import mimetypes
 import uuid
 from datetime import datetime, timedelta
 
-from flask import render_template, request, jsonify, current_app, send_file, abort
+import click
+
+from flask import render_template, request, jsonify, current_app, abort
 from flask_login import login_required, current_user
+from sqlalchemy import exists, func
 
 from .. import get_db
 from . import drive_bp
 from ..models import DriveFile, DriveFolder, drive_file_folders, DriveShare
+from .usage import get_usage, adjust_usage, reconcile_usage
+from ..uploads import UploadLimit, UploadRejected, streaming_upload, max_file_bytes, upload_size
+from ..blobs import blob_tmp_dir, store_upload, release_blob
+from ..downloads import send_stored_file
+from ..ratelimit import rate_limit
 
 db = get_db()
 
@@ -21,12 +28,6 @@ def _user_quota_limits():
     return count_limit, mb_limit
 
 
-def _user_usage():
-    files = DriveFile.query.filter_by(user_id=current_user.id).all()
-    total_size = sum((f.size_bytes or 0) for f in files)
-    return len(files), total_size
-
-
 @drive_bp.get("/")
 @login_required
 def index():
@@ -44,27 +45,29 @@ def list_files():
     folders_q = DriveFolder.query.filter_by(user_id=current_user.id, parent_id=folder_id).order_by(DriveFolder.name.asc())
     folders = [{"id": d.id, "name": d.name} for d in folders_q.all()]
     files_q = DriveFile.query.filter_by(user_id=current_user.id)
+    if folder_id:
+        files_q = files_q.join(drive_file_folders, drive_file_folders.c.file_id == DriveFile.id).filter(
+            drive_file_folders.c.folder_id == folder_id
+        )
+    else:
+        files_q = files_q.filter(~exists().where(drive_file_folders.c.file_id == DriveFile.id))
+    if q:
+        files_q = files_q.filter(func.lower(DriveFile.filename).contains(q, autoescape=True))
     if sort == 'name':
-        files_q = files_q.order_by(DriveFile.filename.asc())
+        files_q = files_q.order_by(DriveFile.filename.asc(), DriveFile.id.asc())
     elif sort == 'size':
-        files_q = files_q.order_by(DriveFile.size_bytes.desc())
+        files_q = files_q.order_by(DriveFile.size_bytes.desc(), DriveFile.id.desc())
     else:
-        files_q = files_q.order_by(DriveFile.uploaded_at.desc())
-    items = []
-    for f in files_q.paginate(page=page, per_page=per_page, error_out=False).items:
-        fid = f.folder.id if f.folder else None
-        if fid != folder_id:
-            continue
-        if q and (q not in (f.filename or "").lower()):
-            continue
-        items.append({
-            "id": f.id,
-            "filename": f.filename,
-            "mime_type": f.mime_type,
-            "size": f.size_bytes,
-            "uploaded_at": f.uploaded_at.isoformat(),
-        })
-    used_count, used_bytes = _user_usage()
+        files_q = files_q.order_by(DriveFile.uploaded_at.desc(), DriveFile.id.desc())
+    pagination = files_q.paginate(page=page, per_page=per_page, error_out=False)
+    items = [{
+        "id": f.id,
+        "filename": f.filename,
+        "mime_type": f.mime_type,
+        "size": f.size_bytes,
+        "uploaded_at": f.uploaded_at.isoformat(),
+    } for f in pagination.items]
+    used_count, used_bytes = get_usage(current_user.id)
     count_limit, mb_limit = _user_quota_limits()
     breadcrumbs = []
     cur = DriveFolder.query.get(folder_id) if folder_id else None
@@ -78,69 +81,59 @@ def list_files():
         "usage": {"count": used_count, "bytes": used_bytes},
         "limits": {"count": count_limit, "mb": mb_limit},
         "breadcrumbs": breadcrumbs,
-        "pagination": {"page": page, "per_page": per_page}
+        "pagination": {"page": page, "per_page": per_page, "total": pagination.total, "pages": pagination.pages}
     })
 
 
-@drive_bp.post("/api/files")
-@login_required
-def upload_file():
-    if "file" not in request.files:
-        return jsonify({"error": "file required"}), 400
-    f = request.files["file"]
-    if not f.filename:
-        return jsonify({"error": "empty filename"}), 400
-
-    used_count, used_bytes = _user_usage()
+def _drive_upload_limit():
+    used_count, used_bytes = get_usage(current_user.id)
     count_limit, mb_limit = _user_quota_limits()
     if count_limit is not None and used_count >= count_limit:
-        return jsonify({"error": "count quota exceeded"}), 403
-
-    uploads_root = current_app.config["UPLOAD_FOLDER"]
-    user_dir = os.path.join(uploads_root, "drive", str(current_user.id))
-    os.makedirs(user_dir, exist_ok=True)
-    ext = os.path.splitext(f.filename)[1]
-    safe_name = uuid.uuid4().hex + ext
-    stored_path = os.path.join(user_dir, safe_name)
-    ext = os.path.splitext(f.filename)[1]
-    allowed = set((current_app.config.get("ALLOWED_EXTENSIONS") or []))
-    ext_lower = (ext[1:] if ext.startswith('.') else ext).lower()
-    if allowed and ext_lower not in allowed:
-        return jsonify({"error": "type not allowed"}), 415
-    f.save(stored_path)
-    size_bytes = os.path.getsize(stored_path)
-    max_mb = int(current_app.config.get("MAX_FILE_SIZE_MB") or 20)
-    if size_bytes > max_mb * 1024 * 1024:
-        try:
-            os.remove(stored_path)
-        except Exception:
-            pass
-        return jsonify({"error": "file too large"}), 413
-
-    if mb_limit is not None:
-        new_total_mb = (used_bytes + size_bytes) / (1024 * 1024)
-        if new_total_mb > mb_limit:
-            try:
-                os.remove(stored_path)
-            except Exception:
-                pass
-            return jsonify({"error": "size quota exceeded"}), 403
+        raise UploadRejected("count quota exceeded", 403)
+    quota_bytes = None if mb_limit is None else max(0, mb_limit * 1024 * 1024 - used_bytes)
+    return UploadLimit(blob_tmp_dir(), max_file_bytes(), quota_bytes, current_app.config.get("ALLOWED_EXTENSIONS"))
+
 
+def _create_drive_file(filename, stored_path, mime_type, size_bytes, sha256, folder_id=None):
     df = DriveFile(
         user_id=current_user.id,
-        filename=f.filename,
+        filename=filename,
         stored_path=stored_path,
-        mime_type=f.mimetype,
+        mime_type=mime_type,
         size_bytes=size_bytes,
+        sha256=sha256,
         uploaded_at=datetime.utcnow(),
     )
     db.session.add(df)
-    folder_id = request.args.get("folder_id", type=int)
+    db.session.flush()
+    adjust_usage(current_user.id, 1, size_bytes)
     if folder_id:
         folder = DriveFolder.query.filter_by(id=folder_id, user_id=current_user.id).first()
         if folder:
-            db.session.flush()
             db.session.execute(drive_file_folders.insert().values(file_id=df.id, folder_id=folder.id))
+    return df
+
+
+@drive_bp.post("/api/files")
+@login_required
+@rate_limit("drive-upload", "60/minute", per="user")
+@streaming_upload(_drive_upload_limit)
+def upload_file():
+    if "file" not in request.files:
+        return jsonify({"error": "file required"}), 400
+    f = request.files["file"]
+    if not f.filename:
+        return jsonify({"error": "empty filename"}), 400
+
+    # Limits were enforced while the body streamed in; check again in case
+    # another upload of this user finished in the meantime
+    limit = _drive_upload_limit()
+    limit.check_filename(f.filename)
+    limit.check_size(upload_size(f))
+    stored_path, sha256, size_bytes = store_upload(f)
+
+    df = _create_drive_file(f.filename, stored_path, f.mimetype, size_bytes, sha256,
+                            request.args.get("folder_id", type=int))
     db.session.commit()
     return jsonify({"id": df.id, "filename": df.filename, "mime_type": df.mime_type, "size": df.size_bytes}), 201
 
@@ -152,17 +145,18 @@ def download_file(file_id: int):
     if f.user_id != current_user.id and not current_user.is_admin:
         abort(404)
     mime = f.mime_type or mimetypes.guess_type(f.filename)[0] or "application/octet-stream"
-    return send_file(f.stored_path, mimetype=mime, as_attachment=False, download_name=f.filename)
+    return send_stored_file(f.stored_path, mime, f.filename, digest=f.sha256, last_modified=f.uploaded_at)
 
 
 @drive_bp.get('/s/<token>')
+@rate_limit("share", "60/minute")
 def shared_download(token: str):
     share = DriveShare.query.filter_by(token=token).first_or_404()
     if datetime.utcnow() > share.expires_at:
         abort(410)
     f = share.file
     mime = f.mime_type or mimetypes.guess_type(f.filename)[0] or "application/octet-stream"
-    return send_file(f.stored_path, mimetype=mime, as_attachment=False, download_name=f.filename)
+    return send_stored_file(f.stored_path, mime, f.filename, digest=f.sha256, last_modified=f.uploaded_at)
 
 
 @drive_bp.delete("/api/files/<int:file_id>")
@@ -171,12 +165,10 @@ def delete_file(file_id: int):
     f = DriveFile.query.get_or_404(file_id)
     if f.user_id != current_user.id and not current_user.is_admin:
         abort(404)
-    try:
-        if os.path.exists(f.stored_path):
-            os.remove(f.stored_path)
-    except Exception:
-        pass
     db.session.delete(f)
+    db.session.flush()
+    release_blob(f.stored_path)
+    adjust_usage(f.user_id, -1, -(f.size_bytes or 0))
     db.session.commit()
     return jsonify({"ok": True})
 
@@ -270,3 +262,10 @@ def move_file(file_id: int):
     return jsonify({'ok': True})
 
 
+
+
+@drive_bp.cli.command("reconcile-usage")
+def reconcile_usage_command():
+    """Recompute per-user drive usage counters from the files table."""
+    fixed = reconcile_usage()
+    click.echo(f"Fixed {fixed} usage counters")
@@ -0,0 +1,69 @@
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from .. import get_db
+from ..engine import upsert_insert
+from ..models import DriveFile, DriveUsage
+
+db = get_db()
+
+
+def _aggregate(user_id: int):
+    return db.session.query(
+        func.count(DriveFile.id), func.coalesce(func.sum(DriveFile.size_bytes), 0)
+    ).filter(DriveFile.user_id == user_id).one()
+
+
+def get_usage(user_id: int):
+    """(file count, total bytes) from the maintained counter, or an aggregate before the first write."""
+    row = db.session.get(DriveUsage, user_id)
+    if row is None:
+        return tuple(_aggregate(user_id))
+    return row.file_count, row.total_bytes
+
+
+def adjust_usage(user_id: int, files: int, size_bytes: int) -> None:
+    """Apply a delta in the caller's transaction, after the DriveFile change has been flushed.
+
+    The first write seeds the row from an aggregate. If another upload
+    creates the row meanwhile, its total lacks our uncommitted file, so the
+    delta is added to it instead.
+    """
+    delta = {"file_count": DriveUsage.file_count + files, "total_bytes": DriveUsage.total_bytes + size_bytes}
+    bump = update(DriveUsage).where(DriveUsage.user_id == user_id).values(delta)
+    if db.session.execute(bump).rowcount:
+        return
+    count, total = _aggregate(user_id)
+    row = {"user_id": user_id, "file_count": count, "total_bytes": total}
+    upsert = upsert_insert(db.engine)
+    if upsert is not None:
+        db.session.execute(
+            upsert(DriveUsage).values(row).on_conflict_do_update(index_elements=[DriveUsage.user_id], set_=delta)
+        )
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(DriveUsage).values(row))
+    except IntegrityError:
+        db.session.execute(bump)
+
+
+def reconcile_usage() -> int:
+    """Recompute every counter from drive_files; returns how many were wrong."""
+    actual = {
+        user_id: (count, total)
+        for user_id, count, total in db.session.query(
+            DriveFile.user_id, func.count(DriveFile.id), func.coalesce(func.sum(DriveFile.size_bytes), 0)
+        ).group_by(DriveFile.user_id)
+    }
+    fixed = 0
+    for row in DriveUsage.query.all():
+        count, total = actual.pop(row.user_id, (0, 0))
+        if (row.file_count, row.total_bytes) != (count, total):
+            row.file_count, row.total_bytes = count, total
+            fixed += 1
+    for user_id, (count, total) in actual.items():
+        db.session.add(DriveUsage(user_id=user_id, file_count=count, total_bytes=total))
+        fixed += 1
+    db.session.commit()
+    return fixed
@@ -0,0 +1,78 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def _unicode_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.database in (None, "", ":memory:") or (url.database or "").startswith("file::memory:")
+
+
+def normalize_database_uri(uri: str) -> str:
+    # Heroku-style postgres:// is not accepted by SQLAlchemy 2
+    if uri.startswith("postgres://"):
+        return "postgresql://" + uri[len("postgres://"):]
+    return uri
+
+
+def engine_options(config) -> dict:
+    """Engine keyword arguments for the configured database; SQLALCHEMY_ENGINE_OPTIONS wins."""
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    options = {}
+    if url.get_backend_name() == "sqlite":
+        if not _is_memory_sqlite(url):
+            # Seconds the driver waits on a locked database; busy_timeout below does the same in SQLite
+            options["connect_args"] = {"timeout": config.get("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000}
+    else:
+        options.update(
+            pool_size=config.get("DB_POOL_SIZE", 10),
+            max_overflow=config.get("DB_MAX_OVERFLOW", 20),
+            pool_timeout=config.get("DB_POOL_TIMEOUT", 30),
+            pool_recycle=config.get("DB_POOL_RECYCLE", 1800),
+            pool_pre_ping=config.get("DB_POOL_PRE_PING", True),
+        )
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    return options
+
+
+def _sqlite_pragmas(config, memory: bool) -> list:
+    pragmas = [f"PRAGMA busy_timeout = {int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}"]
+    if not memory:
+        journal = config.get("SQLITE_JOURNAL_MODE") or "WAL"
+        pragmas += [
+            f"PRAGMA journal_mode = {journal}",
+            f"PRAGMA synchronous = {config.get('SQLITE_SYNCHRONOUS') or 'NORMAL'}",
+            f"PRAGMA mmap_size = {int(config.get('SQLITE_MMAP_SIZE', 0))}",
+        ]
+    return pragmas
+
+
+def configure_engine(engine, config=None) -> None:
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = _sqlite_pragmas(config or {}, _is_memory_sqlite(engine.url))
+
+    def _on_sqlite_connect(dbapi_conn, connection_record):
+        # SQLite's built-in lower() only folds ASCII; filenames are often Cyrillic
+        dbapi_conn.create_function("lower", 1, _unicode_lower, deterministic=True)
+        cursor = dbapi_conn.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    event.listen(engine, "connect", _on_sqlite_connect)
+
+
+def upsert_insert(engine):
+    """insert() with ON CONFLICT support for the engine's database, or None where there is none."""
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import select
+
+from . import get_db, get_identity_cache
+from .models import User, avatar_version
+
+db = get_db()
+
+_COLUMNS = (User.id, User.email, User.name, User.is_admin, User.avatar_path,
+            User.file_quota_count, User.file_quota_mb)
+
+
+@dataclass(frozen=True, eq=False)
+class CachedUser(UserMixin):
+    """Read-only slice of a User that requests need; load the User row to change anything."""
+
+    id: int
+    email: str
+    name: str
+    is_admin: bool
+    avatar_path: str
+    file_quota_count: int
+    file_quota_mb: int
+
+    @property
+    def avatar_version(self):
+        return avatar_version(self.avatar_path)
+
+
+def load_identity(user_id: int):
+    cache = get_identity_cache()
+    identity = cache.get(user_id)
+    if identity is None:
+        row = db.session.execute(select(*_COLUMNS).where(User.id == user_id)).first()
+        if row is None:
+            return None
+        identity = CachedUser(**row._mapping)
+        cache.put(user_id, identity, ttl=current_app.config.get("IDENTITY_CACHE_SECONDS", 30))
+    return identity
+
+
+def invalidate_identity(user_id: int) -> None:
+    get_identity_cache().invalidate(user_id)
@@ -0,0 +1,223 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, event, func, select, update
+
+from . import get_db
+from .models import Job
+from .security import decrypt_text, encrypt_text
+
+db = get_db()
+
+jobs_cli = AppGroup("jobs", help="Background job queue.")
+
+# A worker that died mid-batch leaves its jobs running; they are retried after this
+STALE_AFTER = timedelta(minutes=5)
+STALE_CHECK_SECONDS = 60
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+
+_handlers = {}
+_wake = threading.Event()
+_stale_lock = threading.Lock()
+_stale_checked_at = float("-inf")
+
+
+class _Metrics:
+    """Per-process counters and recent timings, reported by job_stats()."""
+
+    def __init__(self, keep: int = 200):
+        self._lock = threading.Lock()
+        self.counts = defaultdict(lambda: {"done": 0, "retried": 0, "failed": 0})
+        self.run_ms = defaultdict(lambda: deque(maxlen=keep))
+        self.wait_ms = defaultdict(lambda: deque(maxlen=keep))
+
+    def record(self, kind: str, outcome: str, run_ms: float, wait_ms: float) -> None:
+        with self._lock:
+            self.counts[kind][outcome] += 1
+            self.run_ms[kind].append(run_ms)
+            if outcome == "done":
+                self.wait_ms[kind].append(wait_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                kind: dict(counts, run_ms=_summary(self.run_ms[kind]), wait_ms=_summary(self.wait_ms[kind]))
+                for kind, counts in self.counts.items()
+            }
+
+
+def _summary(samples) -> dict:
+    if not samples:
+        return {"avg": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "avg": round(sum(ordered) / len(ordered), 1),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+        "max": round(ordered[-1], 1),
+    }
+
+
+_metrics = _Metrics()
+
+
+def job_handler(kind: str, batch_size=1):
+    """Register fn(payloads) -> list of per-payload errors (None for success) for a job kind.
+
+    Up to batch_size due jobs of the kind (None: JOB_BATCH_SIZE) are handed
+    over in one call, so a handler can share a connection between them.
+    """
+    def decorator(fn):
+        _handlers[kind] = (fn, batch_size)
+        return fn
+    return decorator
+
+
+def enqueue(kind: str, payload: dict, delay_seconds: float = 0, max_attempts: int = 5, dedupe_key=None):
+    """Add a job in the caller's transaction; workers pick it up once committed.
+
+    With a dedupe_key, nothing is added (and None returned) while a job with
+    the same key is still pending, so repeated requests collapse into one run.
+    """
+    if dedupe_key is not None and db.session.execute(
+        select(Job.id).where(Job.dedupe_key == dedupe_key, Job.status == "pending").limit(1)
+    ).first():
+        return None
+    job = Job(
+        kind=kind,
+        payload_encrypted=encrypt_text(json.dumps(payload)),
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+        dedupe_key=dedupe_key,
+    )
+    db.session.add(job)
+    # Wake idle workers of this process once the job is visible to them
+    event.listen(db.session(), "after_commit", lambda session: _wake.set(), once=True)
+    return job
+
+
+def _backoff(attempts: int) -> timedelta:
+    seconds = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return timedelta(seconds=seconds * random.uniform(0.8, 1.2))
+
+
+def _claim(kind: str, limit: int) -> list:
+    now = datetime.utcnow()
+    ids = db.session.execute(
+        select(Job.id)
+        .where(Job.kind == kind, Job.status == "pending", Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(limit)
+    ).scalars().all()
+    claimed = []
+    for job_id in ids:
+        if db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == "pending").values(status="running", locked_at=now)
+        ).rowcount:
+            claimed.append(job_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return Job.query.filter(Job.id.in_(claimed)).order_by(Job.run_at, Job.id).all()
+
+
+def _requeue_stale() -> None:
+    """Return jobs of dead workers to the queue, checking at most every STALE_CHECK_SECONDS.
+
+    The check is a read; a write transaction is opened only when a stale job exists.
+    """
+    global _stale_checked_at
+    now = time.monotonic()
+    with _stale_lock:
+        if now - _stale_checked_at < STALE_CHECK_SECONDS:
+            return
+        _stale_checked_at = now
+    stale = Job.status == "running", Job.locked_at < datetime.utcnow() - STALE_AFTER
+    if db.session.execute(select(Job.id).where(*stale).limit(1)).first() is None:
+        return
+    db.session.execute(update(Job).where(*stale).values(status="pending", locked_at=None))
+    db.session.commit()
+
+
+def run_due_jobs(limit=None) -> int:
+    """Run one batch of due jobs per registered kind; returns how many were attempted."""
+    _requeue_stale()
+    attempted = 0
+    for kind, (fn, batch_size) in list(_handlers.items()):
+        batch_size = batch_size or int(current_app.config.get("JOB_BATCH_SIZE") or 20)
+        jobs = _claim(kind, min(batch_size, limit or batch_size))
+        if not jobs:
+            continue
+        attempted += len(jobs)
+        started = time.monotonic()
+        try:
+            errors = fn([json.loads(decrypt_text(j.payload_encrypted)) for j in jobs])
+        except Exception as exc:
+            errors = [exc] * len(jobs)
+        per_job_ms = (time.monotonic() - started) * 1000 / len(jobs)
+        now = datetime.utcnow()
+        for job, error in zip(jobs, errors):
+            wait_ms = (now - job.created_at).total_seconds() * 1000
+            if error is None:
+                db.session.execute(delete(Job).where(Job.id == job.id))
+                _metrics.record(kind, "done", per_job_ms, wait_ms)
+                continue
+            job.attempts += 1
+            job.last_error = repr(error)[:2000]
+            job.locked_at = None
+            if job.attempts >= job.max_attempts:
+                job.status = "failed"
+                _metrics.record(kind, "failed", per_job_ms, wait_ms)
+                current_app.logger.error("Job %s (%s) failed permanently: %r", job.id, kind, error)
+            else:
+                job.status = "pending"
+                job.run_at = now + _backoff(job.attempts)
+                _metrics.record(kind, "retried", per_job_ms, wait_ms)
+        db.session.commit()
+    return attempted
+
+
+def wait_for_jobs(timeout: float) -> None:
+    """Block a worker until a job is enqueued in this process or the timeout passes."""
+    _wake.wait(timeout)
+    _wake.clear()
+
+
+def job_stats() -> dict:
+    depth = dict(db.session.execute(select(Job.status, func.count(Job.id)).group_by(Job.status)).all())
+    oldest = db.session.execute(select(func.min(Job.run_at)).where(Job.status == "pending")).scalar()
+    return {
+        "depth": {status: depth.get(status, 0) for status in ("pending", "running", "failed")},
+        "oldest_pending_at": oldest.isoformat() if oldest else None,
+        "kinds": _metrics.snapshot(),
+    }
+
+
+@jobs_cli.command("run")
+@click.option("--once", is_flag=True, help="Run one batch and exit.")
+def run_command(once: bool):
+    """Run due jobs in the foreground (for deployments without worker threads)."""
+    total = 0
+    while True:
+        attempted = run_due_jobs()
+        total += attempted
+        if once or not attempted:
+            break
+    click.echo(f"Attempted {total} jobs")
+
+
+@jobs_cli.command("retry-failed")
+def retry_failed_command():
+    """Put permanently failed jobs back into the queue."""
+    count = db.session.execute(
+        update(Job).where(Job.status == "failed").values(status="pending", attempts=0, run_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    click.echo(f"Requeued {count} jobs")
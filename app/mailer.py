@@ -0,0 +1,199 @@
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import current_app
+from flask_mail import Message, sanitize_address, sanitize_addresses
+
+from .jobs import enqueue, job_handler
+
+MAIL_JOB = "mail"
+
+# An idle session older than this is probed with NOOP before reuse
+HEALTHCHECK_IDLE_SECONDS = 30
+
+# Refusals that leave the SMTP session usable after RSET
+_MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class _BrokenSession(Exception):
+    def __init__(self, errors):
+        super().__init__("SMTP session lost")
+        self.errors = errors
+
+
+class _Session:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.created_at = self.last_used = time.monotonic()
+        self.sent = 0
+
+
+class SMTPPool:
+    """Bounded pool of authenticated SMTP sessions shared by the mail workers of a process.
+
+    Sessions are reused across messages and batches, probed with NOOP after
+    sitting idle, and recycled after max_age seconds or max_messages sends.
+    """
+
+    def __init__(self, host, port, use_tls=False, use_ssl=False, username=None, password=None,
+                 size=2, max_age=300, max_messages=100, timeout=10):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.size = size
+        self.opened = 0
+        self.reused = 0
+        self.recycled = 0
+
+    def _open(self) -> _Session:
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.use_tls:
+                smtp.starttls()
+                smtp.ehlo()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._close(smtp)
+            raise
+        with self._lock:
+            self.opened += 1
+        return _Session(smtp)
+
+    @staticmethod
+    def _close(smtp) -> None:
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _usable(self, s: _Session) -> bool:
+        now = time.monotonic()
+        if now - s.created_at > self.max_age or s.sent >= self.max_messages:
+            return False
+        if now - s.last_used > HEALTHCHECK_IDLE_SECONDS:
+            try:
+                return s.smtp.noop()[0] == 250
+            except Exception:
+                return False
+        return True
+
+    def _checkout(self) -> _Session:
+        while True:
+            with self._lock:
+                s = self._idle.popleft() if self._idle else None
+            if s is None:
+                return self._open()
+            if self._usable(s):
+                with self._lock:
+                    self.reused += 1
+                return s
+            self._discard(s)
+
+    def _discard(self, s: _Session) -> None:
+        with self._lock:
+            self.recycled += 1
+        self._close(s.smtp)
+
+    @contextmanager
+    def session(self):
+        """Hold one pooled session; it is dropped instead of returned if the block fails."""
+        with self._slots:
+            s = self._checkout()
+            try:
+                yield s
+            except Exception:
+                self._discard(s)
+                raise
+            s.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(s)
+
+    def send_batch(self, messages: list) -> list:
+        """Send messages over one session; returns per-message errors (None for success)."""
+        errors = []
+        with self.session() as s:
+            for i, msg in enumerate(messages):
+                try:
+                    s.smtp.sendmail(sanitize_address(msg.sender), list(sanitize_addresses(msg.send_to)),
+                                    msg.as_bytes(), msg.mail_options, msg.rcpt_options)
+                    s.sent += 1
+                    errors.append(None)
+                except _MESSAGE_ERRORS as exc:
+                    errors.append(exc)
+                    try:
+                        s.smtp.rset()
+                    except Exception as lost:
+                        errors.extend([lost] * (len(messages) - i - 1))
+                        raise _BrokenSession(errors) from lost
+                except Exception as exc:
+                    # The session is gone; the rest of the batch is retried later
+                    errors.extend([exc] * (len(messages) - i))
+                    raise _BrokenSession(errors) from exc
+        return errors
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for s in idle:
+            self._close(s.smtp)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": self.size, "idle": len(self._idle), "opened": self.opened,
+                    "reused": self.reused, "recycled": self.recycled}
+
+
+def get_smtp_pool() -> SMTPPool:
+    pool = current_app.extensions.get("smtp_pool")
+    if pool is None:
+        cfg = current_app.config
+        pool = current_app.extensions["smtp_pool"] = SMTPPool(
+            cfg.get("MAIL_SERVER"),
+            cfg.get("MAIL_PORT"),
+            use_tls=cfg.get("MAIL_USE_TLS", False),
+            use_ssl=cfg.get("MAIL_USE_SSL", False),
+            username=cfg.get("MAIL_USERNAME"),
+            password=cfg.get("MAIL_PASSWORD"),
+            size=int(cfg.get("MAIL_POOL_SIZE") or 2),
+            max_age=int(cfg.get("MAIL_POOL_RECYCLE_SECONDS") or 300),
+            max_messages=int(cfg.get("MAIL_POOL_MAX_MESSAGES") or 100),
+        )
+    return pool
+
+
+def mail_enabled() -> bool:
+    return bool(current_app.config.get("MAIL_ENABLED"))
+
+
+def queue_mail(subject: str, recipients: list, body: str) -> None:
+    """Send a plain-text message from a background worker after the caller commits."""
+    enqueue(MAIL_JOB, {"subject": subject, "recipients": recipients, "body": body})
+
+
+@job_handler(MAIL_JOB, batch_size=None)
+def send_mail_batch(payloads: list) -> list:
+    messages = [Message(subject=p["subject"], recipients=p["recipients"], body=p["body"]) for p in payloads]
+    try:
+        return get_smtp_pool().send_batch(messages)
+    except _BrokenSession as exc:
+        return exc.errors
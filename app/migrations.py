@@ -0,0 +1,311 @@
+import hashlib
+import os
+import re
+from contextlib import closing
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, exists, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+from . import get_db
+
+db = get_db()
+
+db_cli = AppGroup("db", help="Database schema migrations.")
+
+BACKFILL_BATCH = 500
+
+_meta = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _meta,
+    Column("version", String(32), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+_migrations = []
+
+
+def migration(version: str):
+    """Register fn(ctx) as schema version `version`; versions run in ascending order.
+
+    Steps must be safe to repeat: a migration that fails half-way runs again
+    from the start next time.
+    """
+    def decorator(fn):
+        _migrations.append((version, fn))
+        _migrations.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+class MigrationContext:
+    """Idempotent schema helpers. Each step commits on its own, so no lock outlives a step.
+
+    Migrations must not assume create_all has run: a table added after the
+    first release is created (ctx.create_table) before a step alters it.
+    """
+
+    def __init__(self, engine, log=None):
+        self.engine = engine
+        self.log = log or (lambda msg: None)
+
+    def _inspector(self):
+        return inspect(self.engine)
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in {c["name"] for c in self._inspector().get_columns(table)}
+
+    def add_column(self, table: str, column: Column) -> None:
+        if self.has_column(table, column.name):
+            return
+        col_type = column.type.compile(dialect=self.engine.dialect)
+        null = "" if column.nullable else " NOT NULL"
+        default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+        with self.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column.name} {col_type}{default}{null}'))
+        self.log(f"added {table}.{column.name}")
+
+    def create_table(self, table: Table) -> None:
+        """Create a model-declared table and its indexes if missing."""
+        table.create(self.engine, checkfirst=True)
+        self.log(f"table {table.name}")
+
+    def create_index(self, index) -> None:
+        """Create a model-declared Index if missing; concurrently on PostgreSQL, so writers keep going."""
+        if self.engine.dialect.name == "postgresql":
+            ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=self.engine.dialect))
+            ddl = re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+            # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(ddl))
+        else:
+            with self.engine.begin() as conn:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+        self.log(f"index {index.name}")
+
+    def backfill(self, table: Table, where, compute, batch_size: int = BACKFILL_BATCH) -> int:
+        """Set columns on rows matching `where`, batch by batch in primary key order.
+
+        compute(row) returns a dict of new values, or None to leave the row as
+        is. Rows are read in one short transaction and written in another, so
+        slow computations never hold a write lock. Returns rows updated.
+        """
+        pk = table.primary_key.columns.values()[0]
+        last, updated = None, 0
+        while True:
+            query = select(table).where(where).order_by(pk).limit(batch_size)
+            if last is not None:
+                query = query.where(pk > last)
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).all()
+            if not rows:
+                return updated
+            last = rows[-1]._mapping[pk.name]
+            changes = []
+            for row in rows:
+                values = compute(row)
+                if values:
+                    changes.append({"b_pk": row._mapping[pk.name], **values})
+            if changes:
+                stmt = (table.update().where(pk == bindparam("b_pk"))
+                        .values({name: bindparam(name) for name in changes[0] if name != "b_pk"}))
+                with self.engine.begin() as conn:
+                    conn.execute(stmt, changes)
+                updated += len(changes)
+            self.log(f"{table.name}: {updated} rows backfilled")
+
+
+def applied_versions(engine) -> set:
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending_migrations(engine) -> list:
+    done = applied_versions(engine)
+    return [(version, fn) for version, fn in _migrations if version not in done]
+
+
+def run_migrations(engine, log=None) -> list:
+    """Apply pending migrations in order; returns the versions applied by this call."""
+    ctx = MigrationContext(engine, log)
+    applied = []
+    for version, fn in pending_migrations(engine):
+        ctx.log(f"migrating {version} {fn.__name__}")
+        fn(ctx)
+        try:
+            with engine.begin() as conn:
+                conn.execute(schema_migrations.insert().values(version=version, applied_at=datetime.utcnow()))
+        except IntegrityError:
+            pass  # another process finished the same migration
+        applied.append(version)
+    return applied
+
+
+@migration("0001")
+def performance_indexes(ctx: MigrationContext) -> None:
+    """Columns added after release, and the indexes behind per-user listings and joins."""
+    from .models import Attachment, DriveFile, DriveFolder, DriveShare, Note, note_groups, note_tags
+
+    ctx.add_column("drive_files", Column("sha256", String(64), nullable=True))
+    ctx.add_column("attachments", Column("sha256", String(64), nullable=True))
+    for index in (
+        *Note.__table__.indexes,
+        *Attachment.__table__.indexes,
+        *DriveFile.__table__.indexes,
+        *DriveFolder.__table__.indexes,
+        *DriveShare.__table__.indexes,
+        *note_tags.indexes,
+        *note_groups.indexes,
+    ):
+        ctx.create_index(index)
+
+
+@migration("0002")
+def backfill_sha256(ctx: MigrationContext) -> None:
+    """Digests of files uploaded before they were recorded: from the blob key, or by hashing the bytes."""
+    from .blobs import blob_digest
+    from .models import Attachment, DriveFile
+    from .storage import get_storage
+
+    storage = get_storage()
+
+    def digest(row):
+        sha256 = blob_digest(row.stored_path)
+        if sha256 is None and storage.exists(row.stored_path):
+            h = hashlib.sha256()
+            with closing(storage.open(row.stored_path)) as fh:
+                for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                    h.update(chunk)
+            sha256 = h.hexdigest()
+        return {"sha256": sha256} if sha256 else None
+
+    for table in (DriveFile.__table__, Attachment.__table__):
+        ctx.backfill(table, table.c.sha256.is_(None), digest)
+
+
+@migration("0003")
+def note_revisions(ctx: MigrationContext) -> None:
+    """Note revisions for delta autosave, and job dedupe keys for coalesced reindexing."""
+    from .models import Job
+
+    ctx.add_column("notes", Column("revision", Integer, nullable=False, server_default="1"))
+    ctx.create_table(Job.__table__)
+    ctx.add_column("jobs", Column("dedupe_key", String(128), nullable=True))
+    for index in Job.__table__.indexes:
+        ctx.create_index(index)
+
+
+@migration("0004")
+def state_entries(ctx: MigrationContext) -> None:
+    """Shared OTP and rate-limit state for STATE_STORE_URL=database://."""
+    from .models import StateEntry
+
+    ctx.create_table(StateEntry.__table__)
+
+
+@migration("0005")
+def folder_file_index(ctx: MigrationContext) -> None:
+    """ix_drive_file_folders_folder_id, which 0001 left out: folder listings join on it."""
+    from .models import drive_file_folders
+
+    for index in drive_file_folders.indexes:
+        ctx.create_index(index)
+
+
+@migration("0006")
+def avatar_mime(ctx: MigrationContext) -> None:
+    """Avatar content type, recorded at upload since blob keys have no extension."""
+    ctx.add_column("users", Column("avatar_mime", String(128), nullable=True))
+
+
+@migration("0007")
+def search_tokens(ctx: MigrationContext) -> None:
+    """Blind-index tokens for notes written before the search index existed.
+
+    Notes without tokens are read in id order, BACKFILL_BATCH at a time, and
+    each batch's tokens are written in a short transaction of their own.
+    """
+    from .models import Note, NoteSearchToken
+    from .notes.search import token_rows
+    from .security import decrypt_text
+
+    notes, tokens = Note.__table__, NoteSearchToken.__table__
+    ctx.create_table(tokens)
+    unindexed = ~exists().where(tokens.c.note_id == notes.c.id)
+    last, indexed = 0, 0
+    while True:
+        with ctx.engine.connect() as conn:
+            rows = conn.execute(
+                select(notes.c.id, notes.c.user_id, notes.c.title, notes.c.content_encrypted)
+                .where(unindexed, notes.c.id > last).order_by(notes.c.id).limit(BACKFILL_BATCH)
+            ).all()
+        if not rows:
+            return
+        last = rows[-1].id
+        values = [t for r in rows for t in token_rows(r.id, r.user_id, r.title, decrypt_text(r.content_encrypted))]
+        with ctx.engine.begin() as conn:
+            # Notes the running app has indexed meanwhile keep their newer tokens
+            done = set(conn.execute(
+                select(tokens.c.note_id).where(tokens.c.note_id.in_([r.id for r in rows])).distinct()
+            ).scalars())
+            values = [v for v in values if v["note_id"] not in done]
+            if values:
+                conn.execute(tokens.insert(), values)
+        indexed += len(rows)
+        ctx.log(f"note_search_tokens: {indexed} notes indexed")
+
+
+@migration("0008")
+def parked_deletes(ctx: MigrationContext) -> None:
+    """Purge queue entries that failed PURGE_MAX_ATTEMPTS times are parked, not retried forever."""
+    from .models import PendingDelete
+
+    ctx.create_table(PendingDelete.__table__)
+    ctx.add_column("pending_deletes", Column("parked_at", DateTime, nullable=True))
+
+
+def init_database(log=None) -> None:
+    """Create missing tables, apply migrations and add the first admin from ADMIN_EMAIL/ADMIN_PASSWORD."""
+    from .models import User
+
+    db.create_all()
+    run_migrations(db.engine, log)
+    admin_email = os.getenv("ADMIN_EMAIL")
+    admin_password = os.getenv("ADMIN_PASSWORD")
+    if admin_email and admin_password and db.session.query(User.id).first() is None:
+        u = User(email=admin_email.strip().lower(), is_admin=True)
+        u.set_password(admin_password)
+        db.session.add(u)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+
+
+@click.command("init")
+@with_appcontext
+def init_command():
+    """Prepare the database once per deployment: tables, migrations, bootstrap admin."""
+    init_database(log=click.echo)
+    click.echo("Database ready")
+
+
+@db_cli.command("migrate")
+def migrate_command():
+    """Create missing tables, then apply pending schema migrations."""
+    db.create_all()
+    applied = run_migrations(db.engine, log=click.echo)
+    click.echo(f"Applied {len(applied)} migrations" if applied else "Schema is up to date")
+
+
+@db_cli.command("status")
+def status_command():
+    """List migrations and whether they are applied."""
+    done = applied_versions(db.engine)
+    for version, fn in _migrations:
+        click.echo(f"{'applied' if version in done else 'pending'}  {version} {fn.__name__}")
@@ -1,10 +1,12 @@
+import os
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import Table, Column, Integer, ForeignKey, UniqueConstraint
+from werkzeug.security import check_password_hash
+from sqlalchemy import Table, Column, Integer, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 
 from . import get_db
+from .security import hash_password, password_needs_rehash
 
 db = get_db()
 
@@ -13,6 +15,8 @@ note_tags = Table(
     db.metadata,
     Column("note_id", Integer, ForeignKey("notes.id", ondelete="CASCADE"), primary_key=True),
     Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    # The primary key leads with note_id; tag filters look notes up by tag
+    Index("ix_note_tags_tag_id", "tag_id"),
 )
 
 note_groups = Table(
@@ -20,16 +24,24 @@ note_groups = Table(
     db.metadata,
     Column("note_id", Integer, ForeignKey("notes.id", ondelete="CASCADE"), primary_key=True),
     Column("group_id", Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_note_groups_group_id", "group_id"),
 )
 
 drive_file_folders = Table(
     "drive_file_folders",
     db.metadata,
     Column("file_id", Integer, ForeignKey("drive_files.id", ondelete="CASCADE"), primary_key=True),
-    Column("folder_id", Integer, ForeignKey("drive_folders.id", ondelete="CASCADE"), nullable=False),
+    Column("folder_id", Integer, ForeignKey("drive_folders.id", ondelete="CASCADE"), nullable=False, index=True),
 )
 
 
+def avatar_version(avatar_path):
+    # Avatars are stored under their content hash (or a random legacy name), so the name versions the URL
+    if not avatar_path:
+        return None
+    return os.path.splitext(os.path.basename(avatar_path))[0]
+
+
 class User(UserMixin, db.Model):
     __tablename__ = "users"
 
@@ -39,13 +51,9 @@ class User(UserMixin, db.Model):
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     name = db.Column(db.String(255), nullable=True)
     avatar_path = db.Column(db.String(512), nullable=True)
+    # Blob keys carry no extension, so the type is recorded at upload
+    avatar_mime = db.Column(db.String(128), nullable=True)
     email_verified_at = db.Column(db.DateTime, nullable=True)
-    otp_code = db.Column(db.String(8), nullable=True)
-    otp_expires_at = db.Column(db.DateTime, nullable=True)
-    otp_send_count = db.Column(db.Integer, nullable=True)
-    otp_last_sent_at = db.Column(db.DateTime, nullable=True)
-    otp_fail_count = db.Column(db.Integer, nullable=True)
-    otp_locked_until = db.Column(db.DateTime, nullable=True)
     file_quota_count = db.Column(db.Integer, nullable=True)  
     file_quota_mb = db.Column(db.Integer, nullable=True)    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -54,12 +62,23 @@ class User(UserMixin, db.Model):
     groups = relationship("Group", back_populates="user", cascade="all, delete-orphan")
     drive_files = relationship("DriveFile", back_populates="user", cascade="all, delete-orphan")
 
+    @property
+    def avatar_version(self):
+        return avatar_version(self.avatar_path)
+
     def set_password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password: str) -> bool:
         return check_password_hash(self.password_hash, password)
 
+    def rehash_password(self, password: str) -> bool:
+        """After a successful check: re-hash with the configured method if the stored one differs."""
+        if not password_needs_rehash(self.password_hash):
+            return False
+        self.set_password(password)
+        return True
+
 
 class Note(db.Model):
     __tablename__ = "notes"
@@ -70,12 +89,31 @@ class Note(db.Model):
     content_encrypted = db.Column(db.LargeBinary, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Bumped by every saved change; autosave sends the revision it started from
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     user = relationship("User", back_populates="notes")
     tags = relationship("Tag", secondary=note_tags, back_populates="notes")
     attachments = relationship("Attachment", back_populates="note", cascade="all, delete-orphan")
     groups = relationship("Group", secondary=note_groups, back_populates="notes")
 
+    __table_args__ = (
+        # Listing: WHERE user_id = ? ORDER BY updated_at DESC, id DESC with a keyset cursor
+        Index("ix_notes_user_updated", "user_id", "updated_at", "id"),
+    )
+
+
+class NoteSearchToken(db.Model):
+    __tablename__ = "note_search_tokens"
+
+    note_id = db.Column(db.Integer, db.ForeignKey("notes.id", ondelete="CASCADE"), primary_key=True)
+    token = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_note_search_tokens_user_token", "user_id", "token"),
+    )
+
 
 class Tag(db.Model):
     __tablename__ = "tags"
@@ -106,11 +144,12 @@ class Attachment(db.Model):
     __tablename__ = "attachments"
 
     id = db.Column(db.Integer, primary_key=True)
-    note_id = db.Column(db.Integer, db.ForeignKey("notes.id", ondelete="CASCADE"), nullable=False)
+    note_id = db.Column(db.Integer, db.ForeignKey("notes.id", ondelete="CASCADE"), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     stored_path = db.Column(db.String(512), nullable=False)
     mime_type = db.Column(db.String(128), nullable=True)
     size_bytes = db.Column(db.Integer, nullable=True)
+    sha256 = db.Column(db.String(64), nullable=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     note = relationship("Note", back_populates="attachments")
@@ -125,11 +164,82 @@ class DriveFile(db.Model):
     stored_path = db.Column(db.String(512), nullable=False)
     mime_type = db.Column(db.String(128), nullable=True)
     size_bytes = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="drive_files")
     folder = relationship("DriveFolder", secondary=drive_file_folders, uselist=False, back_populates="files")
 
+    __table_args__ = (
+        Index("ix_drive_files_user_uploaded", "user_id", "uploaded_at"),
+        Index("ix_drive_files_user_filename", "user_id", "filename"),
+        Index("ix_drive_files_user_size", "user_id", "size_bytes"),
+    )
+
+
+class DriveUsage(db.Model):
+    __tablename__ = "drive_usage"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class Blob(db.Model):
+    """Content-addressed file shared by every DriveFile, Attachment and avatar with the same SHA-256."""
+    __tablename__ = "blobs"
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class PendingDelete(db.Model):
+    """Outbox of storage keys whose rows are gone; the purge worker removes the bytes."""
+    __tablename__ = "pending_deletes"
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(512), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    # Set once PURGE_MAX_ATTEMPTS deletes failed; parked rows wait for `flask blobs purge --retry-parked`
+    parked_at = db.Column(db.DateTime, nullable=True)
+
+
+class Job(db.Model):
+    """Background job; the payload is encrypted since it may carry OTP codes or addresses."""
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload_encrypted = db.Column(db.LargeBinary, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Jobs with the same key are not queued twice while one is pending
+    dedupe_key = db.Column(db.String(128), nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+        Index("ix_jobs_dedupe_key_status", "dedupe_key", "status"),
+    )
+
+
+class StateEntry(db.Model):
+    """Short-lived key/value state (OTP codes, counters, rate-limit windows) for STATE_STORE_URL=database://."""
+    __tablename__ = "state_entries"
+
+    key = db.Column(db.String(255), primary_key=True)
+    value = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)  # Unix time
+
+    __table_args__ = (Index("ix_state_entries_expires_at", "expires_at"),)
+
 
 class DriveFolder(db.Model):
     __tablename__ = "drive_folders"
@@ -148,11 +258,27 @@ class DriveFolder(db.Model):
     )
 
 
+class UploadSession(db.Model):
+    __tablename__ = "upload_sessions"
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    mime_type = db.Column(db.String(128), nullable=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    total_chunks = db.Column(db.Integer, nullable=False)
+    folder_id = db.Column(db.Integer, db.ForeignKey("drive_folders.id", ondelete="SET NULL"), nullable=True)
+    sha256 = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
 class DriveShare(db.Model):
     __tablename__ = "drive_shares"
 
     id = db.Column(db.Integer, primary_key=True)
-    file_id = db.Column(db.Integer, db.ForeignKey("drive_files.id", ondelete="CASCADE"), nullable=False)
+    file_id = db.Column(db.Integer, db.ForeignKey("drive_files.id", ondelete="CASCADE"), nullable=False, index=True)
     token = db.Column(db.String(64), unique=True, nullable=False, index=True)
     expires_at = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,19 @@
+import sys
+
+from .. import get_note_cache
+from ..models import Note
+from ..security import decrypt_text
+
+
+def note_content(note: Note) -> str:
+    """Decrypted body of a note, served from the per-process cache while updated_at is unchanged."""
+    cache = get_note_cache()
+    content = cache.get(note.id, version=note.updated_at)
+    if content is None:
+        content = decrypt_text(note.content_encrypted)
+        cache.put(note.id, content, version=note.updated_at, size=sys.getsizeof(content))
+    return content
+
+
+def forget_note(note_id: int) -> None:
+    get_note_cache().invalidate(note_id)
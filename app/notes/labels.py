@@ -0,0 +1,174 @@
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import get_db, get_tag_cache
+from ..models import Group, Tag, note_groups, note_tags
+
+db = get_db()
+
+# Session.info key for tag ids created in the open transaction
+_NEW_TAGS = "labels.new_tags"
+
+
+def clean_names(values) -> list:
+    """Stripped, non-empty, first-seen order without duplicates; ValueError unless a list of strings."""
+    if values is None:
+        return []
+    if not isinstance(values, list) or not all(isinstance(name, str) for name in values):
+        raise ValueError("expected a list of strings")
+    names = []
+    for name in values:
+        name = name.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _dialect_insert():
+    """insert() with ON CONFLICT support for the current database, or None."""
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _insert_ignoring_duplicates(model, rows: list, returning: tuple) -> list:
+    """Insert rows, skipping those that hit a unique constraint; returns the inserted rows' columns.
+
+    A row lost to a concurrent insert is not returned; callers select it afterwards.
+    """
+    dialect_insert = _dialect_insert()
+    if dialect_insert is not None:
+        stmt = dialect_insert(model).values(rows).on_conflict_do_nothing().returning(*returning)
+        return db.session.execute(stmt).all()
+    inserted = []
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                inserted.append(db.session.execute(insert(model).values(row).returning(*returning)).one())
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def resolve_tags(names: list) -> list:
+    """Ids of the named tags in the given order, creating missing ones.
+
+    Known names come from the per-process cache. The rest cost one IN lookup
+    and, for new names, one INSERT .. ON CONFLICT DO NOTHING.
+    """
+    cache = get_tag_cache()
+    ids = {}
+    for name in names:
+        tag_id = cache.get(name)
+        if tag_id is not None:
+            ids[name] = tag_id
+    missing = [n for n in names if n not in ids]
+    if missing:
+        found = dict(db.session.execute(select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+        for name, tag_id in found.items():
+            cache.put(name, tag_id)
+        ids.update(found)
+        missing = [n for n in missing if n not in found]
+    if missing:
+        created = dict(_insert_ignoring_duplicates(Tag, [{"name": n} for n in missing], (Tag.name, Tag.id)))
+        lost = [n for n in missing if n not in created]
+        if lost:
+            created.update(db.session.execute(select(Tag.name, Tag.id).where(Tag.name.in_(lost))).all())
+        ids.update(created)
+        # New ids are cached only once they are committed
+        db.session.info.setdefault(_NEW_TAGS, {}).update(created)
+    return [ids[n] for n in names]
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed_tags(session):
+    cache = get_tag_cache()
+    for name, tag_id in session.info.pop(_NEW_TAGS, {}).items():
+        cache.put(name, tag_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back_tags(session, previous_transaction):
+    # Also fires for savepoints; losing a few cache entries is harmless
+    session.info.pop(_NEW_TAGS, None)
+
+
+def resolve_groups(user_id: int, names: list) -> list:
+    """Ids of the user's named groups in the given order, creating missing ones."""
+    if not names:
+        return []
+    ids = dict(db.session.execute(
+        select(Group.name, Group.id).where(Group.user_id == user_id, Group.name.in_(names))
+    ).all())
+    missing = [n for n in names if n not in ids]
+    if missing:
+        rows = [{"user_id": user_id, "name": n} for n in missing]
+        ids.update(_insert_ignoring_duplicates(Group, rows, (Group.name, Group.id)))
+        lost = [n for n in missing if n not in ids]
+        if lost:
+            ids.update(db.session.execute(
+                select(Group.name, Group.id).where(Group.user_id == user_id, Group.name.in_(lost))
+            ).all())
+    return [ids[n] for n in names]
+
+
+def note_tags_by_name(note_id: int) -> dict:
+    return dict(db.session.execute(
+        select(Tag.name, Tag.id).join(note_tags, note_tags.c.tag_id == Tag.id).where(note_tags.c.note_id == note_id)
+    ).all())
+
+
+def note_groups_by_name(note_id: int) -> dict:
+    return dict(db.session.execute(
+        select(Group.name, Group.id).join(note_groups, note_groups.c.group_id == Group.id)
+        .where(note_groups.c.note_id == note_id)
+    ).all())
+
+
+def _set_links(table, column: str, note_id: int, ids: list, current=None) -> None:
+    """Make the note's links in an association table equal to ids; current, if known, saves a lookup."""
+    target = getattr(table.c, column)
+    if current is None:
+        current = db.session.execute(select(target).where(table.c.note_id == note_id)).scalars()
+    current = set(current)
+    removed = current - set(ids)
+    if removed:
+        db.session.execute(delete(table).where(table.c.note_id == note_id, target.in_(removed)))
+    add_links(table, column, [(note_id, i) for i in dict.fromkeys(ids) if i not in current])
+
+
+def add_links(table, column: str, pairs: list) -> None:
+    """Insert (note_id, id) pairs into note_tags ("tag_id") or note_groups ("group_id") in one statement.
+
+    Repeated pairs and links that already exist are skipped.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return
+    dialect_insert = _dialect_insert()
+    if dialect_insert is not None:
+        stmt = dialect_insert(table).on_conflict_do_nothing()
+    else:
+        target = getattr(table.c, column)
+        existing = set(db.session.execute(
+            select(table.c.note_id, target).where(table.c.note_id.in_({note_id for note_id, _ in pairs}))
+        ).all())
+        pairs = [pair for pair in pairs if pair not in existing]
+        stmt = insert(table)
+    if pairs:
+        db.session.execute(stmt, [{"note_id": note_id, column: i} for note_id, i in pairs])
+
+
+def set_note_tags(note_id: int, tag_ids: list, current=None) -> None:
+    _set_links(note_tags, "tag_id", note_id, tag_ids, current)
+
+
+def set_note_groups(note_id: int, group_ids: list, current=None) -> None:
+    _set_links(note_groups, "group_id", note_id, group_ids, current)
+
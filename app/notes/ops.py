@@ -0,0 +1,352 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import delete, select, update
+
+from .. import get_db
+from ..blobs import release_blobs
+from ..models import Attachment, Group, Note, NoteSearchToken, Tag, note_groups, note_tags
+from ..security import decrypt_text, encrypt_text
+from . import labels, search
+from .content import forget_note, note_content
+
+db = get_db()
+
+# Operations per batch request, and notes per transaction during import
+BATCH_MAX = 500
+TITLE_MAX = 255
+DEFAULT_TITLE = "Без названия"
+COPY_SUFFIX = " (копия)"
+
+
+def _title(value) -> str:
+    return ((value if isinstance(value, str) else "") or "").strip()[:TITLE_MAX] or DEFAULT_TITLE
+
+
+def _is_id(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value) if isinstance(value, str) else None
+    except ValueError:
+        return None
+
+
+def item_error(item: dict):
+    """Why a create or update body cannot be applied, or None."""
+    for field in ("title", "content"):
+        if item.get(field) is not None and not isinstance(item[field], str):
+            return f"{field} must be a string"
+    for field in ("tags", "groups"):
+        try:
+            labels.clean_names(item.get(field))
+        except ValueError:
+            return f"{field} must be a list of strings"
+    if item.get("revision") is not None and not _is_id(item["revision"]):
+        return "revision must be an integer"
+    return None
+
+
+def create_notes(user_id: int, items: list) -> list:
+    """Insert notes with their tags, groups and search tokens using a fixed number of statements.
+
+    Items are dicts with title, content, tags, groups and optionally
+    created_at/updated_at (ISO strings, as exported). Returns one
+    {"id", "revision"} per item. An invalid item raises ValueError before
+    anything is written.
+    """
+    if not items:
+        return []
+    for item in items:
+        error = item_error(item)
+        if error:
+            raise ValueError(error)
+    notes, contents = [], []
+    for item in items:
+        content = item.get("content") if isinstance(item.get("content"), str) else ""
+        note = Note(user_id=user_id, title=_title(item.get("title")), content_encrypted=encrypt_text(content))
+        created_at, updated_at = _timestamp(item.get("created_at")), _timestamp(item.get("updated_at"))
+        if created_at:
+            note.created_at = created_at
+        if updated_at:
+            note.updated_at = updated_at
+        notes.append(note)
+        contents.append(content)
+    db.session.add_all(notes)
+    db.session.flush()
+
+    tag_names = [labels.clean_names(item.get("tags")) for item in items]
+    group_names = [labels.clean_names(item.get("groups")) for item in items]
+    all_tags = list(dict.fromkeys(n for names in tag_names for n in names))
+    all_groups = list(dict.fromkeys(n for names in group_names for n in names))
+    tag_ids = dict(zip(all_tags, labels.resolve_tags(all_tags)))
+    group_ids = dict(zip(all_groups, labels.resolve_groups(user_id, all_groups)))
+    labels.add_links(note_tags, "tag_id",
+                     [(note.id, tag_ids[n]) for note, names in zip(notes, tag_names) for n in names])
+    labels.add_links(note_groups, "group_id",
+                     [(note.id, group_ids[n]) for note, names in zip(notes, group_names) for n in names])
+    search.index_notes(list(zip(notes, contents)), fresh=True)
+    return [{"id": note.id, "revision": note.revision} for note in notes]
+
+
+def update_note(note: Note, data: dict):
+    """Apply the fields present in data, skipping those equal to the stored ones.
+
+    With "revision" the change applies only on top of that revision. Returns
+    (body, status); an invalid body gives 400 and a stale revision 409,
+    neither writing anything.
+    """
+    error = item_error(data)
+    if error:
+        return {"error": error}, 400
+    revision = data.get("revision", note.revision)
+    if revision != note.revision:
+        return {"error": "conflict", "revision": note.revision}, 409
+
+    values = {}
+    changed = []
+    if "title" in data:
+        title = (data.get("title") or "").strip()
+        if title and title != note.title:
+            values["title"] = title
+            changed.append("title")
+    content = None
+    if "content" in data:
+        content = data.get("content") or ""
+        if content != note_content(note):
+            values["content_encrypted"] = encrypt_text(content)
+            changed.append("content")
+    tags = groups = None
+    if "tags" in data:
+        tags = labels.clean_names(data.get("tags"))
+        current_tags = labels.note_tags_by_name(note.id)
+        if set(tags) == set(current_tags):
+            tags = None
+        else:
+            changed.append("tags")
+    if "groups" in data:
+        groups = labels.clean_names(data.get("groups"))
+        current_groups = labels.note_groups_by_name(note.id)
+        if set(groups) == set(current_groups):
+            groups = None
+        else:
+            changed.append("groups")
+    if not changed:
+        return {"ok": True, "revision": note.revision, "changed": []}, 200
+
+    # Claim the next revision; of two saves based on the same one, the second matches no row
+    claimed = db.session.execute(
+        update(Note)
+        .where(Note.id == note.id, Note.revision == revision)
+        .values(revision=revision + 1, **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        current = db.session.execute(select(Note.revision).where(Note.id == note.id)).scalar()
+        return {"error": "conflict", "revision": current}, 409
+    db.session.expire(note, ["revision", "updated_at", *values])
+
+    if tags is not None:
+        labels.set_note_tags(note.id, labels.resolve_tags(tags), current=current_tags.values())
+    if groups is not None:
+        labels.set_note_groups(note.id, labels.resolve_groups(note.user_id, groups),
+                               current=current_groups.values())
+    if "title" in changed or "content" in changed:
+        search.schedule_reindex(note, content if "content" in changed else None)
+    if "content" in changed:
+        forget_note(note.id)
+    return {"ok": True, "revision": revision + 1, "changed": changed}, 200
+
+
+def delete_notes(note_ids: list) -> None:
+    """Delete notes with set-based statements; their attachments' bytes go to the purge queue."""
+    if not note_ids:
+        return
+    release_blobs(db.session.execute(
+        select(Attachment.stored_path).where(Attachment.note_id.in_(note_ids))
+    ).scalars().all())
+    for stmt in (
+        delete(NoteSearchToken).where(NoteSearchToken.note_id.in_(note_ids)),
+        note_tags.delete().where(note_tags.c.note_id.in_(note_ids)),
+        note_groups.delete().where(note_groups.c.note_id.in_(note_ids)),
+        delete(Attachment).where(Attachment.note_id.in_(note_ids)),
+        delete(Note).where(Note.id.in_(note_ids)),
+    ):
+        db.session.execute(stmt.execution_options(synchronize_session=False))
+    for note_id in note_ids:
+        forget_note(note_id)
+
+
+def move_notes(note_ids: list, group_id) -> None:
+    """Make group_id (None: no group) the only group of each note."""
+    note_ids = list(dict.fromkeys(note_ids))
+    if not note_ids:
+        return
+    db.session.execute(note_groups.delete().where(note_groups.c.note_id.in_(note_ids)))
+    if group_id is not None:
+        labels.add_links(note_groups, "group_id", [(note_id, group_id) for note_id in note_ids])
+    db.session.execute(
+        update(Note).where(Note.id.in_(note_ids)).values(revision=Note.revision + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def duplicate_notes(notes: list) -> list:
+    """Copy notes with their tags and groups; the encrypted body is copied as is."""
+    if not notes:
+        return []
+    ids = [n.id for n in notes]
+    tags, groups = {}, {}
+    for note_id, tag_id in db.session.execute(
+        select(note_tags.c.note_id, note_tags.c.tag_id).where(note_tags.c.note_id.in_(ids))
+    ):
+        tags.setdefault(note_id, []).append(tag_id)
+    for note_id, group_id in db.session.execute(
+        select(note_groups.c.note_id, note_groups.c.group_id).where(note_groups.c.note_id.in_(ids))
+    ):
+        groups.setdefault(note_id, []).append(group_id)
+    copies = [
+        Note(user_id=n.user_id, title=(n.title[:TITLE_MAX - len(COPY_SUFFIX)] + COPY_SUFFIX),
+             content_encrypted=n.content_encrypted)
+        for n in notes
+    ]
+    db.session.add_all(copies)
+    db.session.flush()
+    pairs = list(zip(notes, copies))
+    labels.add_links(note_tags, "tag_id", [(c.id, t) for n, c in pairs for t in tags.get(n.id, [])])
+    labels.add_links(note_groups, "group_id", [(c.id, g) for n, c in pairs for g in groups.get(n.id, [])])
+    search.index_notes([(c, note_content(n)) for n, c in pairs], fresh=True)
+    return [{"id": c.id, "revision": c.revision} for c in copies]
+
+
+def apply_batch(user_id: int, ops: list) -> list:
+    """Run create/update/delete/move/duplicate operations in the caller's transaction.
+
+    Kinds run in that order, each in bulk where possible; results come back
+    in request order as {"ok": true, ...} or {"ok": false, "error": ...}.
+    A failed item writes nothing; the others still apply.
+    """
+    results = [None] * len(ops)
+    ops = [op if isinstance(op, dict) else {} for op in ops]
+    wanted_ids = {op["id"] for op in ops if _is_id(op.get("id"))}
+    owned = {n.id: n for n in Note.query.filter(Note.user_id == user_id, Note.id.in_(wanted_ids))} if wanted_ids else {}
+    by_kind = {kind: [] for kind in ("create", "update", "move", "duplicate", "delete")}
+    for i, op in enumerate(ops):
+        kind = op.get("op")
+        if not isinstance(kind, str) or kind not in by_kind:
+            results[i] = {"ok": False, "error": "unknown op"}
+        elif kind != "create" and (not _is_id(op.get("id")) or op["id"] not in owned):
+            results[i] = {"ok": False, "error": "not found"}
+        elif kind in ("create", "update") and item_error(op):
+            results[i] = {"ok": False, "error": item_error(op)}
+        else:
+            by_kind[kind].append((i, op))
+
+    created = create_notes(user_id, [op for _, op in by_kind["create"]])
+    for (i, _), result in zip(by_kind["create"], created):
+        results[i] = {"ok": True, **result}
+
+    for i, op in by_kind["update"]:
+        body, status = update_note(owned[op["id"]], op)
+        results[i] = {"ok": False, **body} if status != 200 else body
+
+    moves, target = {}, {}
+    for i, op in by_kind["move"]:
+        group_id = op.get("group_id")
+        if group_id is not None and (not isinstance(group_id, int) or isinstance(group_id, bool)):
+            results[i] = {"ok": False, "error": "invalid group_id"}
+        elif target.setdefault(op["id"], group_id) != group_id:
+            # A note can end up in one place only; the first move wins
+            results[i] = {"ok": False, "error": "conflicting move"}
+        else:
+            moves.setdefault(group_id, []).append((i, op["id"]))
+    known_groups = set(db.session.execute(
+        select(Group.id).where(Group.user_id == user_id, Group.id.in_([g for g in moves if g is not None]))
+    ).scalars()) if moves else set()
+    for group_id, items in moves.items():
+        if group_id is not None and group_id not in known_groups:
+            for i, _ in items:
+                results[i] = {"ok": False, "error": "group not found"}
+            continue
+        move_notes([note_id for _, note_id in items], group_id)
+        for i, note_id in items:
+            results[i] = {"ok": True, "id": note_id}
+
+    copies = duplicate_notes([owned[op["id"]] for _, op in by_kind["duplicate"]])
+    for (i, _), result in zip(by_kind["duplicate"], copies):
+        results[i] = {"ok": True, **result}
+
+    deleted = list(dict.fromkeys(op["id"] for _, op in by_kind["delete"]))
+    delete_notes(deleted)
+    for i, op in by_kind["delete"]:
+        results[i] = {"ok": True, "id": op["id"]}
+    return results
+
+
+def export_lines(user_id: int, chunk: int = BATCH_MAX):
+    """The user's notebook as NDJSON lines, read in id order a chunk at a time."""
+    last_id = 0
+    while True:
+        notes = (
+            Note.query.filter(Note.user_id == user_id, Note.id > last_id)
+            .order_by(Note.id.asc()).limit(chunk).all()
+        )
+        if not notes:
+            return
+        ids = [n.id for n in notes]
+        tags, groups = {}, {}
+        for note_id, name in db.session.execute(
+            select(note_tags.c.note_id, Tag.name)
+            .join(Tag, Tag.id == note_tags.c.tag_id).where(note_tags.c.note_id.in_(ids))
+        ):
+            tags.setdefault(note_id, []).append(name)
+        for note_id, name in db.session.execute(
+            select(note_groups.c.note_id, Group.name)
+            .join(Group, Group.id == note_groups.c.group_id).where(note_groups.c.note_id.in_(ids))
+        ):
+            groups.setdefault(note_id, []).append(name)
+        for n in notes:
+            yield json.dumps({
+                "id": n.id,
+                "title": n.title,
+                # Not note_content(): an export would flush the whole per-process cache
+                "content": decrypt_text(n.content_encrypted),
+                "tags": tags.get(n.id, []),
+                "groups": groups.get(n.id, []),
+                "created_at": n.created_at.isoformat() if n.created_at else None,
+                "updated_at": n.updated_at.isoformat() if n.updated_at else None,
+            }, ensure_ascii=False) + "\n"
+        last_id = ids[-1]
+        # Release the chunk; the export may be far larger than memory should hold
+        db.session.expunge_all()
+
+
+def import_lines(user_id: int, lines, chunk: int = BATCH_MAX) -> dict:
+    """Create notes from NDJSON lines, committing every `chunk` notes; bad lines are reported, not fatal."""
+    imported, errors, pending = 0, [], []
+    for number, raw in enumerate(lines, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            item = json.loads(raw)
+        except ValueError:
+            errors.append({"line": number, "error": "invalid json"})
+            continue
+        if not isinstance(item, dict):
+            errors.append({"line": number, "error": "expected an object"})
+            continue
+        error = item_error(item)
+        if error:
+            errors.append({"line": number, "error": error})
+            continue
+        pending.append(item)
+        if len(pending) >= chunk:
+            imported += len(create_notes(user_id, pending))
+            db.session.commit()
+            pending = []
+    imported += len(create_notes(user_id, pending))
+    db.session.commit()
+    return {"imported": imported, "errors": errors}
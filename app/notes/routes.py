@@ -1,19 +1,51 @@
-from flask import Blueprint, render_template, request, jsonify, current_app, send_file, abort
+from flask import Blueprint, Response, render_template, request, jsonify, current_app, abort, stream_with_context
 from flask_login import login_required, current_user
-from sqlalchemy import or_
-import os
+from sqlalchemy import or_, and_, select, func
+from sqlalchemy.orm import selectinload
 import mimetypes
-import uuid
+from datetime import datetime, timedelta
+import click
 
 from .. import get_db
-from ..models import Note, Tag, Group, Attachment, DriveFile
-from ..security import encrypt_text, decrypt_text
+from ..models import Note, Tag, Group, Attachment, DriveFile, note_tags
+from . import ops, search
+from .content import note_content
+from ..uploads import UploadLimit, streaming_upload, max_file_bytes, upload_size
+from ..blobs import blob_tmp_dir, store_upload, release_blob
+from ..downloads import send_stored_file
+from ..ratelimit import rate_limit
 
 notes_bp = Blueprint("notes", __name__)
 
 db = get_db()
 
 
+NOTES_PAGE_DEFAULT = 50
+NOTES_PAGE_MAX = 200
+# Rows read per round when a query too short for the search index is checked note by note
+NOTES_SCAN_CHUNK = 500
+
+
+def _make_cursor(note: Note) -> str:
+    return f"{note.updated_at.isoformat()}|{note.id}"
+
+
+def _after(query, after):
+    """Rows after (updated_at, id) in the listing's newest-first order."""
+    if after is None:
+        return query
+    after_ts, after_id = after
+    return query.filter(or_(
+        Note.updated_at < after_ts,
+        and_(Note.updated_at == after_ts, Note.id < after_id),
+    ))
+
+
+def _parse_cursor(raw: str):
+    ts, _, note_id = raw.partition("|")
+    return datetime.fromisoformat(ts), int(note_id)
+
+
 @notes_bp.get("/")
 @login_required
 def index():
@@ -72,34 +104,82 @@ def delete_group(group_id: int):
 @login_required
 def list_notes():
     q = request.args.get("q", "").strip().lower()
-    tag = request.args.get("tag")
+    tags = {t.strip() for t in request.args.getlist("tag") if t.strip()}
+    tag_mode = (request.args.get("tag_mode") or "or").lower()
     group_id = request.args.get("group_id", type=int)
     date = request.args.get("date")  # YYYY-MM-DD
+    view = request.args.get("view", "full")  # full | list
+    limit = max(1, min(NOTES_PAGE_MAX, request.args.get("limit", type=int) or NOTES_PAGE_DEFAULT))
+    cursor = request.args.get("cursor")
 
     query = Note.query.filter_by(user_id=current_user.id)
     if group_id:
         query = query.join(Note.groups).filter(Group.id == group_id)
-    notes = query.order_by(Note.updated_at.desc()).all()
+    if tags:
+        tagged = (
+            select(note_tags.c.note_id)
+            .join(Tag, Tag.id == note_tags.c.tag_id)
+            .where(Tag.name.in_(tags))
+        )
+        if tag_mode == "and":
+            tagged = tagged.group_by(note_tags.c.note_id).having(func.count(Tag.id) == len(tags))
+        query = query.filter(Note.id.in_(tagged))
+    if date:
+        try:
+            day = datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            return jsonify({"error": "invalid date"}), 400
+        query = query.filter(Note.updated_at >= day, Note.updated_at < day + timedelta(days=1))
+    candidates = None
+    if q:
+        candidates = search.candidate_ids(current_user.id, q)
+        if candidates is not None:
+            query = query.filter(Note.id.in_(candidates))
+    after = None
+    if cursor:
+        try:
+            after = _parse_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "invalid cursor"}), 400
+    query = (
+        query.options(selectinload(Note.tags), selectinload(Note.groups), selectinload(Note.attachments))
+        .order_by(Note.updated_at.desc(), Note.id.desc())
+    )
+    # q is checked against the decrypted text, so rows the index let through (or, for
+    # queries too short for it, every row) may drop out; keep reading until the page is full
+    fetch = NOTES_SCAN_CHUNK if q and candidates is None else limit + 1
+    found = []
+    while len(found) <= limit:
+        chunk = _after(query, after).limit(fetch).all()
+        for n in chunk:
+            content = note_content(n)
+            if not q or search.matches(q, n.title, content):
+                found.append((n, content))
+        if len(chunk) < fetch:
+            break
+        after = (chunk[-1].updated_at, chunk[-1].id)
+    next_cursor = None
+    if len(found) > limit:
+        found = found[:limit]
+        next_cursor = _make_cursor(found[-1][0])
 
     result = []
-    for n in notes:
-        content = decrypt_text(n.content_encrypted)
-        if q and (q not in n.title.lower() and q not in content.lower()):
-            continue
-        if tag and not any(t.name == tag for t in n.tags):
-            continue
-        if date and n.updated_at.strftime('%Y-%m-%d') != date:
-            continue
-        result.append({
+    for n, content in found:
+        item = {
             "id": n.id,
             "title": n.title,
-            "content": content,
             "tags": [t.name for t in n.tags],
             "groups": [ {"id": g.id, "name": g.name} for g in n.groups ],
             "attachments": [ {"id": a.id, "filename": a.filename, "mime_type": a.mime_type, "size": a.size_bytes} for a in n.attachments ],
             "updated_at": n.updated_at.isoformat(),
-        })
-    return jsonify(result)
+            "revision": n.revision,
+        }
+        if view == "list":
+            item["snippet"] = content[:180]
+        else:
+            item["content"] = content
+        result.append(item)
+    return jsonify({"items": result, "next_cursor": next_cursor})
 
 
 @notes_bp.get("/search")
@@ -110,30 +190,38 @@ def search_page():
 
 @notes_bp.get("/api/search")
 @login_required
+@rate_limit("search", "120/minute", per="user", shared=False)
 def api_search():
     q = (request.args.get("q") or "").strip().lower()
     notes_out = []
     files_out = []
     if q:
-        notes = Note.query.filter_by(user_id=current_user.id).order_by(Note.updated_at.desc()).all()
-        for n in notes:
-            content = decrypt_text(n.content_encrypted)
-            if q in (n.title or '').lower() or q in (content or '').lower():
+        notes_q = Note.query.filter_by(user_id=current_user.id)
+        candidates = search.candidate_ids(current_user.id, q)
+        if candidates is not None:
+            notes_q = notes_q.filter(Note.id.in_(candidates))
+        for n in notes_q.order_by(Note.updated_at.desc()).all():
+            content = note_content(n)
+            if search.matches(q, n.title, content):
                 notes_out.append({
                     "id": n.id,
                     "title": n.title,
                     "snippet": (content or '')[:180],
                     "updated_at": n.updated_at.isoformat(),
                 })
-        files = DriveFile.query.filter_by(user_id=current_user.id).order_by(DriveFile.uploaded_at.desc()).all()
+        files = (
+            DriveFile.query.filter_by(user_id=current_user.id)
+            .filter(func.lower(DriveFile.filename).contains(q, autoescape=True))
+            .order_by(DriveFile.uploaded_at.desc())
+            .all()
+        )
         for f in files:
-            if q in (f.filename or '').lower():
-                files_out.append({
-                    "id": f.id,
-                    "filename": f.filename,
-                    "size": f.size_bytes,
-                    "uploaded_at": f.uploaded_at.isoformat(),
-                })
+            files_out.append({
+                "id": f.id,
+                "filename": f.filename,
+                "size": f.size_bytes,
+                "uploaded_at": f.uploaded_at.isoformat(),
+            })
     return jsonify({"notes": notes_out, "files": files_out})
 
 
@@ -141,101 +229,92 @@ def api_search():
 @login_required
 def create_note():
     data = request.get_json(force=True)
-    title = (data.get("title") or "").strip() or "Без названия"
-    content = data.get("content") or ""
-    tags = data.get("tags") or []
-    groups = data.get("groups") or []  
-
-    note = Note(user_id=current_user.id, title=title, content_encrypted=encrypt_text(content))
-
-    tag_models = []
-    for name in tags:
-        if isinstance(name, str):
-            name = name.strip()
-        if not name:
-            continue
-        tag = Tag.query.filter_by(name=name).first()
-        if not tag:
-            tag = Tag(name=name)
-            db.session.add(tag)
-        tag_models.append(tag)
-    note.tags = tag_models
-
-    group_models = []
-    for gname in groups:
-        if isinstance(gname, str):
-            gname = gname.strip()
-        if not gname:
-            continue
-        g = Group.query.filter_by(user_id=current_user.id, name=gname).first()
-        if not g:
-            g = Group(user_id=current_user.id, name=gname)
-            db.session.add(g)
-        group_models.append(g)
-    note.groups = group_models
-
-    db.session.add(note)
+    if not isinstance(data, dict):
+        return jsonify({"error": "object required"}), 400
+    error = ops.item_error(data)
+    if error:
+        return jsonify({"error": error}), 400
+    created = ops.create_notes(current_user.id, [data])[0]
     db.session.commit()
-
-    return jsonify({"id": note.id}), 201
+    return jsonify(created), 201
 
 
 @notes_bp.patch("/api/notes/<int:note_id>")
 @login_required
 def update_note(note_id: int):
+    """Apply the fields present in the body, skipping those equal to the stored ones.
+
+    With "revision" the change applies only on top of that revision; a stale
+    one gets 409 and the current revision. Search tokens are rebuilt later
+    by one job per burst of saves.
+    """
     note = Note.query.filter_by(id=note_id, user_id=current_user.id).first_or_404()
     data = request.get_json(force=True)
-
-    if "title" in data:
-        title = (data.get("title") or "").strip()
-        if title:
-            note.title = title
-    if "content" in data:
-        note.content_encrypted = encrypt_text(data.get("content") or "")
-    if "tags" in data:
-        tags = data.get("tags") or []
-        tag_models = []
-        for name in tags:
-            if isinstance(name, str):
-                name = name.strip()
-            if not name:
-                continue
-            tag = Tag.query.filter_by(name=name).first()
-            if not tag:
-                tag = Tag(name=name)
-                db.session.add(tag)
-            tag_models.append(tag)
-        note.tags = tag_models
-    if "groups" in data:
-        groups = data.get("groups") or []
-        group_models = []
-        for gname in groups:
-            if isinstance(gname, str):
-                gname = gname.strip()
-            if not gname:
-                continue
-            g = Group.query.filter_by(user_id=current_user.id, name=gname).first()
-            if not g:
-                g = Group(user_id=current_user.id, name=gname)
-                db.session.add(g)
-            group_models.append(g)
-        note.groups = group_models
-
-    db.session.commit()
-    return jsonify({"ok": True})
+    if not isinstance(data, dict):
+        return jsonify({"error": "object required"}), 400
+    body, status = ops.update_note(note, data)
+    if status == 200:
+        db.session.commit()
+    return jsonify(body), status
 
 
 @notes_bp.delete("/api/notes/<int:note_id>")
 @login_required
 def delete_note(note_id: int):
     note = Note.query.filter_by(id=note_id, user_id=current_user.id).first_or_404()
-    db.session.delete(note)
+    ops.delete_notes([note.id])
     db.session.commit()
     return jsonify({"ok": True})
 
 
+@notes_bp.post("/api/notes/batch")
+@login_required
+@rate_limit("notes-batch", "60/minute", per="user")
+def batch_notes():
+    """Up to ops.BATCH_MAX operations in one transaction:
+    {"ops": [{"op": "create", "title": ..., "content": ..., "tags": [...], "groups": [...]},
+             {"op": "update", "id": 1, "revision": 3, "content": ...},
+             {"op": "move", "id": 1, "group_id": 2 | null},
+             {"op": "duplicate", "id": 1},
+             {"op": "delete", "id": 1}]}
+    """
+    data = request.get_json(force=True)
+    items = data.get("ops") if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "ops required"}), 400
+    if len(items) > ops.BATCH_MAX:
+        return jsonify({"error": f"at most {ops.BATCH_MAX} ops per request"}), 400
+    results = ops.apply_batch(current_user.id, items)
+    db.session.commit()
+    return jsonify({"results": results})
+
+
+@notes_bp.get("/api/notes/export")
+@login_required
+def export_notes():
+    """Every note of the user as NDJSON, streamed."""
+    resp = Response(stream_with_context(ops.export_lines(current_user.id)), mimetype="application/x-ndjson")
+    resp.headers["Content-Disposition"] = "attachment; filename=notes.ndjson"
+    return resp
+
+
+@notes_bp.post("/api/notes/import")
+@login_required
+@rate_limit("notes-batch", "60/minute", per="user")
+def import_notes():
+    """Create notes from an NDJSON body, one note per line in the export format (ids are ignored)."""
+    lines = (line.decode("utf-8", "replace") for line in request.stream)
+    return jsonify(ops.import_lines(current_user.id, lines))
+
+
+def _attachment_upload_limit():
+    return UploadLimit(blob_tmp_dir(), max_file_bytes(),
+                       allowed_extensions=current_app.config.get("ALLOWED_EXTENSIONS"))
+
+
 @notes_bp.post("/api/notes/<int:note_id>/attachments")
 @login_required
+@streaming_upload(_attachment_upload_limit)
 def upload_attachment(note_id: int):
     note = Note.query.filter_by(id=note_id, user_id=current_user.id).first_or_404()
     if "file" not in request.files:
@@ -244,29 +323,13 @@ def upload_attachment(note_id: int):
     if f.filename == "":
         return jsonify({"error": "empty filename"}), 400
 
-    uploads_dir = current_app.config["UPLOAD_FOLDER"]
-    os.makedirs(uploads_dir, exist_ok=True)
-    ext = os.path.splitext(f.filename)[1]
-    safe_name = uuid.uuid4().hex + ext
-    stored_path = os.path.join(uploads_dir, safe_name)
-
-    # Constraints
-    allowed = set((current_app.config.get("ALLOWED_EXTENSIONS") or []))
-    ext_lower = (ext[1:] if ext.startswith('.') else ext).lower()
-    if allowed and ext_lower not in allowed:
-        return jsonify({"error": "type not allowed"}), 415
-    # Save and size check
-    f.save(stored_path)
-    size_bytes = os.path.getsize(stored_path)
-    max_mb = int(current_app.config.get("MAX_FILE_SIZE_MB") or 20)
-    if size_bytes > max_mb * 1024 * 1024:
-        try:
-            os.remove(stored_path)
-        except Exception:
-            pass
-        return jsonify({"error": "file too large"}), 413
+    limit = _attachment_upload_limit()
+    limit.check_filename(f.filename)
+    limit.check_size(upload_size(f))
+    stored_path, sha256, size_bytes = store_upload(f)
 
-    att = Attachment(note_id=note.id, filename=f.filename, stored_path=stored_path, mime_type=f.mimetype, size_bytes=size_bytes)
+    att = Attachment(note_id=note.id, filename=f.filename, stored_path=stored_path, mime_type=f.mimetype,
+                     size_bytes=size_bytes, sha256=sha256)
     db.session.add(att)
     db.session.commit()
 
@@ -280,7 +343,7 @@ def download_attachment(att_id: int):
     if att.note.user_id != current_user.id:
         abort(404)
     mime = att.mime_type or mimetypes.guess_type(att.filename)[0] or "application/octet-stream"
-    return send_file(att.stored_path, mimetype=mime, as_attachment=False, download_name=att.filename)
+    return send_stored_file(att.stored_path, mime, att.filename, digest=att.sha256, last_modified=att.uploaded_at)
 
 
 @notes_bp.delete("/api/attachments/<int:att_id>")
@@ -289,11 +352,15 @@ def delete_attachment(att_id: int):
     att = Attachment.query.get_or_404(att_id)
     if att.note.user_id != current_user.id:
         abort(404)
-    try:
-        if os.path.exists(att.stored_path):
-            os.remove(att.stored_path)
-    except Exception:
-        pass
     db.session.delete(att)
+    release_blob(att.stored_path)
     db.session.commit()
     return jsonify({"ok": True})
+
+
+@notes_bp.cli.command("reindex")
+@click.option("--batch-size", default=200, show_default=True)
+def reindex_command(batch_size: int):
+    """Rebuild the encrypted search index for all notes."""
+    total = search.reindex_all(batch_size=batch_size)
+    click.echo(f"Reindexed {total} notes")
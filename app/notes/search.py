@@ -0,0 +1,123 @@
+from flask import current_app
+from sqlalchemy import select, delete, func, union
+
+from .. import get_db
+from ..jobs import enqueue, job_handler
+from ..models import Job, Note, NoteSearchToken
+from ..security import blind_index, decrypt_text
+
+db = get_db()
+
+REINDEX_JOB = "search-reindex"
+
+GRAM_SIZE = 3
+# Any subset of a query's grams still selects a superset of the matches
+MAX_QUERY_GRAMS = 24
+
+
+def _grams(text: str) -> set:
+    text = (text or "").lower()
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def matches(q: str, title: str, content: str) -> bool:
+    return q in (title or "").lower() or q in (content or "").lower()
+
+
+def token_rows(note_id: int, user_id: int, title: str, content: str) -> list:
+    """note_search_tokens rows of one note."""
+    return [
+        {"note_id": note_id, "user_id": user_id, "token": blind_index(user_id, g)}
+        for g in _grams(title) | _grams(content)
+    ]
+
+
+def index_note(note: Note, content: str) -> None:
+    """Replace the blind-index tokens of a flushed note."""
+    index_notes([(note, content)])
+
+
+def index_notes(pairs: list, fresh: bool = False) -> None:
+    """Replace the tokens of many flushed (note, content) pairs in two statements; fresh: never indexed."""
+    if not fresh:
+        db.session.execute(delete(NoteSearchToken).where(NoteSearchToken.note_id.in_([n.id for n, _ in pairs])))
+    rows = [row for note, content in pairs for row in token_rows(note.id, note.user_id, note.title, content)]
+    if rows:
+        db.session.execute(NoteSearchToken.__table__.insert(), rows)
+
+
+def schedule_reindex(note: Note, content=None) -> None:
+    """Re-index after NOTE_REINDEX_DELAY_SECONDS; saves made meanwhile share one job.
+
+    The job reads the note when it runs, so it indexes the latest text. With
+    a delay of 0, or without background workers to run the job, the note is
+    indexed right away.
+    """
+    delay = current_app.config.get("NOTE_REINDEX_DELAY_SECONDS", 5)
+    if not delay or not current_app.config.get("BACKGROUND_WORKERS", True):
+        index_note(note, content if content is not None else decrypt_text(note.content_encrypted))
+        return
+    enqueue(REINDEX_JOB, {"note_id": note.id}, delay_seconds=delay, dedupe_key=f"reindex:{note.id}")
+
+
+@job_handler(REINDEX_JOB, batch_size=None)
+def reindex_notes(payloads: list) -> list:
+    ids = {p["note_id"] for p in payloads}
+    notes = Note.query.filter(Note.id.in_(ids)).all()
+    if notes:
+        index_notes([(note, decrypt_text(note.content_encrypted)) for note in notes])
+    # Deleted notes were unindexed with them
+    return [None] * len(payloads)
+
+
+def unindex_note(note_id: int) -> None:
+    db.session.execute(delete(NoteSearchToken).where(NoteSearchToken.note_id == note_id))
+
+
+def _pending_reindex_ids() -> list:
+    """Notes saved since their last indexing: their reindex job has not run yet."""
+    keys = db.session.execute(
+        select(Job.dedupe_key).where(Job.kind == REINDEX_JOB, Job.status.in_(("pending", "running")))
+    ).scalars()
+    return [int(key.split(":", 1)[1]) for key in keys if key]
+
+
+def candidate_ids(user_id: int, q: str):
+    """Select of note ids that contain every gram of q, or None if q is too short to use the index.
+
+    Notes waiting for a reindex are included too, since their tokens may be
+    stale; callers check q against the decrypted text anyway.
+    """
+    grams = sorted(_grams(q))[:MAX_QUERY_GRAMS]
+    if not grams:
+        return None
+    tokens = [blind_index(user_id, g) for g in grams]
+    indexed = (
+        select(NoteSearchToken.note_id)
+        .where(NoteSearchToken.user_id == user_id, NoteSearchToken.token.in_(tokens))
+        .group_by(NoteSearchToken.note_id)
+        .having(func.count(NoteSearchToken.token) == len(tokens))
+    )
+    pending = _pending_reindex_ids()
+    if not pending:
+        return indexed
+    return union(indexed, select(Note.id).where(Note.user_id == user_id, Note.id.in_(pending)))
+
+
+def reindex_all(batch_size: int = 200) -> int:
+    last_id = 0
+    total = 0
+    while True:
+        batch = (
+            Note.query.filter(Note.id > last_id)
+            .order_by(Note.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        index_notes([(n, decrypt_text(n.content_encrypted)) for n in batch])
+        db.session.commit()
+        total += len(batch)
+        last_id = batch[-1].id
+    return total
@@ -0,0 +1,318 @@
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, text
+
+perf_cli = AppGroup("perf", help="Performance checks.")
+
+# Upper bound of SQL statements per listing request, independent of row count
+LISTING_QUERY_BUDGET = {
+    "/api/notes?limit=200": 5,
+    "/api/notes?limit=200&view=list&q=note": 5,
+    "/api/search?q=note": 3,
+    "/drive/api/files?per_page=100": 5,
+    "/drive/api/files?per_page=100&folder_id={folder_id}": 6,
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(engine):
+    counter = QueryCounter()
+
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _on_execute)
+
+
+@contextmanager
+def scratch_app(database_uri: str = "sqlite://", **overrides):
+    """A throwaway app on an in-memory database (by default) and a temporary upload folder."""
+    from . import create_app
+    from .migrations import init_database
+
+    uploads = tempfile.mkdtemp(prefix="perf-uploads-")
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": database_uri,
+        "UPLOAD_FOLDER": uploads,
+        "WTF_CSRF_ENABLED": False,
+        "TESTING": True,
+        # One process: rate-limit windows stay out of the measured queries
+        "STATE_STORE_URL": "memory://",
+        **overrides,
+    })
+    with app.app_context():
+        init_database()
+    try:
+        yield app
+    finally:
+        shutil.rmtree(uploads, ignore_errors=True)
+
+
+def _seed(db, rows: int, label=None) -> tuple:
+    from .models import User, Note, Tag, Group, Attachment, DriveFile, DriveFolder, DriveUsage, drive_file_folders
+    from .notes import search
+    from .security import encrypt_text
+
+    label = label or rows
+    user = User(email=f"perf-{label}@example.com")
+    user.set_password("perf")
+    db.session.add(user)
+    db.session.flush()
+    tags = [Tag(name=f"perf-{label}-{i}") for i in range(3)]
+    group = Group(user_id=user.id, name="perf")
+    folder = DriveFolder(user_id=user.id, name="perf")
+    db.session.add_all(tags + [group, folder])
+    db.session.flush()
+    for i in range(rows):
+        content = f"note body {i}"
+        note = Note(user_id=user.id, title=f"note {i}", content_encrypted=encrypt_text(content))
+        note.tags = tags[:2]
+        note.groups = [group]
+        note.attachments = [Attachment(filename=f"a{i}.txt", stored_path="/dev/null", size_bytes=1)]
+        db.session.add(note)
+        db.session.flush()
+        search.index_note(note, content)
+        for in_folder in (False, True):
+            f = DriveFile(user_id=user.id, filename=f"f{i}.txt", stored_path="/dev/null", size_bytes=1)
+            db.session.add(f)
+            if in_folder:
+                db.session.flush()
+                db.session.execute(drive_file_folders.insert().values(file_id=f.id, folder_id=folder.id))
+    db.session.add(DriveUsage(user_id=user.id, file_count=rows * 2, total_bytes=rows * 2))
+    db.session.commit()
+    return user.id, folder.id
+
+
+def _listing_counts(app, rows: int) -> dict:
+    from . import get_db
+
+    db = get_db()
+    # Requests must not share the seeding session, or its identity map hides lazy loads
+    with app.app_context():
+        user_id, folder_id = _seed(db, rows)
+        engine = db.engine
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
+    counts = {}
+    for url in LISTING_QUERY_BUDGET:
+        with count_queries(engine) as counter:
+            resp = client.get(url.format(folder_id=folder_id))
+        if resp.status_code != 200:
+            raise click.ClickException(f"{url} returned {resp.status_code}")
+        counts[url] = counter.count
+    return counts
+
+
+@perf_cli.command("queries")
+@click.option("--small", default=3, show_default=True, help="Rows in the first run.")
+@click.option("--large", default=60, show_default=True, help="Rows in the second run.")
+def check_queries(small: int, large: int):
+    """Fail if a listing endpoint's SQL statement count grows with rows or exceeds its budget."""
+    with scratch_app() as app:
+        small_counts = _listing_counts(app, small)
+        large_counts = _listing_counts(app, large)
+    failed = False
+    for url, budget in LISTING_QUERY_BUDGET.items():
+        a, b = small_counts[url], large_counts[url]
+        ok = a == b and b <= budget
+        failed = failed or not ok
+        click.echo(f"{'ok  ' if ok else 'FAIL'} {url}: {a} -> {b} queries (budget {budget})")
+    if failed:
+        raise click.ClickException("query budget exceeded")
+
+
+# Mixed workload for `perf endpoints`: two listings and a write per round
+ENDPOINT_MIX = (
+    ("GET", "/api/notes?limit=50"),
+    ("GET", "/drive/api/files?per_page=50"),
+    ("POST", "/api/notes"),
+)
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def _endpoint_run(app, user_id: int, threads: int, rounds: int) -> tuple:
+    timings = {path: [] for _, path in ENDPOINT_MIX}
+    errors = []
+    lock = threading.Lock()
+
+    def _client():
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+            sess["_fresh"] = True
+        client.get("/api/notes?limit=1")
+        return client
+
+    def _run(i):
+        client = _client()
+        for n in range(rounds):
+            for method, path in ENDPOINT_MIX:
+                started = time.perf_counter()
+                try:
+                    if method == "POST":
+                        resp = client.post(path, json={"title": f"bench {i}-{n}", "content": "benchmark"})
+                    else:
+                        resp = client.get(path)
+                    failure = None if resp.status_code < 400 else f"{path}: HTTP {resp.status_code}"
+                except Exception as exc:
+                    failure = f"{path}: {str(exc).splitlines()[0]}"
+                elapsed = time.perf_counter() - started
+                with lock:
+                    timings[path].append(elapsed)
+                    if failure:
+                        errors.append(failure)
+
+    workers = [threading.Thread(target=_run, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return timings, errors, time.perf_counter() - started
+
+
+@perf_cli.command("endpoints")
+@click.option("--database-url", default=None,
+              help="Scratch database to benchmark (it gets seeded); defaults to a temporary SQLite file.")
+@click.option("--journal-mode", default=None, help="SQLite journal mode override, e.g. DELETE to compare with WAL.")
+@click.option("--threads", default=8, show_default=True, help="Concurrent clients.")
+@click.option("--rounds", default=50, show_default=True, help="Rounds of the endpoint mix per client.")
+@click.option("--rows", default=200, show_default=True, help="Notes and files seeded before the run.")
+def bench_endpoints(database_url, journal_mode, threads: int, rounds: int, rows: int):
+    """Concurrent notes/drive listings and note creation against one database profile."""
+    from . import get_db
+
+    tmpdir = None
+    if not database_url:
+        tmpdir = tempfile.mkdtemp(prefix="perf-db-")
+        database_url = "sqlite:///" + os.path.join(tmpdir, "bench.db")
+    overrides = {"RATE_LIMITS_ENABLED": False, "BACKGROUND_WORKERS": False}
+    if journal_mode:
+        overrides["SQLITE_JOURNAL_MODE"] = journal_mode
+    try:
+        with scratch_app(database_url, **overrides) as app:
+            db = get_db()
+            with app.app_context():
+                user_id, _ = _seed(db, rows, label=uuid.uuid4().hex[:12])
+                dialect = db.engine.dialect.name
+                profile = db.session.execute(text("PRAGMA journal_mode")).scalar() if dialect == "sqlite" else dialect
+            timings, errors, wall = _endpoint_run(app, user_id, threads, rounds)
+            with app.app_context():
+                db.engine.dispose()
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    total = sum(len(v) for v in timings.values())
+    click.echo(f"{dialect} ({profile}), {threads} threads: {total / wall:.0f} req/s, {len(errors)} errors")
+    for path, values in timings.items():
+        click.echo(f"  {path}: p50 {_percentile(values, 0.5) * 1000:.1f} ms, "
+                   f"p95 {_percentile(values, 0.95) * 1000:.1f} ms")
+    for message in sorted(set(errors))[:5]:
+        click.echo(f"  error: {message}")
+
+
+def _hash_rate(method: str, seconds: float, threads: int) -> float:
+    """Password hashes per second with `threads` threads hashing in parallel."""
+    from .security import hash_password
+
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def _run(i):
+        while time.perf_counter() < deadline:
+            hash_password("benchmark-password", method)
+            counts[i] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=_run, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+@perf_cli.command("hashing")
+@click.option("--method", default=None, help="Werkzeug method string; defaults to PASSWORD_HASH_METHOD.")
+@click.option("--seconds", default=3.0, show_default=True, help="Duration of each run.")
+@click.option("--threads", default=None, type=int, help="Parallel run width; defaults to the CPU count.")
+def bench_hashing(method, seconds: float, threads):
+    """Measure password hashes/sec on one core and across all cores (hashlib releases the GIL)."""
+    from .security import normalize_hash_method, password_hash_method
+
+    method = normalize_hash_method(method) if method else password_hash_method()
+    threads = threads or os.cpu_count() or 1
+    single = _hash_rate(method, seconds, 1)
+    click.echo(f"{method}: {single:.1f} hashes/s per core ({1000 / single:.1f} ms per hash)")
+    if threads > 1:
+        total = _hash_rate(method, seconds, threads)
+        click.echo(f"{method}: {total:.1f} hashes/s with {threads} threads ({total / threads:.1f} per thread)")
+
+
+# Run in a fresh interpreter: time to import the package and build the app, and SQL issued while building
+_STARTUP_PROBE = """
+import json, time
+t0 = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+t1 = time.perf_counter()
+from app import create_app
+t2 = time.perf_counter()
+create_app()
+t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t2 - t1) * 1000, "create_ms": (t3 - t2) * 1000, "queries": len(statements)}))
+"""
+
+
+@perf_cli.command("startup")
+@click.option("--runs", default=5, show_default=True, help="Fresh interpreters to start.")
+def bench_startup(runs: int):
+    """Measure worker boot: package import time, create_app() time and SQL statements it issues."""
+    from .config import PROJECT_ROOT
+
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=PROJECT_ROOT,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            raise click.ClickException(out.stderr.strip().splitlines()[-1] if out.stderr else "probe failed")
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    create_ms = statistics.median(r["create_ms"] for r in results)
+    queries = max(r["queries"] for r in results)
+    click.echo(f"import app: {import_ms:.0f} ms, create_app(): {create_ms:.0f} ms, "
+               f"SQL statements: {queries} (median of {runs})")
@@ -0,0 +1,102 @@
+import math
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+from .state import get_local_state_store, get_state_store
+
+_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+_rejections = Counter()
+_rejections_lock = threading.Lock()
+
+
+class RateLimited(TooManyRequests):
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(retry_after=retry_after)
+        self.limit_name = name
+
+
+def parse_limit(spec: str):
+    """'60/minute' -> (60, 60)."""
+    count, _, unit = spec.partition("/")
+    return int(count), _UNITS[unit.strip().rstrip("s")]
+
+
+def rate_limit(name: str, limit: str, per: str = "ip", shared: bool = True):
+    """Limit a view to `limit` requests per client; per is "ip" or "user" (IP when anonymous).
+
+    RATE_LIMITS[name] in the config overrides the default limit. Checked in
+    a before_request hook, ahead of CSRF and upload parsing. shared=False
+    counts in process memory whatever STATE_STORE_URL is: the limit then
+    applies per worker, but a cheap read-only route writes nothing per request.
+    """
+    def decorator(view):
+        view.rate_limits = getattr(view, "rate_limits", []) + [(name, limit, per, shared)]
+        return view
+    return decorator
+
+
+def _client_key(per: str) -> str:
+    if per == "user" and current_user.is_authenticated:
+        return f"u{current_user.id}"
+    return f"ip{request.remote_addr}"
+
+
+def hit(name: str, client: str, limit: int, window: int, store=None):
+    """Sliding-window counter: the previous window's count, weighted by its overlap, plus this one's.
+
+    Two counters per client and limit, expiring on their own. The request
+    is counted first with one atomic incr, so concurrent requests never
+    pass on the same stale count; rejected requests count too. Returns
+    seconds to wait, or 0 when the request is allowed.
+    """
+    store = store or get_state_store()
+    now = time.time()
+    index = int(now // window)
+    elapsed = now / window - index
+    current = store.incr(f"rl:{name}:{client}:{index}", 2 * window)
+    previous = int(store.get(f"rl:{name}:{client}:{index - 1}") or 0)
+    if previous * (1 - elapsed) + current <= limit:
+        return 0
+    before = current - 1
+    if before >= limit or previous == 0:
+        wait = (1 - elapsed) * window
+    else:
+        # When the previous window's share drops enough to admit one more request
+        wait = (1 - elapsed - (limit - before) / previous) * window
+        wait = min(max(wait, 0), (1 - elapsed) * window)
+    return max(1, math.ceil(wait))
+
+
+def check_rate_limits():
+    if not current_app.config.get("RATE_LIMITS_ENABLED", True) or request.endpoint is None:
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    overrides = current_app.config.get("RATE_LIMITS") or {}
+    for name, default, per, shared in getattr(view, "rate_limits", ()):
+        limit, window = parse_limit(overrides.get(name, default))
+        store = get_state_store() if shared else get_local_state_store()
+        wait = hit(name, _client_key(per), limit, window, store)
+        if wait:
+            with _rejections_lock:
+                _rejections[name] += 1
+            raise RateLimited(name, wait)
+
+
+def handle_rate_limited(exc: RateLimited):
+    if "/api/" in request.path or request.is_json:
+        resp = jsonify({"error": "too many requests", "retry_after": exc.retry_after})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = str(exc.retry_after)
+        return resp
+    return exc.get_response()
+
+
+def rate_limit_stats() -> dict:
+    with _rejections_lock:
+        return {"rejected": dict(_rejections)}
@@ -1,7 +1,14 @@
 import base64
+import hashlib
+import hmac
 import os
 from functools import lru_cache
 from cryptography.fernet import Fernet, InvalidToken
+from flask import current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash
+
+# Werkzeug's own default, spelled out so stored hashes can be compared with it
+DEFAULT_PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
 
 
 def _load_key_from_env() -> bytes:
@@ -14,9 +21,25 @@ def _load_key_from_env() -> bytes:
         raise RuntimeError("Invalid SECURE_ENCRYPTION_KEY") from exc
 
 
+@lru_cache(maxsize=1)
+def _master_key() -> bytes:
+    return _load_key_from_env()
+
+
 @lru_cache(maxsize=1)
 def get_fernet() -> Fernet:
-    return Fernet(_load_key_from_env())
+    return Fernet(_master_key())
+
+
+@lru_cache(maxsize=1)
+def _search_key() -> bytes:
+    return hmac.new(_master_key(), b"note-search-index", hashlib.sha256).digest()
+
+
+def blind_index(user_id: int, term: str) -> str:
+    # Keyed and per-user, so equal terms of different users never share a token
+    msg = f"{user_id}:{term}".encode("utf-8")
+    return hmac.new(_search_key(), msg, hashlib.sha256).hexdigest()[:32]
 
 
 def encrypt_text(plain_text: str) -> bytes:
@@ -32,3 +55,43 @@ def decrypt_text(cipher_bytes: bytes) -> str:
         return get_fernet().decrypt(cipher_bytes).decode("utf-8")
     except InvalidToken:
         return "[DECRYPTION ERROR]"
+
+
+def normalize_hash_method(method: str) -> str:
+    """Spell out the defaults Werkzeug fills in: "pbkdf2" -> "pbkdf2:sha256:600000".
+
+    ValueError for anything Werkzeug could not hash with.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt" and len(args) in (0, 3):
+        n, r, p = map(int, args) if args else (2**15, 8, 1)
+        # hashlib.scrypt wants a power of two above 1 for n
+        if n > 1 and not n & (n - 1) and r > 0 and p > 0:
+            return f"scrypt:{n}:{r}:{p}"
+    if name == "pbkdf2" and len(args) <= 2:
+        digest = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        hashlib.new(digest)
+        if iterations > 0:
+            return f"pbkdf2:{digest}:{iterations}"
+    raise ValueError(f"Unsupported PASSWORD_HASH_METHOD: {method}")
+
+
+def password_hash_method() -> str:
+    method = DEFAULT_PASSWORD_HASH_METHOD
+    if has_app_context():
+        method = current_app.config.get("PASSWORD_HASH_METHOD") or method
+    return normalize_hash_method(method)
+
+
+def hash_password(password: str, method: str = None) -> str:
+    return generate_password_hash(password, method=method or password_hash_method())
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """True when a stored hash was made with other parameters than the configured ones."""
+    stored = (password_hash or "").split("$", 1)[0]
+    try:
+        return normalize_hash_method(stored) != password_hash_method()
+    except ValueError:
+        return True
@@ -0,0 +1,232 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import Integer, String, case, cast, delete, select
+
+
+class MemoryStateStore:
+    """Per-process key/value store with TTLs; only for a single app process (one worker).
+
+    Expired keys are dropped when touched and by a sweep every SWEEP_EVERY writes.
+    """
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def _wrote(self, now) -> None:
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            for key in [k for k, (_, exp) in self._data.items() if exp is not None and exp <= now]:
+                del self._data[key]
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return entry[0] if entry else None
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (str(value), now + ttl)
+            self._wrote(now)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key: str, ttl: int) -> int:
+        """Increment a counter; the TTL starts with the first increment."""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._live(key, now)
+            value = int(entry[0]) + 1 if entry else 1
+            self._data[key] = (str(value), entry[1] if entry else now + ttl)
+            self._wrote(now)
+            return value
+
+    def ttl(self, key: str):
+        """Seconds until key expires, or None when it does not exist."""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._live(key, now)
+            return max(0, int(entry[1] - now)) if entry else None
+
+
+class RedisStateStore:
+    """Same interface on a Redis server, shared by every app process. Needs the redis package."""
+
+    def __init__(self, url: str, client=None, prefix: str = "notes:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError as exc:
+                raise RuntimeError("STATE_STORE_URL=redis://... requires the redis package") from exc
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _k(self, key: str) -> str:
+        return self.prefix + key
+
+    def get(self, key: str):
+        return self.client.get(self._k(key))
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        self.client.set(self._k(key), str(value), ex=ttl)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*[self._k(k) for k in keys])
+
+    def incr(self, key: str, ttl: int) -> int:
+        value = self.client.incr(self._k(key))
+        if value == 1:
+            self.client.expire(self._k(key), ttl)
+        return value
+
+    def ttl(self, key: str):
+        remaining = self.client.ttl(self._k(key))
+        # -2: no such key; -1: no expiry
+        if remaining is None or remaining == -2:
+            return None
+        return max(0, remaining)
+
+
+class DatabaseStateStore:
+    """Same interface on the app database (table state_entries), shared by every app process.
+
+    Each call is its own short transaction on a separate connection, so
+    request sessions are unaffected. Expired rows are ignored on read and
+    deleted by a sweep every SWEEP_EVERY writes. Counters need
+    INSERT .. ON CONFLICT .. RETURNING, so only SQLite and PostgreSQL are
+    supported.
+    """
+
+    SWEEP_EVERY = 1000
+    DIALECTS = ("sqlite", "postgresql")
+
+    def __init__(self, engine):
+        from .models import StateEntry
+
+        if engine.dialect.name not in self.DIALECTS:
+            raise RuntimeError(
+                f"STATE_STORE_URL=database:// supports SQLite and PostgreSQL, not {engine.dialect.name}; "
+                "use redis:// instead"
+            )
+        self.engine = engine
+        self.table = StateEntry.__table__
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _upsert(self):
+        if self.engine.dialect.name == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(self.table)
+
+    def _wrote(self, conn, now) -> None:
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % self.SWEEP_EVERY == 0
+        if sweep:
+            conn.execute(delete(self.table).where(self.table.c.expires_at <= now))
+
+    def get(self, key: str):
+        t = self.table
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(t.c.value).where(t.c.key == key, t.c.expires_at > time.time())
+            ).scalar()
+
+    def set(self, key: str, value: str, ttl: int) -> None:
+        t = self.table
+        now = time.time()
+        row = {"key": key, "value": str(value), "expires_at": now + ttl}
+        with self.engine.begin() as conn:
+            conn.execute(self._upsert().values(row).on_conflict_do_update(
+                index_elements=[t.c.key], set_={"value": row["value"], "expires_at": row["expires_at"]}
+            ))
+            self._wrote(conn, now)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            with self.engine.begin() as conn:
+                conn.execute(delete(self.table).where(self.table.c.key.in_(keys)))
+
+    def incr(self, key: str, ttl: int) -> int:
+        """Increment a counter; the TTL starts with the first increment.
+
+        One INSERT .. ON CONFLICT DO UPDATE .. RETURNING, so concurrent
+        increments from several processes never read a stale count.
+        """
+        t = self.table
+        now = time.time()
+        expired = t.c.expires_at <= now
+        with self.engine.begin() as conn:
+            # An expired counter starts over
+            value = conn.execute(
+                self._upsert().values(key=key, value="1", expires_at=now + ttl)
+                .on_conflict_do_update(index_elements=[t.c.key], set_={
+                    "value": case((expired, "1"), else_=cast(cast(t.c.value, Integer) + 1, String)),
+                    "expires_at": case((expired, now + ttl), else_=t.c.expires_at),
+                })
+                .returning(t.c.value)
+            ).scalar()
+            self._wrote(conn, now)
+        return int(value)
+
+    def ttl(self, key: str):
+        """Seconds until key expires, or None when it does not exist."""
+        t = self.table
+        now = time.time()
+        with self.engine.connect() as conn:
+            expires_at = conn.execute(
+                select(t.c.expires_at).where(t.c.key == key, t.c.expires_at > now)
+            ).scalar()
+        return None if expires_at is None else max(0, int(expires_at - now))
+
+
+def get_state_store():
+    """Short-lived state (OTP codes, counters, lockouts) of the current app; create_app builds it."""
+    store = current_app.extensions.get("state_store")
+    if store is None:
+        url = current_app.config.get("STATE_STORE_URL") or "memory://"
+        if url.startswith("database://"):
+            from . import get_db
+
+            store = DatabaseStateStore(get_db().engine)
+        elif url.startswith("memory://"):
+            store = MemoryStateStore()
+        elif url.startswith(("redis://", "rediss://", "unix://")):
+            store = RedisStateStore(url)
+        else:
+            raise RuntimeError(f"Unsupported STATE_STORE_URL: {url}")
+        current_app.extensions["state_store"] = store
+    return store
+
+
+def get_local_state_store():
+    """A MemoryStateStore of this process, for counters that need not be shared between workers."""
+    store = get_state_store()
+    if isinstance(store, MemoryStateStore):
+        return store
+    store = current_app.extensions.get("local_state_store")
+    if store is None:
+        store = current_app.extensions["local_state_store"] = MemoryStateStore()
+    return store
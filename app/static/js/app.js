@@ -13,7 +13,11 @@ async function api(method, url, body, isForm = false) {
   if (body && !isForm) opts.body = JSON.stringify(body);
   if (body && isForm) opts.body = body;
   const res = await fetch(url, opts);
-  if (!res.ok) throw new Error(await res.text());
+  if (!res.ok) {
+    const err = new Error(await res.text());
+    err.status = res.status;
+    throw err;
+  }
   try { return await res.json(); } catch { return {}; }
 }
 
@@ -183,31 +187,34 @@ function buildAttachmentNode(att) {
   return wrap;
 }
 
-async function loadNotes() {
+const NOTES_PAGE_SIZE = 50;
+
+function notesUrl(cursor) {
+  const q = document.getElementById('search')?.value || '';
+  const date = document.getElementById('dateFilter')?.value || '';
+  const tags = splitList(document.getElementById('tags')?.value || '');
+  const url = new URL('/api/notes', window.location.origin);
+  if (q) url.searchParams.set('q', q);
+  if (currentGroupId) url.searchParams.set('group_id', currentGroupId);
+  if (date) url.searchParams.set('date', date);
+  tags.forEach(t => url.searchParams.append('tag', t));
+  if (tags.length) url.searchParams.set('tag_mode', tagMode.toLowerCase());
+  url.searchParams.set('limit', NOTES_PAGE_SIZE);
+  if (cursor) url.searchParams.set('cursor', cursor);
+  return url.pathname + url.search;
+}
+
+async function loadNotes(cursor) {
   try {
-    const q = document.getElementById('search')?.value || '';
-    const date = document.getElementById('dateFilter')?.value || '';
-    const tags = splitList(document.getElementById('tags')?.value || '');
-    const url = new URL('/api/notes', window.location.origin);
-    if (q) url.searchParams.set('q', q);
-    if (currentGroupId) url.searchParams.set('group_id', currentGroupId);
-    if (date) url.searchParams.set('date', date);
-    const list = await api('GET', url.pathname + url.search);
+    const page = await api('GET', notesUrl(cursor));
 
     const container = document.getElementById('notes');
     if (!container) return;
-    container.innerHTML = '';
+    if (!cursor) container.innerHTML = '';
     const tpl = document.getElementById('noteCardTpl');
 
-    const tagMatch = (noteTags) => {
-      if (!tags.length) return true;
-      const set = new Set(noteTags || []);
-      return tagMode === 'AND' ? tags.every(t => set.has(t)) : tags.some(t => set.has(t));
-    };
-
-    const filtered = (list || []).filter(n => tagMatch(n.tags));
     const pinSet = getPinned();
-    const notes = applyOrder(filtered).sort((a, b) => (pinSet.has(b.id) - pinSet.has(a.id)));
+    const notes = applyOrder(page.items || []).sort((a, b) => (pinSet.has(b.id) - pinSet.has(a.id)));
 
     notes.forEach(n => {
       const node = tpl.content.cloneNode(true);
@@ -266,14 +273,45 @@ async function loadNotes() {
 
       const getContent = () => quill ? quill.root.innerHTML : (ql ? ql.innerHTML : '');
 
-      const debouncedSave = debounce(async () => {
-        await api('PATCH', `/api/notes/${n.id}`, {
-          title: title ? title.value : n.title,
-          content: getContent(),
-          tags: splitList(tagInput ? tagInput.value : ''),
-          groups: splitList(groupInput ? groupInput.value : '')
+      const currentState = () => ({
+        title: title ? title.value : n.title,
+        content: getContent(),
+        tags: splitList(tagInput ? tagInput.value : ''),
+        groups: splitList(groupInput ? groupInput.value : '')
+      });
+      // What the server has at `revision`; saves send only the fields that differ from it
+      let saved = currentState();
+      let revision = n.revision;
+      let saving = null;
+      let dirty = false;
+
+      const save = () => {
+        if (saving) { dirty = true; return saving; }
+        const state = currentState();
+        const delta = {};
+        Object.keys(state).forEach(key => {
+          if (JSON.stringify(state[key]) !== JSON.stringify(saved[key])) delta[key] = state[key];
         });
-      }, 600);
+        if (!Object.keys(delta).length) return Promise.resolve();
+        delta.revision = revision;
+        saving = api('PATCH', `/api/notes/${n.id}`, delta)
+          .then(res => { saved = state; revision = res.revision; })
+          .catch(err => {
+            if (err.status === 409) {
+              alert('Заметка изменена в другой вкладке, загружаю актуальную версию');
+              dirty = false;
+              loadNotes();
+            } else {
+              console.error('Failed to save note', err);
+            }
+          })
+          .finally(() => {
+            saving = null;
+            if (dirty) { dirty = false; save(); }
+          });
+        return saving;
+      };
+      const debouncedSave = debounce(save, 600);
 
       title && title.addEventListener('input', debouncedSave);
       quill && quill.on('text-change', debouncedSave);
@@ -282,12 +320,7 @@ async function loadNotes() {
       groupInput && groupInput.addEventListener('input', debouncedSave);
 
       saveBtn && saveBtn.addEventListener('click', async () => {
-        await api('PATCH', `/api/notes/${n.id}`, {
-          title: title ? title.value : n.title,
-          content: getContent(),
-          tags: splitList(tagInput ? tagInput.value : ''),
-          groups: splitList(groupInput ? groupInput.value : '')
-        });
+        await save();
         await loadNotes();
       });
 
@@ -321,7 +354,7 @@ async function loadNotes() {
           m.style.top = e.pageY + 'px';
           const items = [
             { label: 'Закрепить/Открепить', action: () => pinBtn.click() },
-            { label: 'Дублировать', action: async () => { await api('POST', '/api/notes', { title: (title ? title.value : n.title) + ' (копия)', content: getContent(), tags: splitList(tagInput ? tagInput.value : ''), groups: splitList(groupInput ? groupInput.value : '') }); loadNotes(); } },
+            { label: 'Дублировать', action: async () => { await save(); await api('POST', '/api/notes/batch', { ops: [{ op: 'duplicate', id: n.id }] }); loadNotes(); } },
             { label: 'Развернуть', action: () => expandBtn && expandBtn.click() },
             { label: 'Удалить', action: () => delBtn && delBtn.click() },
           ];
@@ -373,6 +406,17 @@ async function loadNotes() {
       if (head) head.prepend(pinBtn);
       container.appendChild(node);
     });
+
+    if (page.next_cursor) {
+      const wrap = document.createElement('div');
+      wrap.className = 'col-12 text-center';
+      const more = document.createElement('button');
+      more.className = 'btn btn-outline-secondary';
+      more.textContent = 'Показать ещё';
+      more.onclick = () => { wrap.remove(); loadNotes(page.next_cursor); };
+      wrap.appendChild(more);
+      container.appendChild(wrap);
+    }
   } catch (err) {
     console.error('Failed to load notes', err);
   }
@@ -406,7 +450,7 @@ function initTagControls() {
       loadNotes();
     });
   }
-  input && input.addEventListener('input', () => loadNotes());
+  input && input.addEventListener('input', debounce(() => loadNotes(), 300));
 }
 
 function initHotkeys() {
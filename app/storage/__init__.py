@@ -0,0 +1,32 @@
+from flask import current_app
+
+from .base import Storage, StoredObject
+from .local import LocalStorage
+
+
+def _build(config) -> Storage:
+    backend = (config.get("STORAGE_BACKEND") or "local").lower()
+    if backend == "local":
+        return LocalStorage(config["UPLOAD_FOLDER"])
+    if backend == "s3":
+        from .s3 import S3Storage
+        return S3Storage(
+            config["S3_BUCKET"],
+            prefix=config.get("S3_PREFIX") or "",
+            endpoint_url=config.get("S3_ENDPOINT_URL"),
+            region_name=config.get("S3_REGION"),
+            aws_access_key_id=config.get("S3_ACCESS_KEY_ID"),
+            aws_secret_access_key=config.get("S3_SECRET_ACCESS_KEY"),
+        )
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+def get_storage() -> Storage:
+    """Storage backend of the current app, built on first use."""
+    storage = current_app.extensions.get("storage")
+    if storage is None:
+        storage = current_app.extensions["storage"] = _build(current_app.config)
+    return storage
+
+
+__all__ = ["Storage", "StoredObject", "LocalStorage", "get_storage"]
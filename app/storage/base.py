@@ -0,0 +1,43 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+
+@dataclass
+class StoredObject:
+    size: int
+    modified: datetime
+
+
+class Storage:
+    """Where stored files live. Keys are relative, slash-separated names such as blobs/ab/cd/<sha256>.
+
+    Rows written before keys existed hold absolute local paths; every backend
+    still accepts those.
+    """
+
+    def put_file(self, key: str, local_path: str) -> None:
+        """Move a finished local temp file to key; the temp file is gone afterwards."""
+        raise NotImplementedError
+
+    def open(self, key: str):
+        """Binary file-like object for reading; the caller closes it."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Remove key; a missing key is not an error."""
+        raise NotImplementedError
+
+    def stat(self, key: str):
+        """StoredObject for key, or None when it does not exist."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def local_path(self, key: str):
+        """Filesystem path for key when the backend is a local disk, else None."""
+        return None
+
+    def presign(self, key: str, expires_in: int, download_name=None, mimetype=None):
+        """Time-limited URL a client can download key from directly, or None if unsupported."""
+        return None
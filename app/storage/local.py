@@ -0,0 +1,41 @@
+import os
+from datetime import datetime
+
+from .base import Storage, StoredObject
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        if os.path.isabs(key):
+            return key
+        path = os.path.abspath(os.path.join(self.root, *key.split("/")))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f"storage key escapes the root: {key!r}")
+        return path
+
+    def put_file(self, key: str, local_path: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(local_path, path)
+
+    def open(self, key: str):
+        return open(self._path(key), "rb")
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stat(self, key: str):
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return StoredObject(size=st.st_size, modified=datetime.utcfromtimestamp(st.st_mtime))
+
+    def local_path(self, key: str):
+        return self._path(key)
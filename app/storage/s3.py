@@ -0,0 +1,69 @@
+import os
+from urllib.parse import quote
+
+from .base import Storage, StoredObject
+from .local import LocalStorage
+
+
+class S3Storage(Storage):
+    """Any S3-compatible object store (AWS, MinIO, Ceph RGW, ...). Needs boto3.
+
+    Absolute keys are legacy rows from before object storage; they are read
+    from the local disk of the node that has them.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", client=None, legacy_root: str = "/", **client_kwargs):
+        if client is None:
+            try:
+                import boto3
+            except ImportError as exc:
+                raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package") from exc
+            client = boto3.client("s3", **{k: v for k, v in client_kwargs.items() if v})
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._legacy = LocalStorage(legacy_root)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put_file(self, key: str, local_path: str) -> None:
+        if os.path.isabs(key):
+            return self._legacy.put_file(key, local_path)
+        self.client.upload_file(local_path, self.bucket, self._key(key))
+        os.remove(local_path)
+
+    def open(self, key: str):
+        if os.path.isabs(key):
+            return self._legacy.open(key)
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+
+    def delete(self, key: str) -> None:
+        if os.path.isabs(key):
+            return self._legacy.delete(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def stat(self, key: str):
+        if os.path.isabs(key):
+            return self._legacy.stat(key)
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception as exc:
+            status = getattr(exc, "response", {}).get("ResponseMetadata", {}).get("HTTPStatusCode")
+            if status == 404:
+                return None
+            raise
+        return StoredObject(size=head["ContentLength"], modified=head["LastModified"].replace(tzinfo=None))
+
+    def local_path(self, key: str):
+        return self._legacy.local_path(key) if os.path.isabs(key) else None
+
+    def presign(self, key: str, expires_in: int, download_name=None, mimetype=None):
+        if os.path.isabs(key):
+            return None
+        params = {"Bucket": self.bucket, "Key": self._key(key)}
+        if download_name:
+            params["ResponseContentDisposition"] = f"inline; filename*=UTF-8''{quote(download_name)}"
+        if mimetype:
+            params["ResponseContentType"] = mimetype
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request, current_app, jsonify
+from flask_login import current_user
+
+# Multipart framing around a single file part never comes close to this
+MULTIPART_SLACK = 64 * 1024
+
+
+class UploadRejected(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class UploadLimit:
+    def __init__(self, dest_dir: str, max_bytes=None, quota_bytes=None, allowed_extensions=None):
+        self.dest_dir = dest_dir
+        self.max_bytes = max_bytes
+        self.quota_bytes = quota_bytes
+        self.allowed_extensions = set(allowed_extensions or [])
+
+    def check_size(self, size: int) -> None:
+        if self.max_bytes is not None and size > self.max_bytes:
+            raise UploadRejected("file too large", 413)
+        if self.quota_bytes is not None and size > self.quota_bytes:
+            raise UploadRejected("size quota exceeded", 403)
+
+    def check_filename(self, filename) -> None:
+        ext = os.path.splitext(filename or "")[1]
+        ext_lower = (ext[1:] if ext.startswith('.') else ext).lower()
+        if self.allowed_extensions and ext_lower not in self.allowed_extensions:
+            raise UploadRejected("type not allowed", 415)
+
+
+class LimitedSpool:
+    """Temp file in the destination directory that rejects the upload as soon as a limit is crossed."""
+
+    def __init__(self, limit: UploadLimit):
+        os.makedirs(limit.dest_dir, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=limit.dest_dir, prefix=".upload-")
+        self._file = os.fdopen(fd, "w+b")
+        self._limit = limit
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        try:
+            self._limit.check_size(self.size)
+        except UploadRejected:
+            self.close()
+            raise
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def detach(self) -> str:
+        """Close the spool and hand its file over to the caller."""
+        self._file.close()
+        self.committed = True
+        return self.name
+
+    def close(self) -> None:
+        self._file.close()
+        if not self.committed:
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StreamingRequest(Request):
+    """Streams file parts of views marked with streaming_upload() straight into a LimitedSpool.
+
+    The form may be parsed before the view runs (CSRF reads it), so the limit
+    is resolved here from the matched endpoint rather than inside the view.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = self._upload_limit()
+        if limit is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        if filename:
+            limit.check_filename(filename)
+        if total_content_length:
+            limit.check_size(max(0, total_content_length - MULTIPART_SLACK))
+        return LimitedSpool(limit)
+
+    def _upload_limit(self):
+        if self.url_rule is None or not current_user.is_authenticated:
+            return None
+        view = current_app.view_functions.get(self.url_rule.endpoint)
+        resolve = getattr(view, "upload_limit", None)
+        return resolve() if resolve else None
+
+
+def streaming_upload(resolve):
+    """Mark a view so its uploads stream to disk under the UploadLimit returned by resolve()."""
+    def decorator(view):
+        view.upload_limit = resolve
+        return view
+    return decorator
+
+
+def max_file_bytes() -> int:
+    return int(current_app.config.get("MAX_FILE_SIZE_MB") or 20) * 1024 * 1024
+
+
+def upload_size(f) -> int:
+    if isinstance(f.stream, LimitedSpool):
+        return f.stream.size
+    pos = f.stream.tell()
+    f.stream.seek(0, os.SEEK_END)
+    size = f.stream.tell()
+    f.stream.seek(pos)
+    return size
+
+
+def upload_digest(f) -> str:
+    if isinstance(f.stream, LimitedSpool):
+        return f.stream.sha256
+    digest = hashlib.sha256()
+    pos = f.stream.tell()
+    f.stream.seek(0)
+    for block in iter(lambda: f.stream.read(64 * 1024), b""):
+        digest.update(block)
+    f.stream.seek(pos)
+    return digest.hexdigest()
+
+
+def upload_to_temp(f, dest_dir: str) -> str:
+    """Local temp file holding the upload; a streamed spool is handed over without copying."""
+    if isinstance(f.stream, LimitedSpool):
+        return f.stream.detach()
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=dest_dir, prefix=".upload-")
+    os.close(fd)
+    f.save(path)
+    return path
+
+
+def handle_upload_rejected(exc: UploadRejected):
+    return jsonify({"error": exc.message}), exc.status
@@ -0,0 +1,71 @@
+import threading
+
+from . import get_db
+
+db = get_db()
+
+
+class PeriodicWorker(threading.Thread):
+    """Daemon thread calling fn() inside an app context.
+
+    While fn() reports work done it is called again right away; otherwise the
+    thread sleeps via wait(interval), which may return early.
+    """
+
+    def __init__(self, app, name: str, interval: float, fn, wait=None):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.fn = fn
+        self._stop_event = threading.Event()
+        self._wait = wait or self._stop_event.wait
+
+    def run(self) -> None:
+        busy = False
+        while not self._stop_event.is_set():
+            if not busy:
+                self._wait(self.interval)
+                if self._stop_event.is_set():
+                    break
+            with self.app.app_context():
+                try:
+                    busy = bool(self.fn())
+                except Exception:
+                    busy = False
+                    db.session.rollback()
+                    self.app.logger.exception("Background worker %s failed", self.name)
+                finally:
+                    db.session.remove()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+_start_lock = threading.Lock()
+
+
+def _purge_step():
+    from .blobs import purge_pending
+    processed, failed = purge_pending()
+    return processed and not failed
+
+
+def start_workers(app) -> None:
+    """Start this process's background workers once; called on the first request."""
+    if app.extensions.get("workers") is not None:
+        return
+    with _start_lock:
+        if app.extensions.get("workers") is not None:
+            return
+        workers = []
+        if app.config.get("BACKGROUND_WORKERS") and not app.testing:
+            from .jobs import run_due_jobs, wait_for_jobs
+            interval = int(app.config.get("PURGE_INTERVAL_SECONDS") or 0)
+            if interval > 0:
+                workers.append(PeriodicWorker(app, "storage-purge", interval, _purge_step))
+            poll = float(app.config.get("JOB_POLL_SECONDS") or 1)
+            for i in range(int(app.config.get("JOB_WORKERS") or 0)):
+                workers.append(PeriodicWorker(app, f"jobs-{i}", poll, run_due_jobs, wait=wait_for_jobs))
+        for worker in workers:
+            worker.start()
+        app.extensions["workers"] = workers
@@ -0,0 +1,98 @@
+import os
+from contextlib import contextmanager
+
+import pytest
+from cryptography.fernet import Fernet
+
+# Config reads the key at import time
+os.environ.setdefault("SECURE_ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+from app import create_app, get_db, get_identity_cache, get_note_cache, get_tag_cache  # noqa: E402
+from app.migrations import init_database  # noqa: E402
+from app.models import User  # noqa: E402
+
+TEST_CONFIG = {
+    "WTF_CSRF_ENABLED": False,
+    "TESTING": True,
+    "RATE_LIMITS_ENABLED": False,
+    "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+    "NOTE_REINDEX_DELAY_SECONDS": 0,
+}
+
+
+def _clear_caches():
+    # The caches live at module level and would leak ids between test databases
+    for cache in (get_note_cache(), get_identity_cache(), get_tag_cache()):
+        cache.clear()
+
+
+@pytest.fixture
+def make_app(tmp_path_factory):
+    """Build an app on its own database (in memory unless a URI is given) and upload folder.
+
+    init=False leaves the database as it is instead of running init_database.
+    """
+    @contextmanager
+    def make(database_uri="sqlite://", init=True, **overrides):
+        _clear_caches()
+        app = create_app({
+            **TEST_CONFIG,
+            "SQLALCHEMY_DATABASE_URI": database_uri,
+            "UPLOAD_FOLDER": str(tmp_path_factory.mktemp("uploads")),
+            **overrides,
+        })
+        if init:
+            with app.app_context():
+                init_database()
+        try:
+            yield app
+        finally:
+            with app.app_context():
+                get_db().engine.dispose()
+            _clear_caches()
+    return make
+
+
+@pytest.fixture
+def app_config(request):
+    """Config overrides for the app fixture; parametrize it indirectly to change them."""
+    return getattr(request, "param", {})
+
+
+@pytest.fixture
+def app(make_app, app_config):
+    with make_app(**app_config) as app:
+        yield app
+
+
+@pytest.fixture
+def db():
+    return get_db()
+
+
+@pytest.fixture
+def make_user(app):
+    def make(email="user@example.com", password="secret", **fields):
+        with app.app_context():
+            user = User(email=email, **fields)
+            user.set_password(password)
+            get_db().session.add(user)
+            get_db().session.commit()
+            return user.id
+    return make
+
+
+@pytest.fixture
+def login(app):
+    def login(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+            sess["_fresh"] = True
+        return client
+    return login
+
+
+@pytest.fixture
+def client(make_user, login):
+    return login(make_user())
@@ -0,0 +1,124 @@
+import io
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from app import get_identity_cache
+from app.auth.routes import OTP_MAX_FAILS, _otp_keys
+from app.models import User
+from app.state import get_state_store
+
+
+def _code(app, user_id):
+    with app.app_context():
+        return get_state_store().get(_otp_keys(user_id)[0])
+
+
+def _start_login(app):
+    resp = app.test_client().post("/auth/login", data={"email": "user@example.com", "password": "secret"})
+    assert resp.status_code == 302
+    return resp
+
+
+def test_login_with_otp(app, db, make_user):
+    user_id = make_user()
+    assert "/auth/verify" in _start_login(app).headers["Location"]
+    client = app.test_client()
+    resp = client.post("/auth/verify", data={"email": "user@example.com", "code": _code(app, user_id)})
+    assert resp.headers["Location"] == "/"
+    assert client.get("/api/notes").status_code == 200
+    with app.app_context():
+        assert db.session.get(User, user_id).email_verified_at is not None
+
+
+def test_wrong_password_issues_no_code(app, make_user):
+    user_id = make_user()
+    resp = app.test_client().post("/auth/login", data={"email": "user@example.com", "password": "wrong"})
+    assert resp.headers["Location"] == "/auth/login"
+    assert _code(app, user_id) is None
+
+
+def test_repeated_wrong_codes_lock_the_account(app, make_user):
+    user_id = make_user()
+    _start_login(app)
+    code = _code(app, user_id)
+    wrong = "0000" if code != "0000" else "1111"
+    client = app.test_client()
+    for _ in range(OTP_MAX_FAILS):
+        client.post("/auth/verify", data={"email": "user@example.com", "code": wrong})
+    client.post("/auth/verify", data={"email": "user@example.com", "code": code})
+    assert client.get("/api/notes").status_code in (302, 401)
+    resp = app.test_client().post("/auth/login", data={"email": "user@example.com", "password": "secret"})
+    assert resp.headers["Location"] == "/auth/login"
+
+
+def test_login_upgrades_an_outdated_password_hash(app, db, make_user):
+    user_id = make_user()
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.password_hash = generate_password_hash("secret", method="pbkdf2:sha256:900")
+        db.session.commit()
+    _start_login(app)
+    with app.app_context():
+        assert db.session.get(User, user_id).password_hash.startswith("pbkdf2:sha256:1000$")
+
+
+@pytest.mark.parametrize("method", ["bcrypt", "scrypt:1000:8:1", "pbkdf2:nope:1000", "pbkdf2:sha256:x"])
+def test_unusable_hash_method_fails_at_startup(make_app, method):
+    with pytest.raises(RuntimeError, match="PASSWORD_HASH_METHOD"):
+        with make_app(PASSWORD_HASH_METHOD=method):
+            pass
+
+
+@pytest.mark.parametrize("filename, data, mimetype", [
+    ("me.png", b"\x89PNG\r\n\x1a\n" + b"0" * 50, "image/png"),
+    ("me.webp", b"RIFF0000WEBPVP8 ", "image/webp"),
+])
+def test_avatar_is_served_with_its_type(client, filename, data, mimetype):
+    resp = client.post("/auth/profile", data={"avatar": (io.BytesIO(data), filename)},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 302
+    with client.application.app_context():
+        user_id = User.query.one().id
+    resp = client.get(f"/auth/avatar/{user_id}")
+    assert resp.status_code == 200
+    assert resp.mimetype == mimetype
+    assert resp.data == data
+
+
+def _cached_identity(app, user_id):
+    with app.app_context():
+        return get_identity_cache().get(user_id)
+
+
+def test_admin_changes_reach_the_cached_identity(app, make_user, login):
+    user_id = make_user()
+    client = login(user_id)
+    admin = login(make_user("admin@example.com", is_admin=True))
+    assert client.get("/drive/api/files").json["limits"] == {"count": 200, "mb": 500}
+    assert _cached_identity(app, user_id) is not None
+
+    admin.post(f"/admin/users/{user_id}/quota", data={"file_quota_count": "3", "file_quota_mb": "7"})
+    assert client.get("/drive/api/files").json["limits"] == {"count": 3, "mb": 7}
+
+    admin.post(f"/admin/users/{user_id}/reset", data={"password": "changed"})
+    assert _cached_identity(app, user_id) is None
+
+    client.get("/drive/api/files")
+    admin.post(f"/admin/users/{user_id}/delete")
+    assert _cached_identity(app, user_id) is None
+    assert client.get("/drive/api/files").status_code == 302
+
+
+def test_profile_changes_reach_the_cached_identity(app, make_user, login):
+    user_id = make_user()
+    client = login(user_id)
+    assert 'name="name" value=""' in client.get("/auth/profile").get_data(as_text=True)
+    client.post("/auth/profile", data={"name": "Анна"})
+    assert 'name="name" value="Анна"' in client.get("/auth/profile").get_data(as_text=True)
+
+    assert _cached_identity(app, user_id) is not None
+    client.post("/auth/profile", data={"password": "changed"})
+    assert _cached_identity(app, user_id) is None
+    with app.app_context():
+        assert User.query.get(user_id).check_password("changed")
@@ -0,0 +1,138 @@
+import hashlib
+import io
+import os
+
+import pytest
+from sqlalchemy import event
+
+from app.blobs import blob_key, blob_tmp_dir, dedup_stats, enqueue_delete, purge_pending
+from app.models import Blob, PendingDelete, User
+from app.storage import get_storage
+
+DATA = b"same bytes in every upload"
+KEY = blob_key(hashlib.sha256(DATA).hexdigest())
+
+
+def _upload(client, url="/drive/api/files", name="a.txt", data=DATA):
+    resp = client.post(url, data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+    assert resp.status_code == 201, resp.json
+    return resp.json["id"]
+
+
+def _refs(app):
+    with app.app_context():
+        blob = Blob.query.filter_by(sha256=hashlib.sha256(DATA).hexdigest()).first()
+        return blob.ref_count if blob else 0
+
+
+def _queued(app):
+    with app.app_context():
+        return [p.key for p in PendingDelete.query.all()]
+
+
+def test_identical_uploads_share_one_blob(app, client, make_user, login):
+    note_id = client.post("/api/notes", json={"title": "t", "content": "c"}).json["id"]
+    first = _upload(client)
+    second = _upload(login(make_user("other@example.com")), name="b.txt")
+    _upload(client, f"/api/notes/{note_id}/attachments")
+    assert _refs(app) == 3
+    with app.app_context():
+        assert get_storage().exists(KEY)
+        assert dedup_stats()["saved_bytes"] == 2 * len(DATA)
+    assert client.get(f"/drive/api/files/{first}").data == DATA
+    assert second != first
+
+
+def test_last_release_queues_the_bytes_for_purge(app, client):
+    note_id = client.post("/api/notes", json={"title": "t", "content": "c"}).json["id"]
+    file_id = _upload(client)
+    _upload(client, f"/api/notes/{note_id}/attachments")
+
+    assert client.delete(f"/drive/api/files/{file_id}").status_code == 200
+    assert _refs(app) == 1 and _queued(app) == []
+
+    # Deleting the note releases its attachments
+    assert client.delete(f"/api/notes/{note_id}").status_code == 200
+    assert _refs(app) == 0 and _queued(app) == [KEY]
+    with app.app_context():
+        assert purge_pending(grace_seconds=0) == (1, 0)
+        assert not get_storage().exists(KEY)
+    assert _queued(app) == []
+
+
+def test_upload_before_purge_keeps_the_bytes(app, client):
+    client.delete(f"/drive/api/files/{_upload(client)}")
+    assert _queued(app) == [KEY]
+    file_id = _upload(client)
+    assert _queued(app) == []
+    with app.app_context():
+        assert purge_pending(grace_seconds=0) == (0, 0)
+    assert client.get(f"/drive/api/files/{file_id}").data == DATA
+
+
+@pytest.mark.parametrize("app_config", [{"PURGE_MAX_ATTEMPTS": 3}], indirect=True)
+def test_failing_deletes_are_parked(app, db, monkeypatch):
+    with app.app_context():
+        storage = get_storage()
+
+        def fail(key):
+            raise OSError("storage unavailable")
+
+        monkeypatch.setattr(storage, "delete", fail)
+        enqueue_delete(["uploads/legacy.bin"])
+        db.session.commit()
+        assert [purge_pending(grace_seconds=0) for _ in range(4)] == [(1, 1), (1, 1), (1, 1), (0, 0)]
+        row = PendingDelete.query.one()
+        assert row.attempts == 3 and row.parked_at is not None
+        assert dedup_stats()["parked_deletes"] == 1
+
+
+def test_concurrent_first_upload_is_counted(app, db, client):
+    with app.app_context():
+        engine = db.engine
+
+    raced = []
+
+    def insert_first(conn, cursor, statement, parameters, context, executemany):
+        # Another worker commits the same blob between our check and our insert
+        if statement.startswith("INSERT INTO blobs") and not raced:
+            raced.append(True)
+            cursor.connection.execute(
+                "INSERT INTO blobs (sha256, size_bytes, ref_count) VALUES (?, ?, 1)",
+                (hashlib.sha256(DATA).hexdigest(), len(DATA)),
+            )
+
+    event.listen(engine, "before_cursor_execute", insert_first)
+    try:
+        _upload(client)
+    finally:
+        event.remove(engine, "before_cursor_execute", insert_first)
+    assert _refs(app) == 2
+    with app.app_context():
+        assert os.listdir(blob_tmp_dir()) == []
+
+
+def test_deleting_a_user_queues_their_bytes(app, client, make_user, login):
+    note_id = client.post("/api/notes", json={"title": "t", "content": "c"}).json["id"]
+    _upload(client)
+    _upload(client, name="own.txt", data=b"only this user has these bytes")
+    _upload(client, f"/api/notes/{note_id}/attachments", name="att.txt", data=b"attachment bytes")
+    session_id = client.post("/drive/api/uploads", json={"filename": "big.txt", "size": 4}).json["id"]
+    assert client.put(f"/drive/api/uploads/{session_id}/chunks/0", data=b"part").status_code == 200
+    other = login(make_user("other@example.com"))
+    shared_id = _upload(other)
+
+    with app.app_context():
+        user_id = User.query.filter_by(email="user@example.com").one().id
+    admin = login(make_user("admin@example.com", is_admin=True))
+    assert admin.post(f"/admin/users/{user_id}/delete").status_code == 302
+
+    own_keys = [blob_key(hashlib.sha256(data).hexdigest())
+                for data in (b"only this user has these bytes", b"attachment bytes")]
+    assert sorted(_queued(app)) == sorted(own_keys + [f"chunks/{session_id}/0.part"])
+    assert _refs(app) == 1
+    with app.app_context():
+        assert User.query.get(user_id) is None
+        assert purge_pending(grace_seconds=0) == (3, 0)
+        assert not any(get_storage().exists(key) for key in own_keys)
+    assert other.get(f"/drive/api/files/{shared_id}").data == DATA
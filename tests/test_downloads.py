@@ -0,0 +1,72 @@
+import hashlib
+import io
+
+import pytest
+
+DATA = b"0123456789" * 100
+
+
+def _upload(client, data=DATA, name="digits.txt"):
+    resp = client.post("/drive/api/files", data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+    assert resp.status_code == 201, resp.json
+    return f"/drive/api/files/{resp.json['id']}"
+
+
+def test_download_carries_a_strong_etag(client):
+    resp = client.get(_upload(client))
+    assert resp.status_code == 200
+    assert resp.data == DATA
+    assert resp.headers["ETag"] == f'"{hashlib.sha256(DATA).hexdigest()}"'
+    assert resp.headers["Accept-Ranges"] == "bytes"
+    assert resp.last_modified is not None
+
+
+def test_if_none_match_answers_304(client):
+    url = _upload(client)
+    etag = client.get(url).headers["ETag"]
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.data == b""
+    assert client.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_if_modified_since_answers_304(client):
+    url = _upload(client)
+    last_modified = client.get(url).headers["Last-Modified"]
+    resp = client.get(url, headers={"If-Modified-Since": last_modified})
+    assert resp.status_code == 304
+    assert client.get(url, headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}).status_code == 200
+
+
+def test_range_request_answers_206(client):
+    url = _upload(client)
+    resp = client.get(url, headers={"Range": "bytes=10-19"})
+    assert resp.status_code == 206
+    assert resp.data == DATA[10:20]
+    assert resp.headers["Content-Range"] == f"bytes 10-19/{len(DATA)}"
+    assert client.get(url, headers={"Range": f"bytes={len(DATA)}-"}).status_code == 416
+
+
+@pytest.mark.parametrize("app_config", [{"FILE_DELIVERY": "x-accel-redirect"}], indirect=True)
+def test_x_accel_redirect_leaves_the_body_to_the_proxy(app, client):
+    url = _upload(client)
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.data == b""
+    assert resp.headers["X-Accel-Redirect"].startswith("/_protected/blobs/")
+    assert "X-Sendfile" not in resp.headers
+    assert resp.headers["ETag"] == f'"{hashlib.sha256(DATA).hexdigest()}"'
+
+    resp = client.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
+    assert "X-Accel-Redirect" not in resp.headers
+
+
+@pytest.mark.parametrize("app_config", [{"FILE_DELIVERY": "x-sendfile"}], indirect=True)
+def test_x_sendfile_points_at_the_stored_file(app, client):
+    resp = client.get(_upload(client))
+    assert resp.status_code == 200
+    assert resp.data == b""
+    with open(resp.headers["X-Sendfile"], "rb") as fh:
+        assert fh.read() == DATA
+    assert "X-Accel-Redirect" not in resp.headers
@@ -0,0 +1,74 @@
+import io
+
+from sqlalchemy import event
+
+from app.drive.usage import reconcile_usage
+from app.models import User
+
+
+def _upload(client, name="a.txt", data=b"drive bytes", folder_id=None):
+    url = "/drive/api/files" + (f"?folder_id={folder_id}" if folder_id else "")
+    resp = client.post(url, data={"file": (io.BytesIO(data), name)}, content_type="multipart/form-data")
+    assert resp.status_code == 201, resp.json
+    return resp.json["id"]
+
+
+def _usage(client):
+    return client.get("/drive/api/files").json["usage"]
+
+
+def _listing(client, **args):
+    return client.get("/drive/api/files", query_string=args).json
+
+
+def test_pagination_counts_only_the_filtered_files(client):
+    folder_id = client.post("/drive/api/folders", json={"name": "docs"}).json["id"]
+    for i in range(7):
+        _upload(client, f"Отчёт-{i}.txt", folder_id=folder_id)
+    _upload(client, "notes.txt", folder_id=folder_id)
+    for i in range(3):
+        _upload(client, f"root-{i}.txt")
+
+    listing = _listing(client, folder_id=folder_id, q="отчёт", per_page=5)
+    assert listing["pagination"] == {"page": 1, "per_page": 5, "total": 7, "pages": 2}
+    assert len(listing["files"]) == 5
+    last = _listing(client, folder_id=folder_id, q="отчёт", per_page=5, page=2)
+    assert len(last["files"]) == 2
+    assert {f["id"] for f in listing["files"]}.isdisjoint(f["id"] for f in last["files"])
+
+    assert _listing(client)["pagination"]["total"] == 3
+    assert _listing(client, folder_id=folder_id)["pagination"]["total"] == 8
+    assert _listing(client, folder_id=folder_id, q="%")["pagination"]["total"] == 0
+    assert _listing(client, folder_id=folder_id, per_page=5, page=9)["files"] == []
+
+
+def test_usage_follows_uploads_and_deletes(app, client):
+    ids = [_upload(client, f"f{i}.txt", b"x" * (i + 1)) for i in range(3)]
+    assert _usage(client) == {"count": 3, "bytes": 6}
+    client.delete(f"/drive/api/files/{ids[1]}")
+    assert _usage(client) == {"count": 2, "bytes": 4}
+    with app.app_context():
+        assert reconcile_usage() == 0
+
+
+def test_concurrent_first_upload_keeps_usage_exact(app, db, client):
+    with app.app_context():
+        engine = db.engine
+        user_id = User.query.one().id
+    raced = []
+
+    def insert_first(conn, cursor, statement, parameters, context, executemany):
+        # Another upload creates the counter between our UPDATE and our INSERT
+        if statement.startswith("INSERT INTO drive_usage") and not raced:
+            raced.append(True)
+            cursor.connection.execute(
+                "INSERT INTO drive_usage (user_id, file_count, total_bytes) VALUES (?, 0, 0)", (user_id,)
+            )
+
+    event.listen(engine, "before_cursor_execute", insert_first)
+    try:
+        _upload(client, data=b"12345")
+    finally:
+        event.remove(engine, "before_cursor_execute", insert_first)
+    assert raced
+    assert _usage(client) == {"count": 1, "bytes": 5}
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import jobs
+from app.jobs import enqueue, job_handler, run_due_jobs
+from app.models import Job
+from app.perf import count_queries
+
+calls = []
+
+
+@job_handler("test-echo", batch_size=10)
+def _echo(payloads):
+    calls.append(payloads)
+    return [None if p.get("ok", True) else RuntimeError("failed") for p in payloads]
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    calls.clear()
+    monkeypatch.setattr(jobs, "_stale_checked_at", float("-inf"))
+
+
+def test_jobs_run_in_batches_and_failures_are_retried(app, db):
+    with app.app_context():
+        for i in range(3):
+            enqueue("test-echo", {"i": i, "ok": i != 1})
+        db.session.commit()
+        assert run_due_jobs() == 3
+        assert calls == [[{"i": 0, "ok": True}, {"i": 1, "ok": False}, {"i": 2, "ok": True}]]
+        job = Job.query.one()
+        assert job.status == "pending" and job.attempts == 1 and job.run_at > datetime.utcnow()
+        assert run_due_jobs() == 0
+
+
+def test_idle_poll_only_reads(app, db):
+    with app.app_context():
+        run_due_jobs()
+        jobs._stale_checked_at = float("-inf")
+        with count_queries(db.engine) as counter:
+            run_due_jobs()
+            run_due_jobs()
+    assert counter.statements
+    assert all(s.lstrip().upper().startswith("SELECT") for s in counter.statements)
+
+
+def test_stale_running_jobs_are_requeued(app, db):
+    with app.app_context():
+        job = enqueue("test-echo", {"i": 0})
+        db.session.commit()
+        job.status = "running"
+        job.locked_at = datetime.utcnow() - jobs.STALE_AFTER - timedelta(seconds=1)
+        db.session.commit()
+        assert run_due_jobs() == 1
+        assert Job.query.count() == 0
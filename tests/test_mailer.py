@@ -0,0 +1,160 @@
+import socketserver
+import threading
+
+import pytest
+from flask_mail import Message
+
+from app.jobs import run_due_jobs
+from app.mailer import SMTPPool, queue_mail
+from app.models import Job, User
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server: records messages and can refuse the next MAIL FROM."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.refuse_next = 0
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 stand-in")
+        data = None
+        for raw in self.rfile:
+            line = raw.decode().rstrip("\r\n")
+            if data is not None:
+                if line == ".":
+                    server.messages.append("\n".join(data))
+                    data = None
+                    self.reply("250 queued")
+                else:
+                    data.append(line)
+                continue
+            command = line.split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250-stand-in")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command == "AUTH":
+                self.reply("235 ok")
+            elif command == "MAIL" and server.refuse_next:
+                server.refuse_next -= 1
+                self.reply("451 try again later")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP", "HELO"):
+                self.reply("250 ok")
+            elif command == "DATA":
+                data = []
+                self.reply("354 go ahead")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("500 unknown command")
+
+
+@pytest.fixture
+def smtp():
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def mail_app(smtp, make_app):
+    # Flask-Mail reads its settings at init_app, so they go in at create_app
+    with make_app(MAIL_ENABLED=True, MAIL_SUPPRESS_SEND=False, MAIL_SERVER="127.0.0.1",
+                  MAIL_PORT=smtp.server_address[1], MAIL_USE_TLS=False,
+                  MAIL_USERNAME="user", MAIL_PASSWORD="secret") as app:
+        yield app
+
+
+@pytest.fixture
+def app_context(app):
+    # Message.as_bytes() reads the app config
+    with app.app_context():
+        yield
+
+
+def _message(i):
+    return Message(subject=f"s{i}", recipients=[f"r{i}@example.com"], body=f"body {i}", sender="app@example.com")
+
+
+def test_pool_reuses_one_session(smtp, app_context):
+    pool = SMTPPool("127.0.0.1", smtp.server_address[1], username="user", password="secret")
+    assert pool.send_batch([_message(0), _message(1)]) == [None, None]
+    assert pool.send_batch([_message(2)]) == [None]
+    assert len(smtp.messages) == 3
+    assert smtp.connections == 1
+    assert pool.stats()["opened"] == 1 and pool.stats()["reused"] == 1
+    pool.close_all()
+
+
+def test_refused_message_does_not_fail_the_batch(smtp, app_context):
+    pool = SMTPPool("127.0.0.1", smtp.server_address[1])
+    smtp.refuse_next = 1
+    errors = pool.send_batch([_message(0), _message(1)])
+    assert errors[0] is not None and errors[1] is None
+    assert len(smtp.messages) == 1
+    assert pool.stats()["idle"] == 1
+    pool.close_all()
+
+
+def test_sessions_are_recycled_after_max_messages(smtp, app_context):
+    pool = SMTPPool("127.0.0.1", smtp.server_address[1], max_messages=2)
+    for i in range(3):
+        pool.send_batch([_message(i)])
+    assert smtp.connections == 2
+    assert pool.stats()["recycled"] == 1
+    pool.close_all()
+
+
+def test_unreachable_server_fails_every_message(app_context):
+    with socketserver.TCPServer(("127.0.0.1", 0), socketserver.BaseRequestHandler) as closed:
+        port = closed.server_address[1]
+    pool = SMTPPool("127.0.0.1", port, timeout=1)
+    with pytest.raises(OSError):
+        pool.send_batch([_message(0)])
+
+
+def test_queued_mail_is_delivered_and_retried(mail_app, db, smtp):
+    with mail_app.app_context():
+        for i in range(3):
+            queue_mail(f"s{i}", [f"r{i}@example.com"], f"body {i}")
+        db.session.commit()
+        smtp.refuse_next = 1
+        assert run_due_jobs() == 3
+        assert len(smtp.messages) == 2
+        job = Job.query.one()
+        assert job.status == "pending" and job.attempts == 1 and "451" in job.last_error
+
+        job.run_at = job.created_at
+        db.session.commit()
+        assert run_due_jobs() == 1
+        assert len(smtp.messages) == 3 and Job.query.count() == 0
+        assert smtp.connections == 1
+
+
+def test_login_code_is_mailed(mail_app, db, smtp):
+    with mail_app.app_context():
+        user = User(email="user@example.com")
+        user.set_password("secret")
+        db.session.add(user)
+        db.session.commit()
+    resp = mail_app.test_client().post("/auth/login", data={"email": "user@example.com", "password": "secret"})
+    assert resp.status_code == 302
+    with mail_app.app_context():
+        assert run_due_jobs() == 1
+    assert len(smtp.messages) == 1
+    assert "user@example.com" in smtp.messages[0]
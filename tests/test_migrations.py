@@ -0,0 +1,134 @@
+import hashlib
+import sqlite3
+
+from sqlalchemy import create_engine, inspect, text
+
+from app.migrations import _migrations, applied_versions, run_migrations
+from app.security import encrypt_text
+
+# The schema the app created before migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL, email VARCHAR(255) NOT NULL, password_hash VARCHAR(255) NOT NULL,
+    is_admin BOOLEAN NOT NULL, name VARCHAR(255), avatar_path VARCHAR(512), email_verified_at DATETIME,
+    otp_code VARCHAR(8), otp_expires_at DATETIME, otp_send_count INTEGER, otp_last_sent_at DATETIME,
+    otp_fail_count INTEGER, otp_locked_until DATETIME, file_quota_count INTEGER, file_quota_mb INTEGER,
+    created_at DATETIME, PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_users_email ON users (email);
+CREATE TABLE tags (id INTEGER NOT NULL, name VARCHAR(64) NOT NULL, PRIMARY KEY (id));
+CREATE UNIQUE INDEX ix_tags_name ON tags (name);
+CREATE TABLE notes (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, title VARCHAR(255) NOT NULL, content_encrypted BLOB NOT NULL,
+    created_at DATETIME, updated_at DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+CREATE TABLE groups (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, name VARCHAR(128) NOT NULL, created_at DATETIME,
+    PRIMARY KEY (id), CONSTRAINT uq_group_user_name UNIQUE (user_id, name),
+    FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+CREATE TABLE drive_files (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL,
+    stored_path VARCHAR(512) NOT NULL, mime_type VARCHAR(128), size_bytes INTEGER NOT NULL, uploaded_at DATETIME,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+CREATE TABLE drive_folders (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, name VARCHAR(255) NOT NULL, parent_id INTEGER,
+    created_at DATETIME, PRIMARY KEY (id), CONSTRAINT uq_drive_folder_user_parent_name UNIQUE (user_id, parent_id, name),
+    FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE,
+    FOREIGN KEY(parent_id) REFERENCES drive_folders (id) ON DELETE CASCADE
+);
+CREATE TABLE note_tags (
+    note_id INTEGER NOT NULL, tag_id INTEGER NOT NULL, PRIMARY KEY (note_id, tag_id),
+    FOREIGN KEY(note_id) REFERENCES notes (id) ON DELETE CASCADE, FOREIGN KEY(tag_id) REFERENCES tags (id) ON DELETE CASCADE
+);
+CREATE TABLE note_groups (
+    note_id INTEGER NOT NULL, group_id INTEGER NOT NULL, PRIMARY KEY (note_id, group_id),
+    FOREIGN KEY(note_id) REFERENCES notes (id) ON DELETE CASCADE,
+    FOREIGN KEY(group_id) REFERENCES groups (id) ON DELETE CASCADE
+);
+CREATE TABLE drive_file_folders (
+    file_id INTEGER NOT NULL, folder_id INTEGER NOT NULL, PRIMARY KEY (file_id),
+    FOREIGN KEY(file_id) REFERENCES drive_files (id) ON DELETE CASCADE,
+    FOREIGN KEY(folder_id) REFERENCES drive_folders (id) ON DELETE CASCADE
+);
+CREATE TABLE attachments (
+    id INTEGER NOT NULL, note_id INTEGER NOT NULL, filename VARCHAR(255) NOT NULL, stored_path VARCHAR(512) NOT NULL,
+    mime_type VARCHAR(128), size_bytes INTEGER, uploaded_at DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(note_id) REFERENCES notes (id) ON DELETE CASCADE
+);
+CREATE TABLE drive_shares (
+    id INTEGER NOT NULL, file_id INTEGER NOT NULL, token VARCHAR(64) NOT NULL, expires_at DATETIME NOT NULL,
+    created_at DATETIME, created_by INTEGER, PRIMARY KEY (id),
+    FOREIGN KEY(file_id) REFERENCES drive_files (id) ON DELETE CASCADE,
+    FOREIGN KEY(created_by) REFERENCES users (id) ON DELETE SET NULL
+);
+CREATE UNIQUE INDEX ix_drive_shares_token ON drive_shares (token);
+"""
+
+LEGACY_FILE = b"uploaded before the blob store"
+
+
+def _baseline_db(tmp_path):
+    """A database as the first release left it: one user, three notes and a file stored by path."""
+    legacy = tmp_path / "legacy.bin"
+    legacy.write_bytes(LEGACY_FILE)
+    path = tmp_path / "baseline.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO users (id, email, password_hash, is_admin) VALUES (1, 'user@example.com', 'x', 0)")
+    for i in range(3):
+        conn.execute("INSERT INTO notes (user_id, title, content_encrypted, updated_at) VALUES (1, ?, ?, ?)",
+                     (f"Note {i}", encrypt_text(f"legacy content {i}"), f"2020-01-0{i + 1} 00:00:00"))
+    conn.execute("INSERT INTO drive_files (user_id, filename, stored_path, size_bytes) VALUES (1, 'a.txt', ?, ?)",
+                 (str(legacy), len(LEGACY_FILE)))
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{path}"
+
+
+def _declared_indexes(db):
+    return {ix.name for table in db.metadata.tables.values() for ix in table.indexes}
+
+
+def test_baseline_database_is_brought_up_to_date(make_app, db, tmp_path):
+    # make_app runs init_database, which applies every migration
+    with make_app(_baseline_db(tmp_path)) as app:
+        with app.app_context():
+            assert applied_versions(db.engine) == {version for version, _ in _migrations}
+            assert run_migrations(db.engine) == []
+            inspector = inspect(db.engine)
+            indexes = {ix["name"] for table in inspector.get_table_names() for ix in inspector.get_indexes(table)}
+            assert _declared_indexes(db) <= indexes
+            sha256 = db.session.execute(db.text("SELECT sha256 FROM drive_files")).scalar()
+            assert sha256 == hashlib.sha256(LEGACY_FILE).hexdigest()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = "1"
+            sess["_fresh"] = True
+        assert len(client.get("/api/search?q=legacy").json["notes"]) == 3
+        note_id = client.get("/api/notes").json["items"][0]["id"]
+        resp = client.patch(f"/api/notes/{note_id}", json={"revision": 1, "content": "edited"})
+        assert resp.json["revision"] == 2
+
+
+def test_migrations_do_not_need_create_all(make_app, tmp_path):
+    engine = create_engine(_baseline_db(tmp_path))
+    with make_app() as app, app.app_context():
+        assert run_migrations(engine) == [version for version, _ in _migrations]
+        tables = set(inspect(engine).get_table_names())
+        assert {"jobs", "note_search_tokens", "pending_deletes", "state_entries"} <= tables
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(DISTINCT note_id) FROM note_search_tokens")).scalar() == 3
+    engine.dispose()
+
+
+def test_db_migrate_creates_missing_tables(make_app, db, tmp_path):
+    with make_app(_baseline_db(tmp_path), init=False) as app:
+        result = app.test_cli_runner().invoke(args=["db", "migrate"])
+        assert result.exit_code == 0, result.output
+        with app.app_context():
+            assert run_migrations(db.engine) == []
+            assert "upload_sessions" in inspect(db.engine).get_table_names()
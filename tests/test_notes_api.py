@@ -0,0 +1,184 @@
+from datetime import datetime
+
+import pytest
+
+from app import get_db, get_note_cache, get_tag_cache
+from app.jobs import run_due_jobs
+from app.models import Job
+from app.notes import labels
+from app.notes.search import REINDEX_JOB
+
+
+def _create(client, **fields):
+    resp = client.post("/api/notes", json={"title": "t", "content": "body", **fields})
+    assert resp.status_code == 201, resp.json
+    return resp.json["id"]
+
+
+def _note(client, note_id):
+    return next(n for n in client.get("/api/notes?limit=200").json["items"] if n["id"] == note_id)
+
+
+def test_patch_applies_on_current_revision_and_conflicts_on_stale(client):
+    note_id = _create(client)
+    resp = client.patch(f"/api/notes/{note_id}", json={"revision": 1, "content": "new body"})
+    assert resp.status_code == 200
+    assert resp.json["revision"] == 2
+    assert resp.json["changed"] == ["content"]
+
+    resp = client.patch(f"/api/notes/{note_id}", json={"revision": 1, "content": "lost update"})
+    assert resp.status_code == 409
+    assert resp.json["revision"] == 2
+    assert _note(client, note_id)["content"] == "new body"
+
+
+def test_patch_without_changes_keeps_revision(client):
+    note_id = _create(client, tags=["a"])
+    resp = client.patch(f"/api/notes/{note_id}", json={"title": "t", "tags": ["a"]})
+    assert resp.status_code == 200
+    assert resp.json["changed"] == []
+    assert resp.json["revision"] == 1
+
+
+@pytest.mark.parametrize("body", [
+    {"tags": [1]},
+    {"groups": "work"},
+    {"tags": [{"name": "a"}]},
+    {"title": 5},
+    {"revision": "1"},
+])
+def test_invalid_fields_are_rejected(client, body):
+    assert client.post("/api/notes", json={"title": "t", "content": "c", **body}).status_code == 400
+    note_id = _create(client)
+    assert client.patch(f"/api/notes/{note_id}", json=body).status_code == 400
+
+
+@pytest.mark.parametrize("body", [[1, 2], "text"])
+def test_non_object_body_is_rejected(client, body):
+    assert client.post("/api/notes", json=body).status_code == 400
+    note_id = _create(client)
+    assert client.patch(f"/api/notes/{note_id}", json=body).status_code == 400
+
+
+def test_other_users_note_is_not_found(client, make_user, login):
+    note_id = _create(client)
+    other = login(make_user("other@example.com"))
+    assert other.patch(f"/api/notes/{note_id}", json={"content": "x"}).status_code == 404
+    assert other.delete(f"/api/notes/{note_id}").status_code == 404
+    assert _note(client, note_id)["content"] == "body"
+
+
+def _walk(client, q, limit):
+    seen, cursor = [], None
+    while True:
+        url = f"/api/notes?limit={limit}&q={q}" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(url).json
+        cursor = page["next_cursor"]
+        # Only the last page may come back short
+        assert len(page["items"]) == limit or cursor is None
+        seen += [n["id"] for n in page["items"]]
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize("q, limit, expected", [
+    ("zq", 4, 10),        # a search token
+    ("bcd", 3, 6),        # a substring only the post-filter finds
+    ("", 7, 60),
+])
+def test_filtered_listing_returns_full_pages(client, q, limit, expected):
+    ops = [{"op": "create", "title": f"n{i}",
+            "content": ("zq hit" if i % 6 == 0 else "plain") + (" abcdef" if i % 10 == 0 else "")}
+           for i in range(60)]
+    assert client.post("/api/notes/batch", json={"ops": ops}).status_code == 200
+    seen = _walk(client, q, limit)
+    assert len(seen) == len(set(seen)) == expected
+
+
+def _found(client, q):
+    return [n["id"] for n in client.get(f"/api/search?q={q}").json["notes"]]
+
+
+def test_search_finds_created_and_updated_notes(client):
+    note_id = _create(client, title="Shopping", content="milk and bread")
+    assert _found(client, "bread") == [note_id]
+    client.patch(f"/api/notes/{note_id}", json={"content": "eggs"})
+    assert _found(client, "bread") == []
+    assert _found(client, "eggs") == [note_id]
+
+
+@pytest.mark.parametrize("app_config", [{"NOTE_REINDEX_DELAY_SECONDS": 5, "BACKGROUND_WORKERS": False}],
+                         indirect=True)
+def test_without_workers_edits_are_indexed_in_the_request(app, client):
+    note_id = _create(client, content="milk and bread")
+    client.patch(f"/api/notes/{note_id}", json={"content": "eggs"})
+    assert _found(client, "eggs") == [note_id]
+    with app.app_context():
+        assert Job.query.count() == 0
+
+
+@pytest.mark.parametrize("app_config", [{"NOTE_REINDEX_DELAY_SECONDS": 5, "BACKGROUND_WORKERS": True}],
+                         indirect=True)
+def test_edits_waiting_for_reindex_are_found(app, client):
+    note_id = _create(client, content="milk and bread")
+    client.patch(f"/api/notes/{note_id}", json={"content": "eggs and ham"})
+    with app.app_context():
+        assert Job.query.filter_by(kind=REINDEX_JOB).count() == 1
+    assert _found(client, "eggs") == [note_id]
+    assert _found(client, "bread") == []
+    assert [n["id"] for n in client.get("/api/notes?q=ham").json["items"]] == [note_id]
+    with app.app_context():
+        Job.query.update({"run_at": datetime.utcnow()})
+        get_db().session.commit()
+        run_due_jobs()
+    assert _found(client, "eggs") == [note_id]
+
+
+def _cached_notes():
+    return get_note_cache().stats()["entries"]
+
+
+def test_note_cache_drops_updated_and_deleted_notes(client):
+    note_id = _create(client, content="first body")
+    _create(client, content="other body")
+    assert _note(client, note_id)["content"] == "first body"
+    assert _cached_notes() == 2
+
+    client.patch(f"/api/notes/{note_id}", json={"content": "second body"})
+    assert _cached_notes() == 1
+    assert _note(client, note_id)["content"] == "second body"
+    assert _cached_notes() == 2
+
+    assert client.delete(f"/api/notes/{note_id}").status_code == 200
+    assert _cached_notes() == 1
+
+
+def test_note_cache_drops_notes_deleted_in_a_batch(client):
+    ids = [_create(client, content=f"body {i}") for i in range(3)]
+    client.get("/api/notes")
+    assert _cached_notes() == 3
+    resp = client.post("/api/notes/batch", json={"ops": [{"op": "delete", "id": ids[0]}, {"op": "delete", "id": ids[2]}]})
+    assert resp.status_code == 200, resp.json
+    assert _cached_notes() == 1
+
+
+def test_tag_cache_keeps_ids_of_tags_that_outlive_their_notes(client):
+    first = _create(client, tags=["kept"])
+    client.patch(f"/api/notes/{first}", json={"tags": []})
+    client.delete(f"/api/notes/{first}")
+    second = _create(client, tags=["kept", "new"])
+    assert sorted(_note(client, second)["tags"]) == ["kept", "new"]
+    assert [n["id"] for n in client.get("/api/notes?tag=kept").json["items"]] == [second]
+
+
+def test_tag_cache_skips_ids_from_a_rolled_back_transaction(app, db):
+    with app.app_context():
+        labels.resolve_tags(["ghost"])
+        db.session.rollback()
+        assert get_tag_cache().get("ghost") is None
+        # The next committed tag may well get the rolled-back id
+        (real_id,) = labels.resolve_tags(["real"])
+        db.session.commit()
+        assert get_tag_cache().get("real") == real_id
+        assert get_tag_cache().get("ghost") is None
+        assert labels.resolve_tags(["ghost"]) != [real_id]
@@ -0,0 +1,93 @@
+from app.notes import ops
+
+
+def _batch(client, items, status=200):
+    resp = client.post("/api/notes/batch", json={"ops": items})
+    assert resp.status_code == status, resp.json
+    return resp.json.get("results")
+
+
+def _notes(client):
+    return {n["id"]: n for n in client.get("/api/notes?limit=200").json["items"]}
+
+
+def _create(client, count, **fields):
+    results = _batch(client, [{"op": "create", "title": f"n{i}", "content": f"c{i}", **fields} for i in range(count)])
+    return [r["id"] for r in results]
+
+
+def test_mixed_batch_reports_each_item(client, make_user, login):
+    ids = _create(client, 4, tags=["a"], groups=["g"])
+    foreign = login(make_user("other@example.com")).post("/api/notes", json={"title": "x", "content": "y"}).json["id"]
+    results = _batch(client, [
+        {"op": "update", "id": ids[0], "revision": 1, "content": "changed"},
+        {"op": "update", "id": ids[1], "revision": 7, "content": "stale"},
+        {"op": "duplicate", "id": ids[2]},
+        {"op": "delete", "id": ids[3]},
+        {"op": "delete", "id": foreign},
+        {"op": "bogus"},
+    ])
+    assert [r["ok"] for r in results] == [True, False, True, True, False, False]
+    assert results[1]["error"] == "conflict"
+
+    notes = _notes(client)
+    assert notes[ids[0]]["content"] == "changed"
+    assert notes[ids[1]]["content"] == "c1"
+    assert ids[3] not in notes
+    copy = notes[results[2]["id"]]
+    assert copy["tags"] == ["a"] and [g["name"] for g in copy["groups"]] == ["g"]
+
+
+def test_repeated_and_conflicting_moves_do_not_fail_the_batch(client):
+    ids = _create(client, 2, groups=["g"])
+    group_id = client.post("/api/groups", json={"name": "h"}).json["id"]
+    results = _batch(client, [
+        {"op": "move", "id": ids[0], "group_id": group_id},
+        {"op": "move", "id": ids[0], "group_id": group_id},
+        {"op": "move", "id": ids[1], "group_id": group_id},
+        {"op": "move", "id": ids[1], "group_id": None},
+        {"op": "move", "id": ids[1], "group_id": 99999},
+        {"op": "move", "id": ids[1], "group_id": "1"},
+    ])
+    assert [r["ok"] for r in results] == [True, True, True, False, False, False]
+    notes = _notes(client)
+    assert [g["id"] for g in notes[ids[0]]["groups"]] == [group_id]
+    assert [g["id"] for g in notes[ids[1]]["groups"]] == [group_id]
+
+
+def test_invalid_items_are_reported_per_item(client):
+    note_id = _create(client, 1)[0]
+    results = _batch(client, [
+        {"op": "create", "title": "ok", "content": "fine", "tags": ["x"]},
+        {"op": "create", "title": "bad", "tags": [1]},
+        {"op": "create", "title": 5},
+        {"op": "update", "id": note_id, "groups": [None]},
+        {"op": "update", "id": [note_id], "content": "x"},
+        {"op": "delete", "id": True},
+        5,
+    ])
+    assert [r["ok"] for r in results] == [True, False, False, False, False, False, False]
+    assert len(_notes(client)) == 2
+
+
+def test_batch_size_is_limited(client):
+    _batch(client, [{"op": "create", "title": "x"}] * (ops.BATCH_MAX + 1), status=400)
+    assert client.post("/api/notes/batch", json={}).status_code == 400
+    assert client.post("/api/notes/batch", json=[]).status_code == 400
+
+
+def test_export_import_round_trip(client, make_user, login):
+    _create(client, 3, tags=["a", "b"], groups=["g"])
+    resp = client.get("/api/notes/export")
+    assert resp.status_code == 200
+    lines = resp.get_data(as_text=True).splitlines()
+    assert len(lines) == 3
+
+    other = login(make_user("other@example.com"))
+    body = "\n".join(lines + ["not json", "[1]", '{"title": "x", "tags": [2]}', ""])
+    result = other.post("/api/notes/import", data=body.encode(), content_type="application/x-ndjson").json
+    assert result["imported"] == 3
+    assert len(result["errors"]) == 3
+    imported = sorted(_notes(other).values(), key=lambda n: n["title"])
+    assert [(n["title"], n["content"], sorted(n["tags"])) for n in imported] == \
+        [(f"n{i}", f"c{i}", ["a", "b"]) for i in range(3)]
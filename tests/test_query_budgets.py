@@ -0,0 +1,43 @@
+from collections import Counter
+
+import pytest
+
+from app.perf import LISTING_QUERY_BUDGET, _listing_counts, count_queries
+
+
+def test_listing_queries_stay_within_budget(app):
+    small = _listing_counts(app, 3)
+    large = _listing_counts(app, 25)
+    for url, budget in LISTING_QUERY_BUDGET.items():
+        assert small[url] == large[url], url
+        assert large[url] <= budget, url
+
+
+def _batch_statements(app, db, client, size):
+    # Fresh tag and group names per run, so both runs create their labels
+    ops = [{"op": "create", "title": f"n{i}", "content": f"hello {i}",
+            "tags": [f"{size}-a", f"{size}-t{i % 3}"], "groups": [f"{size}-g"]}
+           for i in range(size)]
+    with app.app_context():
+        engine = db.engine
+    client.get("/api/notes?limit=1")  # loads the user into the identity cache
+    with count_queries(engine) as counter:
+        resp = client.post("/api/notes/batch", json={"ops": ops})
+    assert resp.status_code == 200
+    assert all(r["ok"] for r in resp.json["results"])
+    # SQLite inserts notes one row at a time; everything else is batched
+    return Counter(s.split()[0] for s in counter.statements if not s.startswith("INSERT INTO notes "))
+
+
+def test_batch_create_statements_do_not_grow_with_items(app, db, client):
+    assert _batch_statements(app, db, client, 5) == _batch_statements(app, db, client, 40)
+
+
+@pytest.mark.parametrize("url", ["/api/notes?limit=50", "/drive/api/files?per_page=50"])
+def test_repeated_listing_is_cheap(app, db, client, url):
+    with app.app_context():
+        engine = db.engine
+    client.get(url)
+    with count_queries(engine) as counter:
+        assert client.get(url).status_code == 200
+    assert counter.count <= 5
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from app import get_db
+from app.perf import count_queries
+
+LIMITED = {"RATE_LIMITS_ENABLED": True, "RATE_LIMITS": {"login": "2/minute", "search": "3/minute"}}
+
+
+def _login(client, ip=None):
+    headers = {"X-Forwarded-For": ip} if ip else {}
+    return client.post("/auth/login", data={"email": "x@example.com", "password": "x"}, headers=headers)
+
+
+@pytest.mark.parametrize("app_config", [LIMITED], indirect=True)
+def test_limit_returns_429_with_retry_after(app):
+    client = app.test_client()
+    assert [_login(client).status_code for _ in range(2)] == [302, 302]
+    resp = _login(client)
+    assert resp.status_code == 429
+    assert 0 < int(resp.headers["Retry-After"]) <= 60
+
+
+@pytest.mark.parametrize("app_config", [LIMITED], indirect=True)
+def test_per_user_limits_are_separate(app, make_user, login):
+    first, second = login(make_user("a@example.com")), login(make_user("b@example.com"))
+    assert [first.get("/api/search?q=abc").status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert first.get("/api/search?q=abc").json["error"]
+    assert second.get("/api/search?q=abc").status_code == 200
+
+
+@pytest.mark.parametrize("app_config", [LIMITED], indirect=True)
+def test_forwarded_for_is_ignored_without_proxy_fix(app):
+    client = app.test_client()
+    codes = [_login(client, f"10.0.0.{i}").status_code for i in range(3)]
+    assert codes == [302, 302, 429]
+
+
+@pytest.mark.parametrize("app_config", [{**LIMITED, "PROXY_FIX_X_FOR": 1}], indirect=True)
+def test_proxy_fix_limits_each_forwarded_client(app):
+    client = app.test_client()
+    assert [_login(client, f"10.0.0.{i}").status_code for i in range(3)] == [302, 302, 302]
+    assert [_login(client, "10.0.0.9").status_code for _ in range(3)] == [302, 302, 429]
+
+
+def test_workers_sharing_the_database_share_limits(make_app, tmp_path):
+    uri = f"sqlite:///{tmp_path / 'shared.db'}"
+    config = {**LIMITED, "STATE_STORE_URL": "database://"}
+    with make_app(uri, **config) as first, make_app(uri, **config) as second:
+        assert _login(first.test_client()).status_code == 302
+        assert _login(second.test_client()).status_code == 302
+        assert _login(first.test_client()).status_code == 429
+
+
+@pytest.mark.parametrize("app_config", [{**LIMITED, "STATE_STORE_URL": "database://"}], indirect=True)
+def test_search_is_counted_in_process_memory(app, client):
+    with app.app_context():
+        engine = get_db().engine
+    with count_queries(engine) as counter:
+        assert [client.get("/api/search?q=abc").status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert not [s for s in counter.statements if "state_entries" in s]
+    assert _login(app.test_client()).status_code == 302
+    with app.app_context():
+        assert get_db().session.execute(get_db().text("SELECT count(*) FROM state_entries")).scalar() == 1
+
+
+@pytest.mark.parametrize("app_config", [LIMITED], indirect=True)
+def test_rejected_requests_are_counted(app, monkeypatch):
+    now = [1_000_040.0]  # a third into a minute window
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    client = app.test_client()
+    assert [_login(client).status_code for _ in range(4)] == [302, 302, 429, 429]
+    # Two thirds into the next window all 4 still weigh 4/3; without the rejected ones it would pass
+    now[0] += 80
+    assert _login(client).status_code == 429
+
+
+@pytest.mark.parametrize("endpoint, name", [
+    ("notes.api_search", "search"),
+    ("notes.batch_notes", "notes-batch"),
+    ("drive.upload_file", "drive-upload"),
+    ("drive.init_upload", "drive-upload"),
+    ("drive.upload_chunk", "drive-chunk"),
+])
+def test_limits_are_seen_through_login_required(app, endpoint, name):
+    assert name in [limit[0] for limit in getattr(app.view_functions[endpoint], "rate_limits", ())]
@@ -0,0 +1,97 @@
+import hashlib
+import os
+
+import pytest
+
+CHUNK = 1024 * 1024
+DATA = os.urandom(2 * CHUNK + 1000)
+
+
+@pytest.fixture
+def app_config():
+    return {"DRIVE_UPLOAD_CHUNK_MB": 1}
+
+
+def _start(client, data=DATA, **fields):
+    resp = client.post("/drive/api/uploads", json={"filename": "big.bin.zip", "size": len(data), **fields})
+    assert resp.status_code == 201, resp.json
+    return resp.json
+
+
+def _put(client, session_id, index, body, checksum=None):
+    headers = {"X-Chunk-Sha256": checksum} if checksum else {}
+    return client.put(f"/drive/api/uploads/{session_id}/chunks/{index}", data=body, headers=headers)
+
+
+def _chunk(index, data=DATA):
+    return data[index * CHUNK:(index + 1) * CHUNK]
+
+
+def test_chunks_in_any_order_assemble_the_file(client):
+    session = _start(client, sha256=hashlib.sha256(DATA).hexdigest())
+    assert (session["chunk_size"], session["total_chunks"], session["received"]) == (CHUNK, 3, [])
+    for index in (2, 0, 1):
+        body = _chunk(index)
+        resp = _put(client, session["id"], index, body, hashlib.sha256(body).hexdigest())
+        assert resp.status_code == 200, resp.json
+    assert client.get(f"/drive/api/uploads/{session['id']}").json["received"] == [0, 1, 2]
+
+    resp = client.post(f"/drive/api/uploads/{session['id']}/complete")
+    assert resp.status_code == 201
+    assert resp.json["size"] == len(DATA)
+    assert client.get(f"/drive/api/files/{resp.json['id']}").data == DATA
+    assert client.get(f"/drive/api/uploads/{session['id']}").status_code == 404
+
+
+def test_missing_chunks_block_completion(client):
+    session = _start(client)
+    _put(client, session["id"], 1, _chunk(1))
+    resp = client.post(f"/drive/api/uploads/{session['id']}/complete")
+    assert resp.status_code == 409
+    assert resp.json["missing"] == [0, 2]
+
+
+def test_bad_chunks_are_rejected(client):
+    session = _start(client)
+    assert _put(client, session["id"], 0, _chunk(0)[:-1]).status_code == 400
+    assert _put(client, session["id"], 2, _chunk(2) + b"x").status_code == 400
+    assert _put(client, session["id"], 3, b"x").status_code == 400
+    assert _put(client, session["id"], 0, _chunk(0), "0" * 64).status_code == 400
+    assert client.get(f"/drive/api/uploads/{session['id']}").json["received"] == []
+
+
+def test_whole_file_checksum_is_verified(client):
+    session = _start(client, sha256="0" * 64)
+    for index in range(3):
+        _put(client, session["id"], index, _chunk(index))
+    resp = client.post(f"/drive/api/uploads/{session['id']}/complete")
+    assert resp.status_code == 400
+    assert client.get("/drive/api/files").json["files"] == []
+
+
+@pytest.mark.parametrize("body", [
+    {"size": 10},
+    {"filename": 5, "size": 10},
+    {"filename": "a.txt"},
+    {"filename": "a.txt", "size": -1},
+    {"filename": "a.txt", "size": True},
+    {"filename": "a.txt", "size": 10, "sha256": 1},
+    {"filename": "a.txt", "size": 10, "folder_id": "1"},
+    [1],
+    "text",
+])
+def test_invalid_sessions_are_rejected(client, body):
+    assert client.post("/drive/api/uploads", json=body).status_code == 400
+
+
+def test_disallowed_extension_is_rejected(client):
+    assert client.post("/drive/api/uploads", json={"filename": "a.exe", "size": 10}).status_code == 415
+
+
+def test_sessions_are_private(client, make_user, login):
+    session = _start(client)
+    other = login(make_user("other@example.com"))
+    assert other.get(f"/drive/api/uploads/{session['id']}").status_code == 404
+    assert _put(other, session["id"], 0, _chunk(0)).status_code == 404
+    assert other.delete(f"/drive/api/uploads/{session['id']}").status_code == 404
+    assert client.delete(f"/drive/api/uploads/{session['id']}").status_code == 200
@@ -0,0 +1,155 @@
+import time
+
+import pytest
+from sqlalchemy import create_mock_engine
+
+from app.auth.routes import _otp_keys
+from app.config import Config
+from app.models import User
+from app.perf import count_queries
+from app.state import DatabaseStateStore, MemoryStateStore, RedisStateStore, get_state_store
+
+
+class FakeRedis:
+    """The few redis-py calls RedisStateStore makes, in memory."""
+
+    def __init__(self):
+        self.data = {}
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            entry = None
+        return entry
+
+    def get(self, key):
+        entry = self._live(key)
+        return entry[0] if entry else None
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, None if ex is None else time.time() + ex)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def incr(self, key):
+        entry = self._live(key)
+        value = int(entry[0]) + 1 if entry else 1
+        self.data[key] = (str(value), entry[1] if entry else None)
+        return value
+
+    def expire(self, key, seconds):
+        if self._live(key):
+            self.data[key] = (self.data[key][0], time.time() + seconds)
+
+    def ttl(self, key):
+        entry = self._live(key)
+        if entry is None:
+            return -2
+        return -1 if entry[1] is None else int(entry[1] - time.time())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Frozen time.time and time.monotonic; advance with clock.advance(seconds)."""
+    class Clock:
+        now = 1_000_000.0
+
+        def advance(self, seconds):
+            self.now += seconds
+
+    c = Clock()
+    monkeypatch.setattr(time, "time", lambda: c.now)
+    monkeypatch.setattr(time, "monotonic", lambda: c.now)
+    return c
+
+
+@pytest.fixture(params=["memory", "database", "redis"])
+def store(request, app, db):
+    if request.param == "memory":
+        yield MemoryStateStore()
+    elif request.param == "database":
+        with app.app_context():
+            yield DatabaseStateStore(db.engine)
+    else:
+        yield RedisStateStore("redis://stand-in", client=FakeRedis())
+
+
+def test_set_get_delete(store):
+    assert store.get("k") is None and store.ttl("k") is None
+    store.set("k", "abc", 60)
+    assert store.get("k") == "abc"
+    assert 59 <= store.ttl("k") <= 60
+    store.set("k", "def", 60)
+    assert store.get("k") == "def"
+    store.delete("k", "missing")
+    assert store.get("k") is None
+
+
+def test_incr_counts_within_the_first_window(store, clock):
+    assert [store.incr("c", 60) for _ in range(3)] == [1, 2, 3]
+    clock.advance(30)
+    assert store.incr("c", 60) == 4
+    assert 29 <= store.ttl("c") <= 30
+    clock.advance(31)
+    assert store.get("c") is None
+    assert store.incr("c", 60) == 1
+
+
+def test_values_expire(store, clock):
+    store.set("k", "v", 10)
+    clock.advance(9)
+    assert store.get("k") == "v"
+    clock.advance(2)
+    assert store.get("k") is None and store.ttl("k") is None
+
+
+def test_default_store_is_process_memory(make_app):
+    with make_app(STATE_STORE_URL=Config.STATE_STORE_URL) as app:
+        with app.app_context():
+            assert isinstance(get_state_store(), MemoryStateStore)
+
+
+def test_database_incr_is_one_statement(app, db):
+    with app.app_context():
+        store = DatabaseStateStore(db.engine)
+        store.incr("c", 60)
+        with count_queries(db.engine) as counter:
+            assert store.incr("c", 60) == 2
+    assert len(counter.statements) == 1
+
+
+def test_otp_issued_by_one_worker_verifies_on_another(make_app, db, tmp_path):
+    uri = f"sqlite:///{tmp_path / 'shared.db'}"
+    with make_app(uri, STATE_STORE_URL="database://") as first, make_app(uri, STATE_STORE_URL="database://") as second:
+        with first.app_context():
+            user = User(email="user@example.com")
+            user.set_password("secret")
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+
+        resp = first.test_client().post("/auth/login", data={"email": "user@example.com", "password": "secret"})
+        assert "/auth/verify" in resp.headers["Location"]
+        with first.app_context():
+            code = get_state_store().get(_otp_keys(user_id)[0])
+        assert code
+
+        resp = second.test_client().post("/auth/verify", data={"email": "user@example.com", "code": code})
+        assert resp.headers["Location"] == "/"
+        with second.app_context():
+            assert get_state_store().get(_otp_keys(user_id)[0]) is None
+
+
+def test_database_store_rejects_dialects_without_upsert():
+    engine = create_mock_engine("mysql://", lambda *args, **kwargs: None)
+    with pytest.raises(RuntimeError, match="redis://"):
+        DatabaseStateStore(engine)
+
+
+def test_unusable_store_url_fails_at_startup(make_app):
+    with pytest.raises(RuntimeError, match="STATE_STORE_URL"):
+        with make_app(STATE_STORE_URL="memcached://localhost"):
+            pass
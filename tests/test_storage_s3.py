@@ -0,0 +1,111 @@
+import hashlib
+import io
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app.blobs import blob_key, purge_pending
+from app.storage.s3 import S3Storage
+
+DATA = b"object storage bytes"
+
+
+class ClientError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = {"ResponseMetadata": {"HTTPStatusCode": status}}
+
+
+class FakeS3:
+    """The boto3 S3 client calls S3Storage makes, over a dict."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key):
+        with open(filename, "rb") as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError(404)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError(404)
+        return {"ContentLength": len(self.objects[(Bucket, Key)]),
+                "LastModified": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        query = "&".join(f"{k}={v}" for k, v in Params.items() if k not in ("Bucket", "Key"))
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}&{query}"
+
+
+@pytest.fixture
+def s3(app):
+    client = FakeS3()
+    app.extensions["storage"] = S3Storage("bucket", prefix="drive/", client=client, legacy_root=app.config["UPLOAD_FOLDER"])
+    return client
+
+
+def test_storage_round_trip(s3, tmp_path):
+    storage = S3Storage("bucket", prefix="p", client=s3)
+    local = tmp_path / "upload"
+    local.write_bytes(DATA)
+    storage.put_file("blobs/x", str(local))
+    assert not local.exists()
+    assert s3.objects == {("bucket", "p/blobs/x"): DATA}
+    assert storage.open("blobs/x").read() == DATA
+    assert storage.stat("blobs/x").size == len(DATA)
+    assert storage.stat("blobs/x").modified == datetime(2024, 1, 1)
+    assert storage.local_path("blobs/x") is None
+    storage.delete("blobs/x")
+    assert storage.stat("blobs/x") is None and not storage.exists("blobs/x")
+
+
+def test_stat_raises_other_errors():
+    class Broken(FakeS3):
+        def head_object(self, Bucket, Key):
+            raise ClientError(403)
+
+    with pytest.raises(ClientError):
+        S3Storage("bucket", client=Broken()).stat("blobs/x")
+
+
+def test_drive_files_live_in_the_bucket(app, s3, client):
+    resp = client.post("/drive/api/files", data={"file": (io.BytesIO(DATA), "a.txt")},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 201
+    file_id = resp.json["id"]
+    key = blob_key(hashlib.sha256(DATA).hexdigest())
+    assert s3.objects == {("bucket", f"drive/{key}"): DATA}
+
+    resp = client.get(f"/drive/api/files/{file_id}")
+    assert resp.status_code == 302
+    url = urlsplit(resp.headers["Location"])
+    assert url.path == f"/bucket/drive/{key}"
+    assert parse_qs(url.query)["ResponseContentType"] == ["text/plain"]
+    assert resp.headers["Cache-Control"] == "private, no-store"
+
+    client.delete(f"/drive/api/files/{file_id}")
+    with app.app_context():
+        purge_pending(grace_seconds=0)
+    assert s3.objects == {}
+
+
+@pytest.mark.parametrize("app_config", [{"DRIVE_UPLOAD_CHUNK_MB": 1}], indirect=True)
+def test_resumable_chunks_go_through_the_bucket(app, s3, client):
+    data = b"x" * (1024 * 1024) + b"tail"
+    session = client.post("/drive/api/uploads", json={"filename": "big.txt", "size": len(data)}).json
+    client.put(f"/drive/api/uploads/{session['id']}/chunks/1", data=b"tail")
+    assert client.get(f"/drive/api/uploads/{session['id']}").json["received"] == [1]
+    client.put(f"/drive/api/uploads/{session['id']}/chunks/0", data=data[:1024 * 1024])
+    assert client.post(f"/drive/api/uploads/{session['id']}/complete").status_code == 201
+    with app.app_context():
+        purge_pending(grace_seconds=0)
+    assert list(s3.objects.values()) == [data]
@@ -0,0 +1,104 @@
+import io
+import os
+
+import pytest
+
+from app.blobs import blob_tmp_dir
+
+MB = 1024 * 1024
+BOUNDARY = "upload-test-boundary"
+
+
+class CountingStream(io.BytesIO):
+    """Request body that remembers how much of it the server actually read."""
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.consumed += len(chunk)
+        return chunk
+
+    def readinto(self, buffer):
+        n = super().readinto(buffer)
+        self.consumed += n
+        return n
+
+    def readline(self, size=-1):
+        line = super().readline(size)
+        self.consumed += len(line)
+        return line
+
+
+def _multipart(filename: str, data: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def _post(client, filename, data, declare_length=True):
+    body = CountingStream(_multipart(filename, data))
+    environ = {} if declare_length else {"CONTENT_LENGTH": "", "wsgi.input_terminated": True}
+    resp = client.post(
+        "/drive/api/files",
+        input_stream=body,
+        content_type=f"multipart/form-data; boundary={BOUNDARY}",
+        content_length=len(body.getvalue()) if declare_length else None,
+        environ_overrides=environ,
+    )
+    return resp, body
+
+
+def _spooled(app):
+    with app.app_context():
+        tmp_dir = blob_tmp_dir()
+    return os.listdir(tmp_dir) if os.path.isdir(tmp_dir) else []
+
+
+@pytest.mark.parametrize("app_config", [{"MAX_FILE_SIZE_MB": 1}], indirect=True)
+def test_declared_oversize_is_rejected_before_the_body_is_read(app, client):
+    resp, body = _post(client, "big.txt", b"x" * (4 * MB))
+    assert resp.status_code == 413
+    assert resp.json == {"error": "file too large"}
+    assert body.consumed < MB
+    assert _spooled(app) == []
+
+
+@pytest.mark.parametrize("app_config", [{"MAX_FILE_SIZE_MB": 1}], indirect=True)
+def test_undeclared_oversize_is_cut_off_at_the_limit(app, client):
+    resp, body = _post(client, "big.txt", b"x" * (4 * MB), declare_length=False)
+    assert resp.status_code == 413
+    assert MB < body.consumed < 2 * MB
+    assert _spooled(app) == []
+
+
+def test_disallowed_type_is_rejected_before_spooling(app, client):
+    resp, body = _post(client, "tool.exe", b"x" * MB)
+    assert resp.status_code == 415
+    assert resp.json == {"error": "type not allowed"}
+    assert body.consumed < MB
+    assert _spooled(app) == []
+
+
+@pytest.mark.parametrize("app_config", [{"DEFAULT_USER_FILE_QUOTA_MB": 1}], indirect=True)
+def test_size_quota_counts_what_is_already_stored(app, client):
+    resp, _ = _post(client, "first.txt", b"a" * (MB // 2 + 1))
+    assert resp.status_code == 201
+    resp, _ = _post(client, "second.txt", b"b" * (MB // 2 + 1), declare_length=False)
+    assert resp.status_code == 403
+    assert resp.json == {"error": "size quota exceeded"}
+    assert client.get("/drive/api/files").json["usage"] == {"count": 1, "bytes": MB // 2 + 1}
+    assert _spooled(app) == []
+
+
+def test_count_quota_is_per_user(app, make_user, login):
+    client = login(make_user("limited@example.com", file_quota_count=1))
+    assert _post(client, "one.txt", b"1")[0].status_code == 201
+    resp, _ = _post(client, "two.txt", b"2")
+    assert resp.status_code == 403
+    assert resp.json == {"error": "count quota exceeded"}
+    assert _spooled(app) == []